@@ -105,12 +105,13 @@ def api_v1():
 @manager.command
 def initjobs():
     """Initialize default jobs."""""
-    logger.debug("Initializing default jobs")
-    Scheduler.register_default_jobs(defaults.DEFAULT_JOB_DIR)
-    logger.debug("Default jobs initialized")
     logger.debug("Initializing DB for tokens")
     create_models()
     logger.debug("DB for tokens initialized")
+    logger.debug("Initializing default jobs")
+    Scheduler.register_default_jobs(defaults.DEFAULT_JOB_DIR)
+    logger.debug("Default jobs initialized")
+    Scheduler.migrate_failed_jobs()
     user_cache.create_cache()
     logger.debug("user cache is created")
 
@@ -122,9 +123,9 @@ def runserver():
     # The Flasks's runserver command was overwritten because we are using connexion.
     #
     # Make sure that you do not run the application with multiple processes since we would
-    # have multiple scheduler instances. If you would like to do so, just create one scheduler
-    # that would serve jobs and per-process scheduler would be in paused mode
-    # just for creating/listing jobs.
+    # have multiple scheduler instances, unless leader election is turned on
+    # (JOB_SERVICE_LEADER_ELECTION) - in that case only the elected process executes jobs and
+    # per-process schedulers of other processes are in paused mode just for creating/listing jobs.
     app.run(
         port=os.environ.get('JOB_SERVICE_PORT', defaults.DEFAULT_SERVICE_PORT),
         server='flask',
@@ -1,10 +1,9 @@
 """Module with functions to generate analyses state report."""
 
 from datetime import datetime
-from selinon import StoragePool
 from sqlalchemy.exc import SQLAlchemyError
 from f8a_worker.models import WorkerResult, Analysis, Package, Version, Ecosystem
-from f8a_worker.setup_celery import init_celery
+from f8a_jobs.handlers.base import HANDLER_CONTEXT
 
 
 def _add_query_datetime_constrains(query, from_date, to_date):
@@ -96,8 +95,8 @@ def construct_analyses_report(ecosystem, from_date=None, to_date=None):
     # TODO: init only Selinon
     # there is required only Selinon configuration, we don't need to connect to queues,
     # but let's stick with this for now
-    init_celery(result_backend=False)
-    db = StoragePool.get_connected_storage('BayesianPostgres')
+    HANDLER_CONTEXT.setup()
+    db = HANDLER_CONTEXT.get_storage('BayesianPostgres')
 
     finished_analyses = _get_finished_analyses_count(db, ecosystem, from_date, to_date)
     unfinished_analyses = _get_unfinished_analyses_count(db, ecosystem, from_date, to_date)
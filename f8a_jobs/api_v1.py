@@ -4,25 +4,29 @@
 
 import traceback
 import logging
+import json
+from itertools import chain, islice
 import requests
 from apscheduler.schedulers.base import STATE_STOPPED, JobLookupError
-from flask import session, url_for, request
+from flask import session, url_for, request, Response
 from selinon import StoragePool
 
 import f8a_jobs.handlers as handlers
 from f8a_jobs.handlers.base import BaseHandler
-from f8a_jobs.utils import (get_service_state_str, get_job_state_str, job2raw_dict, is_failed_job,
+from f8a_jobs.utils import (get_service_state_str, get_job_state_str, job2raw_dict,
                             requires_auth, is_organization_member)
-from f8a_jobs.scheduler import uses_scheduler, ScheduleJobError, Scheduler
+from f8a_jobs.scheduler import (uses_scheduler, reads_scheduler, ScheduleJobError,
+                                BulkScheduleJobError, Scheduler)
 from f8a_jobs.analyses_report import construct_analyses_report
 from f8a_jobs.utils import construct_queue_attributes
 from f8a_jobs.utils import purge_queues
 from f8a_jobs.utils import parse_dates
 from f8a_jobs.auth import github
-from f8a_jobs.models import JobToken
+from f8a_jobs.models import JobToken, FailedJob
 from f8a_jobs.defaults import AUTH_ORGANIZATION
 import f8a_jobs.defaults as configuration
 from f8a_jobs import graph_sync
+from f8a_jobs import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -82,16 +86,25 @@ def authorized():
 
 
 @requires_auth
-@uses_scheduler
+@reads_scheduler
 def get_service_state(scheduler):
     """Return the current state of the job service."""
-    return {"state": get_service_state_str(scheduler)}, 200
+    response = {"state": get_service_state_str(scheduler)}
+    is_leader = Scheduler.is_leader()
+    if is_leader is not None:
+        response['leader'] = is_leader
+    return response, 200
 
 
 @requires_auth
 @uses_scheduler
 def put_service_state(scheduler, state):
     """Change the state of the job service."""
+    if Scheduler.is_leader() is False:
+        # resuming scheduler in a follower process would execute jobs in multiple processes
+        return {"error": "This process is not the leader of the job service, "
+                         "its state cannot be changed"}, 409
+
     if scheduler.state == STATE_STOPPED:
         scheduler.start(paused=(state == 'paused'))
 
@@ -120,12 +133,29 @@ def delete_jobs(scheduler, job_id):
 @uses_scheduler
 def delete_clean_failed(scheduler):
     """Clean up all failed jobs."""
+    failures_removed = FailedJob.clean()
+
+    # failures recorded as ErrorHandler jobs by previous versions, if not migrated yet
     ret = []
-    for job in scheduler.get_jobs():
-        if is_failed_job(job):
-            ret.append(job.id)
-            job.remove()
-    return {'removed': ret}, 200
+    failed_jobs, _ = Scheduler.get_job_index().list(job_type='failed')
+    for job in failed_jobs:
+        try:
+            scheduler.remove_job(job['job_id'])
+        except JobLookupError:
+            # already removed, e.g. by another process
+            continue
+        ret.append(job['job_id'])
+    return {'removed': ret, 'failures_removed': failures_removed}, 200
+
+
+@requires_auth
+def get_jobs_failures(handler=None, offset=0, limit=None):
+    """Retrieve recorded job failures, the most recent first."""
+    if offset < 0 or (limit is not None and limit < 0):
+        return {"error": "Offset and limit cannot be negative"}, 400
+
+    failures = FailedJob.list(handler=handler, offset=offset, limit=limit)
+    return {"failures": failures, "failures_count": len(failures), "offset": offset}, 200
 
 
 @requires_auth
@@ -146,27 +176,39 @@ def put_jobs(scheduler, job_id, state):
 
 
 @requires_auth
-@uses_scheduler
-def get_jobs(scheduler, job_type=None):
+def get_jobs(job_type=None, handler=None, job_state=None, offset=0, limit=None):
     """Retrieve all active jobs or all jobs of specified type."""
-    jobs = scheduler.get_jobs()
+    if offset < 0 or (limit is not None and limit < 0):
+        return {"error": "Offset and limit cannot be negative"}, 400
+
+    try:
+        job_list, has_more = Scheduler.get_job_index().list(handler=handler,
+                                                            state=job_state,
+                                                            job_type=job_type,
+                                                            offset=offset,
+                                                            limit=limit)
+    except ValueError as exc:
+        return {"error": str(exc)}, 400
+
+    response = {"jobs": job_list, "jobs_count": len(job_list), "offset": offset}
+    if has_more:
+        response['next_offset'] = offset + len(job_list)
+
+    return response, 200
 
-    job_types = ('all', 'failed', 'user', None)
-    if job_type not in job_types:
-        return {"error": "Unknown job type filtering supplied: '%s', should be one of %s" %
-                (job_type, job_types)}, 400
 
-    job_list = []
-    job_type = job_type or 'all'
-    for job in jobs:
-        if job_type == 'failed' and is_failed_job(job):
-            job_list.append(job2raw_dict(job))
-        if job_type == 'user' and not is_failed_job(job):
-            job_list.append(job2raw_dict(job))
-        if job_type == 'all':
-            job_list.append(job2raw_dict(job))
+def get_metrics():
+    """Get job service metrics in Prometheus text format.
 
-    return {"jobs": job_list, "jobs_count": len(job_list)}, 200
+    Metrics are kept per process and jobs are run only by the leader, other processes report
+    just that they are not the leader so metrics of a random process are never scraped.
+    """
+    # the process is the only one running jobs if leader election is not turned on
+    is_leader = Scheduler.is_leader() is not False
+    metrics.LEADER.set(int(is_leader))
+    const_labels = {'leader': str(is_leader).lower()}
+    text = metrics.render(None if is_leader else [metrics.LEADER], const_labels)
+    return text, 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 
 def get_readiness():
@@ -174,7 +216,7 @@ def get_readiness():
     return {}, 200
 
 
-@uses_scheduler
+@reads_scheduler
 def get_liveness(scheduler):
     """Get job service liveness."""
     handlers.FlowScheduling(job_id=None).execute('livenessFlow', flow_arguments=[None])
@@ -194,6 +236,57 @@ def post_schedule_job(scheduler, handler_name, **kwargs):
         return {"error": str(exc)}, 400
 
 
+def post_estimate_job(handler_name, dry_run, **kwargs):
+    """Estimate number of flows the job specified by its name and parameters would dispatch."""
+    # No need to add @requires_auth for this one, assuming handler specific
+    # POST endpoints take care of it
+    try:
+        kwargs.update(kwargs.pop('kwargs', {}))
+        estimate = Scheduler.estimate_job_flows(handler_name, explain=(dry_run == 'explain'),
+                                                **kwargs)
+    except Exception as exc:
+        logger.exception(str(exc))
+        return {"error": str(exc)}, 400
+
+    if estimate is None:
+        return {"error": "Handler '%s' does not support dry run" % handler_name}, 400
+
+    return {"handler": handler_name, "dry_run": dry_run, "flows": estimate._asdict()}, 200
+
+
+def post_schedule_or_estimate_job(handler_name, dry_run=None, **kwargs):
+    """Schedule the job or, on dry run, only estimate number of flows it would dispatch.
+
+    Counting rows matched by filters can take a while, the scheduler lock is not held for it.
+    """
+    if dry_run:
+        return post_estimate_job(handler_name, dry_run, **kwargs)
+    return uses_scheduler(post_schedule_job)(handler_name, **kwargs)
+
+
+@requires_auth
+@uses_scheduler
+def post_jobs_bulk(scheduler, jobs_bulk):
+    """Schedule multiple jobs at once, all jobs are stored in a single transaction."""
+    try:
+        result = Scheduler.schedule_jobs_bulk(scheduler, jobs_bulk['jobs'],
+                                              replace_existing=jobs_bulk.get('replace_existing',
+                                                                             False))
+    except BulkScheduleJobError as exc:
+        return {"error": str(exc), "errors": exc.errors}, 400
+    except ScheduleJobError as exc:
+        return {"error": str(exc)}, 400
+
+    jobs = []
+    for job, status in result:
+        entry = {"job_id": job.id, "status": status}
+        if status != 'exists':
+            entry['job'] = job2raw_dict(job)
+        jobs.append(entry)
+
+    return {"jobs": jobs, "jobs_count": len(jobs)}, 201
+
+
 @requires_auth
 def post_show_select_query(filter_definition):
     """Show SQL query that will be used in case of filter parametrized jobs."""
@@ -207,17 +300,57 @@ def post_show_select_query(filter_definition):
     return {"query": query}, 200
 
 
+@requires_auth
+def post_explain_select_query(filter_definition):
+    """Show SQL query of the given filter together with its execution plan."""
+    try:
+        from json2sql.select import DEFAULT_FILTER_KEY
+        handler = BaseHandler(job_id=None)
+        query = handler.construct_select_query(filter_definition.pop(DEFAULT_FILTER_KEY))
+        plan = handler.explain_select_query(query)
+    except Exception as exc:
+        logger.exception(str(exc))
+        return {"error": str(exc), "traceback": traceback.format_exc()}, 400
+    return {"query": query, "plan": plan}, 200
+
+
 @requires_auth
 def post_expand_filter_query(filter_definition):
     """Use filter to query database and show results that matched given filter."""
     try:
-        matched = BaseHandler(job_id=None).expand_filter_query(filter_definition)
+        matched = list(BaseHandler(job_id=None).expand_filter_query(filter_definition))
     except Exception as exc:
         logger.exception(str(exc))
         return {"error": str(exc), "traceback": traceback.format_exc()}, 400
     return {"matched": matched}, 200
 
 
+@requires_auth
+def post_expand_filter_query_stream(filter_definition, limit=None):
+    """Stream records that matched given filter as JSON lines, at most limit records."""
+    max_limit = configuration.EXPAND_FILTER_QUERY_STREAM_LIMIT
+    limit = min(limit, max_limit) if limit else max_limit
+    try:
+        matched = BaseHandler(job_id=None).expand_filter_query(filter_definition)
+        # run the query before streaming starts so errors are reported with a proper status
+        first = next(matched, None)
+    except Exception as exc:
+        logger.exception(str(exc))
+        return {"error": str(exc), "traceback": traceback.format_exc()}, 400
+
+    def generate():
+        try:
+            if first is None:
+                return
+            for record in islice(chain((first,), matched), limit):
+                yield json.dumps(record, default=str) + '\n'
+        finally:
+            # release the server-side cursor also if the client disconnects or limit is reached
+            matched.close()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
 @requires_auth
 def get_analyses_report(**kwargs):
     """View brief report of the current system analyses status."""
@@ -257,22 +390,19 @@ def get_gh_tokens_rate_limits():
 
 
 @requires_auth
-@uses_scheduler
-def post_flow_scheduling(scheduler, **kwargs):
+def post_flow_scheduling(**kwargs):
     """Schedule the job with configuration based on the JSON structure send via request."""
-    return post_schedule_job(scheduler, handlers.FlowScheduling.__name__, **kwargs)
+    return post_schedule_or_estimate_job(handlers.FlowScheduling.__name__, **kwargs)
 
 
 @requires_auth
-@uses_scheduler
-def post_selective_flow_scheduling(scheduler, **kwargs):
+def post_selective_flow_scheduling(**kwargs):
     """Schedule the job with configuration based on the JSON structure send via request."""
-    return post_schedule_job(scheduler, handlers.SelectiveFlowScheduling.__name__, **kwargs)
+    return post_schedule_or_estimate_job(handlers.SelectiveFlowScheduling.__name__, **kwargs)
 
 
 @requires_auth
-@uses_scheduler
-def post_analyses(scheduler, **kwargs):
+def post_analyses(**kwargs):
     """Schedule the job to run analysis for selected ecosystem."""
     try:
         handlers.base.AnalysesBaseHandler.check_arguments(**kwargs)
@@ -280,7 +410,7 @@ def post_analyses(scheduler, **kwargs):
         return {"error": str(exc)}, 400
 
     handler_name = handlers.base.AnalysesBaseHandler.ecosystem2handler_name(kwargs['ecosystem'])
-    return post_schedule_job(scheduler, handler_name, **kwargs)
+    return post_schedule_or_estimate_job(handler_name, **kwargs)
 
 
 @requires_auth
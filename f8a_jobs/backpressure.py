@@ -0,0 +1,178 @@
+"""Backpressure of flow dispatching based on depth of the deployment queues.
+
+Depth of SQS queues is sampled periodically (see construct_queue_attributes()). Once the
+dispatcher queue of a flow reaches the high-water mark stated for the flow, dispatching of
+the flow is paused until the queue drains below the low-water mark, so big jobs do not
+flood already backed up queues.
+"""
+
+import logging
+from threading import Lock
+from time import monotonic, sleep
+
+from selinon import Config
+
+import f8a_jobs.defaults as configuration
+from f8a_jobs.utils import construct_queue_attributes
+
+logger = logging.getLogger(__name__)
+
+# watermarks of flows not stated explicitly
+ANY_FLOW = '*'
+
+
+def parse_watermarks(watermarks):
+    """Parse configuration of queue depth watermarks.
+
+    :param watermarks: comma separated definitions in the form of 'flow:high:low', flow can be
+    '*' for all flows not stated explicitly, e.g. 'bayesianFlow:100000:20000,*:500000:100000'
+    :return: a dict mapping flow name to a tuple (high, low)
+    """
+    result = {}
+    for definition in watermarks.split(','):
+        definition = definition.strip()
+        if not definition:
+            continue
+
+        try:
+            flow_name, high, low = definition.split(':')
+            high, low = int(high), int(low)
+        except ValueError as exc:
+            raise ValueError("Unable to parse backpressure watermarks definition '%s', expected "
+                             "'flow:high:low'" % definition) from exc
+
+        if low < 0 or low > high:
+            raise ValueError("Low-water mark of flow '%s' has to be between 0 and the high-water "
+                             "mark" % flow_name)
+
+        result[flow_name] = (high, low)
+
+    return result
+
+
+class QueueDepthMonitor(object):
+    """Periodically sampled number of messages in the deployment queues."""
+
+    def __init__(self, sample_interval):
+        """Construct the monitor.
+
+        :param sample_interval: number of seconds after which queue depths are sampled again
+        """
+        self.sample_interval = sample_interval
+        self._lock = Lock()
+        self._depths = {}
+        self._sampled_at = None
+
+    def _sample(self):
+        """Get number of messages in each deployment queue."""
+        attributes = construct_queue_attributes()
+        return {queue_name: queue['ApproximateNumberOfMessages']
+                for queue_name, queue in attributes.items()
+                if 'ApproximateNumberOfMessages' in queue}
+
+    def get_depth(self, queue_name, refresh=False):
+        """Get number of messages in the given queue as sampled last time.
+
+        :param queue_name: name of the queue, with or without the deployment prefix
+        :param refresh: sample queues even if the last sample is not older than sample_interval
+        :return: number of messages or None if unknown
+        """
+        with self._lock:
+            now = monotonic()
+            if refresh or self._sampled_at is None or \
+                    now - self._sampled_at >= self.sample_interval:
+                self._sampled_at = now
+                try:
+                    self._depths = self._sample()
+                except Exception:
+                    # dispatching should not fail just because queues cannot be inspected
+                    logger.exception("Failed to sample depth of queues")
+                    self._depths = {}
+
+            depth = self._depths.get(queue_name)
+            if depth is None:
+                depth = self._depths.get('{}_{}'.format(configuration.DEPLOYMENT_PREFIX,
+                                                        queue_name))
+            return depth
+
+
+class BackpressureController(object):
+    """Pause dispatching of flows which queues are backed up."""
+
+    def __init__(self, monitor, watermarks, max_wait):
+        """Construct the controller.
+
+        :param monitor: QueueDepthMonitor instance
+        :param watermarks: a dict mapping flow name (or '*') to a tuple (high, low)
+        :param max_wait: maximum number of seconds dispatching of a flow is paused for, the flow
+        is dispatched afterwards regardless of the queue depth
+        """
+        self.monitor = monitor
+        self.watermarks = watermarks
+        self.max_wait = max_wait
+        self._lock = Lock()
+        self._paused = set()
+
+    def is_paused(self, flow_name):
+        """Check whether dispatching of the given flow is paused."""
+        with self._lock:
+            return flow_name in self._paused
+
+    def _get_depth(self, flow_name):
+        """Get number of messages waiting in the dispatcher queue of the given flow."""
+        queue_name = (Config.dispatcher_queues or {}).get(flow_name)
+        if queue_name is None:
+            return None
+        return self.monitor.get_depth(queue_name)
+
+    def _update(self, flow_name, high, low):
+        """Update the paused state of the flow based on depth of its queue.
+
+        :return: True if dispatching of the flow is paused
+        """
+        depth = self._get_depth(flow_name)
+        with self._lock:
+            if depth is None or depth <= low:
+                if flow_name in self._paused:
+                    logger.info("Resuming dispatching of flow '%s', %s messages queued",
+                                flow_name, depth)
+                self._paused.discard(flow_name)
+            elif depth >= high and flow_name not in self._paused:
+                logger.warning("Pausing dispatching of flow '%s', %d messages queued (high-water "
+                               "mark %d)", flow_name, depth, high)
+                self._paused.add(flow_name)
+
+            return flow_name in self._paused
+
+    def wait(self, flow_name):
+        """Block while dispatching of the flow is paused.
+
+        :param flow_name: name of the flow that is about to be dispatched
+        :return: number of seconds spent waiting
+        """
+        watermarks = self.watermarks.get(flow_name, self.watermarks.get(ANY_FLOW))
+        if watermarks is None:
+            return 0.0
+
+        high, low = watermarks
+        start = monotonic()
+        if not self._update(flow_name, high, low):
+            return 0.0
+
+        while True:
+            waited = monotonic() - start
+            if waited >= self.max_wait:
+                logger.warning("Dispatching flow '%s' after waiting %d seconds for its queue "
+                               "to drain", flow_name, waited)
+                return waited
+
+            sleep(min(self.monitor.sample_interval, self.max_wait - waited))
+            if not self._update(flow_name, high, low):
+                return monotonic() - start
+
+
+BACKPRESSURE = BackpressureController(
+    QueueDepthMonitor(configuration.BACKPRESSURE_SAMPLE_INTERVAL),
+    parse_watermarks(configuration.BACKPRESSURE_WATERMARKS),
+    configuration.BACKPRESSURE_MAX_WAIT
+)
@@ -3,6 +3,7 @@
 """Module that contains global variables with the project runtime configuration."""
 
 import os
+import tempfile
 from datetime import timedelta
 
 _BAYESIAN_JOBS_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -45,3 +46,91 @@ GEMINI_API_URL = "http://{host}:{port}/api/v1/pgsql".format(
     port=os.environ.get("GEMINI_SERVICE_PORT", "5000"))
 ENABLE_USER_CACHING = os.environ.get('ENABLE_USER_CACHING', 'true') == 'true'
 ACCOUNT_SECRET_KEY = os.getenv('THREESCALE_ACCOUNT_SECRET', 'not-set')
+
+# Run scheduler in leader election mode - only one process (elected via PostgreSQL advisory lock)
+# executes jobs, other processes only manipulate with jobs stored in the shared job store
+LEADER_ELECTION = os.getenv('JOB_SERVICE_LEADER_ELECTION', 'false') in ('1', 'True', 'true')
+# Advisory locks are bound to a database session, make sure this does not point to a connection
+# pooler running in transaction pooling mode
+LEADER_ELECTION_DB_URL = os.getenv('JOB_SERVICE_LEADER_ELECTION_DB_URL')
+LEADER_ELECTION_LOCK_ID = int(os.getenv('JOB_SERVICE_LEADER_ELECTION_LOCK_ID', '7396287498437943'))
+LEADER_ELECTION_INTERVAL = int(os.getenv('JOB_SERVICE_LEADER_ELECTION_INTERVAL', '10'))
+
+# Number of seconds after which the in-memory job index is reloaded from the job store
+JOB_INDEX_REFRESH_INTERVAL = int(os.getenv('JOB_SERVICE_JOB_INDEX_REFRESH_INTERVAL', '60'))
+
+# Executor pools jobs are run in, comma separated 'name:type:size' definitions where type is
+# 'thread' or 'process'; handlers (or jobs) are routed to pools by name, see BaseHandler.executor;
+# size of a pool caps the number of its jobs running at the same time
+EXECUTOR_POOLS = os.getenv('JOB_SERVICE_EXECUTOR_POOLS', 'default:thread:20,processpool:process:5')
+
+# Failures of jobs not seen for the given number of days are deleted
+FAILED_JOBS_RETENTION_DAYS = int(os.getenv('JOB_SERVICE_FAILED_JOBS_RETENTION_DAYS', '30'))
+
+# Rate limiters of outbound requests shared by handlers, comma separated 'name:rate:burst'
+# definitions where rate is number of requests per second; handlers state the rate limiter
+# they use by name, see BaseHandler.rate_limiter
+RATE_LIMITS = os.getenv('JOB_SERVICE_RATE_LIMITS',
+                        'api.github.com:0.5:5,github.com:1:3,go-search.org:1:3,'
+                        'mvnrepository.com:1:3,skimdb.npmjs.com:5:10,www.npmjs.com:1:3')
+
+# Maximum number of concurrently running jobs per handler, comma separated 'handler:limit'
+# definitions overriding limits stated by handlers, see BaseHandler.max_concurrency
+CONCURRENCY_LIMITS = os.getenv('JOB_SERVICE_CONCURRENCY_LIMITS', '')
+
+# Minimum number of seconds between two checkpoints stored by a long-running job, see
+# BaseHandler.save_checkpoint()
+CHECKPOINT_INTERVAL = int(os.getenv('JOB_SERVICE_CHECKPOINT_INTERVAL', '30'))
+
+# Default random delay (e.g. '10 minutes') added to each run of periodic jobs that do not state
+# their own 'jitter', empty for no jitter
+PERIODIC_JOBS_JITTER = os.getenv('JOB_SERVICE_PERIODIC_JOBS_JITTER', '')
+# Spread periodic jobs that do not state 'when' across their interval by default, so jobs
+# registered at the same time do not become due at the same time
+PERIODIC_JOBS_SPREAD = os.getenv('JOB_SERVICE_PERIODIC_JOBS_SPREAD',
+                                 'false') in ('1', 'True', 'true')
+
+# Number of Selinon flows published at once by jobs dispatching flows in batches, see
+# BaseHandler.flow_dispatch_batch()
+FLOW_DISPATCH_CHUNK_SIZE = int(os.getenv('JOB_SERVICE_FLOW_DISPATCH_CHUNK_SIZE', '100'))
+
+# Number of seconds ecosystem backends used for package name normalization are cached for
+ECOSYSTEM_BACKEND_CACHE_TTL = int(os.getenv('JOB_SERVICE_ECOSYSTEM_BACKEND_CACHE_TTL', '3600'))
+
+# Number of rows fetched from database at once when expanding filter queries ($filter)
+FILTER_QUERY_FETCH_SIZE = int(os.getenv('JOB_SERVICE_FILTER_QUERY_FETCH_SIZE', '1000'))
+# Maximum number of records returned by the streaming variant of /debug/expand-filter-query
+EXPAND_FILTER_QUERY_STREAM_LIMIT = int(os.getenv('JOB_SERVICE_EXPAND_FILTER_QUERY_STREAM_LIMIT',
+                                                 '100000'))
+# Number of SQL statements compiled from filter queries ($filter) cached per process, 0 disables
+# the cache
+SELECT_QUERY_CACHE_SIZE = int(os.getenv('JOB_SERVICE_SELECT_QUERY_CACHE_SIZE', '256'))
+
+# Number of seconds a dispatched flow for an ecosystem/package/version is remembered for, the
+# same flow with the same arguments is not dispatched again meanwhile; 0 disables deduplication
+FLOW_DEDUPE_TTL = int(os.getenv('JOB_SERVICE_FLOW_DEDUPE_TTL', '21600'))
+# Maximum number of dispatched flows remembered in memory per process for deduplication, all
+# processes share dispatched flows through the database
+FLOW_DEDUPE_MAX_SIZE = int(os.getenv('JOB_SERVICE_FLOW_DEDUPE_MAX_SIZE', '100000'))
+
+# Backpressure of flow dispatching based on depth of dispatcher queues, comma separated
+# 'flow:high:low' definitions ('*' for all flows not stated); dispatching of a flow is paused
+# once its queue holds high messages and resumed once it drains to low, empty disables
+BACKPRESSURE_WATERMARKS = os.getenv('JOB_SERVICE_BACKPRESSURE_WATERMARKS', '')
+# Number of seconds after which depth of queues is sampled again
+BACKPRESSURE_SAMPLE_INTERVAL = int(os.getenv('JOB_SERVICE_BACKPRESSURE_SAMPLE_INTERVAL', '60'))
+# Maximum number of seconds dispatching of a flow is paused for
+BACKPRESSURE_MAX_WAIT = int(os.getenv('JOB_SERVICE_BACKPRESSURE_MAX_WAIT', '3600'))
+
+# Maximum number of concurrent requests made by jobs fetching multiple pages of an upstream
+# service, see BaseHandler.http_get_many()
+HTTP_FETCH_WORKERS = int(os.getenv('JOB_SERVICE_HTTP_FETCH_WORKERS', '4'))
+
+# Directory pages fetched by handlers using BaseHandler.http_get_cached() are cached in, shared by
+# all processes of the service; empty disables the cache
+HTTP_CACHE_DIR = os.getenv('JOB_SERVICE_HTTP_CACHE_DIR',
+                           os.path.join(tempfile.gettempdir(), 'f8a-jobs-http-cache'))
+# Number of seconds a cached page is used without revalidation by a conditional request
+HTTP_CACHE_TTL = int(os.getenv('JOB_SERVICE_HTTP_CACHE_TTL', '3600'))
+# Maximum size of the cache in megabytes, the least recently used pages are evicted first
+HTTP_CACHE_MAX_SIZE = int(os.getenv('JOB_SERVICE_HTTP_CACHE_MAX_SIZE', '256'))
@@ -0,0 +1,183 @@
+"""Executors (worker pools) jobs can be routed to.
+
+Each handler states executor its jobs are run in (see BaseHandler.executor), the default
+executor can be overridden per job using the 'executor' job option.
+"""
+
+import concurrent.futures
+from collections import defaultdict
+from concurrent.futures import wait
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from apscheduler.job import Job
+from apscheduler.util import ref_to_obj
+
+from f8a_jobs.throttling import CONCURRENCY_LIMITER
+
+EXECUTOR_TYPES = {
+    'thread': 'f8a_jobs.executors:LimitedThreadPoolExecutor',
+    'process': 'f8a_jobs.executors:PreforkedProcessPoolExecutor'
+}
+
+
+class ConcurrencyLimitedExecutor(object):
+    """Executor mixin enforcing concurrency limits of handlers (see ConcurrencyLimiter).
+
+    Runs of jobs over the limit of their handler are not handed to the pool, they wait in the
+    scheduler process and are submitted once a job of the handler finishes, so they never
+    occupy a worker. A slot is released when the pool reports the job as finished, including
+    when its worker process died.
+    """
+
+    # job_execute() is referenced textually to avoid cyclic imports
+    JOB_FUNC = 'f8a_jobs.scheduler:job_execute'
+
+    limiter = CONCURRENCY_LIMITER
+
+    def __init__(self, *args, **kwargs):
+        """Construct the executor."""
+        super().__init__(*args, **kwargs)
+        # job id -> names of handlers which slots are held by runs of the job
+        self._slots = defaultdict(list)
+
+    def _handler_name(self, job):
+        """Get name of the handler run by the job, None for jobs not running handlers."""
+        if job.func_ref != self.JOB_FUNC or not job.args:
+            return None
+        return job.args[0]
+
+    @staticmethod
+    def _deferred_job(job):
+        """Copy the job to be submitted once it gets a free slot.
+
+        The run was due and it was not missed, it only waited for a free slot, so it is not
+        checked against misfire_grace_time when it is finally run.
+        """
+        deferred = Job.__new__(Job)
+        deferred.__setstate__(job.__getstate__())
+        deferred._scheduler = job._scheduler
+        deferred._jobstore_alias = job._jobstore_alias
+        deferred.misfire_grace_time = None
+        return deferred
+
+    def _do_submit_job(self, job, run_times):
+        handler_name = self._handler_name(job)
+        if handler_name is None or self.limiter.get_limit(handler_name) is None:
+            super()._do_submit_job(job, run_times)
+            return
+
+        def submit(submitted_job=job):
+            # the slot is recorded before the job can finish and release it
+            with self._lock:
+                super(ConcurrencyLimitedExecutor, self)._do_submit_job(submitted_job, run_times)
+                self._slots[job.id].append(handler_name)
+
+        def submit_deferred():
+            try:
+                submit(self._deferred_job(job))
+            except Exception as exc:
+                # the run is dropped, the slot is handed over to the next waiting job
+                super(ConcurrencyLimitedExecutor, self)._run_job_error(job.id, exc)
+                raise
+
+        # jobs over the limit are submitted from a callback of a finished job of the handler
+        self.limiter.submit(handler_name, submit, submit_deferred)
+
+    def _release_slot(self, job_id):
+        """Release the slot held by the finished run of the job, if any."""
+        with self._lock:
+            handler_names = self._slots.get(job_id)
+            if not handler_names:
+                return
+            handler_name = handler_names.pop()
+            if not handler_names:
+                del self._slots[job_id]
+
+        self.limiter.release(handler_name)
+
+    def _run_job_success(self, job_id, events):
+        super()._run_job_success(job_id, events)
+        self._release_slot(job_id)
+
+    def _run_job_error(self, job_id, exc, traceback=None):
+        super()._run_job_error(job_id, exc, traceback)
+        self._release_slot(job_id)
+
+
+class LimitedThreadPoolExecutor(ConcurrencyLimitedExecutor, ThreadPoolExecutor):
+    """Thread pool executor enforcing concurrency limits of handlers."""
+
+
+def _init_worker(initializer_ref):
+    """Initialize a worker process of PreforkedProcessPoolExecutor."""
+    ref_to_obj(initializer_ref)()
+
+
+class PreforkedProcessPoolExecutor(ConcurrencyLimitedExecutor, ProcessPoolExecutor):
+    """Process pool executor that forks all worker processes when the scheduler starts.
+
+    Worker processes are otherwise forked on demand, from the scheduler thread submitting a job
+    while other jobs run in threads of the process, and could inherit locks held by them. The
+    scheduler is started lazily on first use (see Scheduler.get_scheduler()), not before the
+    process serves requests, so workers still inherit whatever the process created by then,
+    such as API server threads or database connections opened by the request. Each worker runs
+    WORKER_INITIALIZER once forked, it drops connections inherited from the parent process so
+    jobs run in workers open their own ones.
+    """
+
+    # referenced textually to avoid cyclic imports, see init_worker()
+    WORKER_INITIALIZER = 'f8a_jobs.scheduler:init_worker'
+
+    def __init__(self, max_workers=10):
+        """Construct the executor.
+
+        :param max_workers: number of worker processes
+        """
+        super().__init__(max_workers)
+        self._max_workers = int(max_workers)
+        # replaces the pool created by ProcessPoolExecutor, which forks no process until
+        # a job is submitted; apscheduler 3.6 does not pass arguments to the pool
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self._max_workers, initializer=_init_worker, initargs=(self.WORKER_INITIALIZER,))
+
+    def start(self, scheduler, alias):
+        """Start the executor and fork all worker processes."""
+        super().start(scheduler, alias)
+        wait([self._pool.submit(int) for _ in range(self._max_workers)])
+
+
+def parse_executor_pools(pools):
+    """Parse configuration of executor pools.
+
+    :param pools: comma separated pool definitions in the form of 'name:type:size', type is
+    one of 'thread' or 'process', e.g. 'default:thread:20,processpool:process:5'
+    :return: a dict mapping pool name to apscheduler executor configuration
+    """
+    result = {}
+    for pool in pools.split(','):
+        pool = pool.strip()
+        if not pool:
+            continue
+
+        try:
+            name, pool_type, size = pool.split(':')
+            size = int(size)
+        except ValueError as exc:
+            raise ValueError("Unable to parse executor pool definition '%s', expected "
+                             "'name:type:size'" % pool) from exc
+
+        if pool_type not in EXECUTOR_TYPES:
+            raise ValueError("Unknown type '%s' of executor pool '%s', should be one of %s"
+                             % (pool_type, name, tuple(EXECUTOR_TYPES.keys())))
+
+        if size < 1:
+            raise ValueError("Size of executor pool '%s' has to be positive" % name)
+
+        result[name] = {
+            'class': EXECUTOR_TYPES[pool_type],
+            'max_workers': str(size)
+        }
+
+    if 'default' not in result:
+        raise ValueError("No 'default' executor pool configured in '%s'" % pools)
+
+    return result
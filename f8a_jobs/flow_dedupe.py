@@ -0,0 +1,208 @@
+"""Suppression of duplicate dispatches of flows analysing the same package version.
+
+The same ecosystem/package/version is often scheduled by several jobs and by the ingestion API
+within a short time and each dispatch runs a full flow on workers. Dispatched flows are
+remembered for JOB_SERVICE_FLOW_DEDUPE_TTL seconds and the same flow for the same package
+version with the same arguments is not dispatched again meanwhile. Dispatched flows are stored
+in Postgres (the jobs_flow_dispatches table) so they are shared by all processes - scheduler
+threads, process pool workers and API workers; flows claimed by the current process are also
+remembered in memory so they are suppressed without a query. Flows dispatched in batches are
+claimed using one query per published chunk, see lookup_many(). Forced flows (force or
+force_graph_sync) are never suppressed.
+"""
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import f8a_jobs.defaults as configuration
+from f8a_jobs.models import FlowDispatch, get_pooled_session
+
+logger = logging.getLogger(__name__)
+
+
+class FlowDeduplicator(object):
+    """Set of recently dispatched flows, entries expire after ttl seconds."""
+
+    HIT = 'hit'
+    MISS = 'miss'
+
+    # flows running the same analyses, they are deduplicated as one flow
+    _EQUIVALENT_FLOWS = {
+        # flow dispatched by the ingestion API, the same analysis as run by jobs
+        'bayesianApiFlow': 'bayesianFlow'
+    }
+
+    def __init__(self, ttl, max_size, session_factory=None):
+        """Construct the deduplicator.
+
+        :param ttl: number of seconds a dispatched flow is remembered for, 0 disables
+        deduplication
+        :param max_size: maximum number of flows remembered in memory, the oldest are forgotten
+        first
+        :param session_factory: callable returning a database session dispatched flows are
+        shared through, flows are remembered by the current process only if not given
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._session_factory = session_factory
+        self._lock = Lock()
+        # key -> expiration time, ordered by expiration time as all entries share the same ttl
+        self._dispatched = OrderedDict()
+
+    @classmethod
+    def key(cls, flow_name, node_args):
+        """Compute key identifying the flow, None if the flow is not subject to deduplication.
+
+        :param flow_name: name of the flow
+        :param node_args: flow arguments
+        :return: tuple of flow name, ecosystem, package name, version and arguments changing
+        the work done by the flow
+        """
+        if not isinstance(node_args, dict):
+            return None
+
+        if not all(node_args.get(attr) for attr in ('ecosystem', 'name', 'version')):
+            return None
+
+        if node_args.get('force') or node_args.get('force_graph_sync'):
+            # forced re-analyses are requested explicitly, they are always dispatched
+            return None
+
+        return (cls._EQUIVALENT_FLOWS.get(flow_name, flow_name), node_args['ecosystem'],
+                node_args['name'], str(node_args['version']), node_args.get('recursive_limit'))
+
+    @staticmethod
+    def _shared_key(key):
+        """Compute key of the flow stored in the database."""
+        return hashlib.sha256(json.dumps(key, default=str).encode('utf-8')).hexdigest()
+
+    def _expire(self, now):
+        """Drop expired entries, called with the lock held."""
+        while self._dispatched:
+            key, expires_at = next(iter(self._dispatched.items()))
+            if expires_at > now and len(self._dispatched) <= self.max_size:
+                break
+            del self._dispatched[key]
+
+    def _claim(self, keys):
+        """Claim the flows in the shared store, return keys of flows not dispatched recently."""
+        if self._session_factory is None:
+            return set(keys)
+
+        shared_keys = {self._shared_key(key): key for key in keys}
+        try:
+            session = self._session_factory()
+            try:
+                claimed = FlowDispatch.claim(shared_keys.keys(), self.ttl, session=session)
+            finally:
+                session.close()
+        except SQLAlchemyError:
+            # dispatching duplicates is cheaper than failing the job
+            logger.exception("Failed to look up %d flows in dispatched flows", len(keys))
+            return set(keys)
+
+        return {shared_keys[shared_key] for shared_key in claimed}
+
+    def lookup_many(self, flows):
+        """Check whether the flows were dispatched recently, remember them as dispatched if not.
+
+        Flows not remembered by the current process are claimed in the shared store using
+        a single query. Second and further occurrences of the same flow are duplicates.
+
+        :param flows: a list of (flow name, node_args) tuples of flows about to be dispatched
+        :return: a list of results in the order of flows - HIT if the flow is a duplicate and
+        should not be dispatched, MISS if it should be dispatched, None if the flow is not
+        subject to deduplication
+        """
+        results = [None] * len(flows)
+        if not self.ttl:
+            return results
+
+        # key -> index of the flow claimed in the shared store
+        unknown = OrderedDict()
+        with self._lock:
+            self._expire(monotonic())
+            for idx, (flow_name, node_args) in enumerate(flows):
+                key = self.key(flow_name, node_args)
+                if key is None:
+                    continue
+                if key in self._dispatched or key in unknown:
+                    results[idx] = self.HIT
+                else:
+                    unknown[key] = idx
+
+        if not unknown:
+            return results
+
+        claimed = self._claim(list(unknown))
+
+        with self._lock:
+            now = monotonic()
+            for key, idx in unknown.items():
+                if key in claimed:
+                    self._dispatched[key] = now + self.ttl
+                    results[idx] = self.MISS
+                else:
+                    results[idx] = self.HIT
+            self._expire(now)
+
+        return results
+
+    def lookup(self, flow_name, node_args):
+        """Check whether the flow was dispatched recently, remember it as dispatched if not.
+
+        :param flow_name: name of the flow that is about to be dispatched
+        :param node_args: flow arguments
+        :return: HIT if the flow is a duplicate and should not be dispatched, MISS if it should
+        be dispatched, None if the flow is not subject to deduplication
+        """
+        return self.lookup_many([(flow_name, node_args)])[0]
+
+    def forget_many(self, flows):
+        """Forget the flows, e.g. when their dispatching failed, so they can be dispatched again.
+
+        :param flows: a list of (flow name, node_args) tuples of flows claimed by lookup_many()
+        """
+        keys = {self.key(flow_name, node_args) for flow_name, node_args in flows} - {None}
+        if not keys:
+            return
+
+        with self._lock:
+            for key in keys:
+                self._dispatched.pop(key, None)
+
+        if self._session_factory is None:
+            return
+
+        try:
+            session = self._session_factory()
+            try:
+                FlowDispatch.release([self._shared_key(key) for key in keys], session=session)
+            finally:
+                session.close()
+        except SQLAlchemyError:
+            logger.exception("Failed to forget %d dispatched flows", len(keys))
+
+    def forget(self, flow_name, node_args):
+        """Forget the flow, e.g. when its dispatching failed, so it can be dispatched again."""
+        self.forget_many([(flow_name, node_args)])
+
+    def clear(self):
+        """Forget all flows remembered in memory."""
+        with self._lock:
+            self._dispatched.clear()
+
+    def __len__(self):
+        """Get number of flows remembered in memory, including expired ones not dropped yet."""
+        return len(self._dispatched)
+
+
+FLOW_DEDUPLICATOR = FlowDeduplicator(configuration.FLOW_DEDUPE_TTL,
+                                     configuration.FLOW_DEDUPE_MAX_SIZE,
+                                     session_factory=get_pooled_session)
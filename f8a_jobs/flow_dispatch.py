@@ -0,0 +1,163 @@
+"""Batched dispatching of Selinon flows.
+
+selinon.run_flow() acquires a broker connection and a producer from the pool and computes
+the selective run (for selective flows) for each flow separately. Flows dispatched using
+FlowDispatchBatch are published in chunks using a single producer held for the whole batch.
+"""
+
+import logging
+from collections import Counter
+from time import monotonic
+from selinon import Config, Dispatcher, UnknownFlowError
+from selinon.selective import compute_selective_run
+
+import f8a_jobs.defaults as configuration
+
+logger = logging.getLogger(__name__)
+
+
+class FlowDispatchBatch(object):
+    """Accumulate flows and publish them in chunks using one producer."""
+
+    def __init__(self, chunk_size=None, on_chunk=None, on_discard=None, claim=None):
+        """Construct the batch.
+
+        :param chunk_size: number of flows published at once, JOB_SERVICE_FLOW_DISPATCH_CHUNK_SIZE
+        is used if not stated
+        :param on_chunk: callable called after each published chunk with a Counter of dispatched
+        flows (by flow name) and the number of seconds publishing took
+        :param on_discard: callable called with a list of (flow name, node_args) tuples of
+        claimed flows that were not published as publishing failed
+        :param claim: callable called before a chunk is published with a list of (flow name,
+        node_args) tuples of its flows (selective flows excluded), returns a list of booleans
+        stating which of them should be published
+        """
+        self.chunk_size = chunk_size or configuration.FLOW_DISPATCH_CHUNK_SIZE
+        self._on_chunk = on_chunk
+        self._on_discard = on_discard
+        self._claim = claim
+        self._pending = []
+        self._selective_runs = {}
+        self._dispatcher = None
+        self._producer = None
+
+    def __len__(self):
+        """Get number of flows waiting to be published."""
+        return len(self._pending)
+
+    def __enter__(self):
+        """Enter the batch context, pending flows are published and producer released on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Publish pending flows and release the producer."""
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+    def add(self, flow_name, node_args, selective=None):
+        """Add a flow to the batch, a chunk is published once the batch is full.
+
+        :param flow_name: flow that should be run
+        :param node_args: flow arguments
+        :param selective: selective run as computed by compute_selective_run(), if any
+        """
+        if Config.dispatcher_queues is None or flow_name not in Config.dispatcher_queues:
+            raise UnknownFlowError("No flow with name '%s' defined" % flow_name)
+
+        kwargs = {'flow_name': flow_name, 'node_args': node_args}
+        if selective is not None:
+            kwargs['selective'] = selective
+
+        self._pending.append((Config.dispatcher_queues[flow_name], kwargs))
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def add_selective(self, flow_name, task_names, node_args, follow_subflows=False,
+                      run_subsequent=False):
+        """Add a selective flow to the batch, the selective run is computed once per batch.
+
+        :param flow_name: flow that should be run
+        :param task_names: a list of tasks that should be executed
+        :param node_args: flow arguments
+        :param follow_subflows: follow subflows when resolving tasks to be executed
+        :param run_subsequent: run tasks that follow after desired tasks stated in task_names
+        """
+        key = (flow_name, tuple(sorted(task_names)), follow_subflows, run_subsequent)
+        if key not in self._selective_runs:
+            self._selective_runs[key] = compute_selective_run(flow_name, task_names,
+                                                              follow_subflows, run_subsequent)
+
+        self.add(flow_name, node_args, selective=self._selective_runs[key])
+
+    def _get_producer(self):
+        """Get producer used for publishing, it is acquired from the pool on first use."""
+        if self._producer is None:
+            self._dispatcher = Dispatcher()
+            self._producer = self._dispatcher.app.producer_pool.acquire(block=True)
+        return self._producer
+
+    def flush(self):
+        """Publish all pending flows.
+
+        :return: a list of dispatcher ids of published flows
+        """
+        if not self._pending:
+            return []
+
+        pending, self._pending = self._pending, []
+        pending = self._claim_pending(pending)
+        if not pending:
+            return []
+
+        start = monotonic()
+        dispatcher_ids = []
+        try:
+            producer = self._get_producer()
+            for queue, kwargs in pending:
+                dispatcher_ids.append(self._dispatcher.apply_async(kwargs=kwargs, queue=queue,
+                                                                   producer=producer).id)
+        finally:
+            # claimed flows are released on any failure, also if the job is interrupted
+            self._discard(pending[len(dispatcher_ids):])
+        duration = monotonic() - start
+
+        logger.info("Dispatched chunk of %d flows in %.3f seconds (%.1f flows/s)",
+                    len(pending), duration, len(pending) / duration if duration else 0.0)
+        if self._on_chunk is not None:
+            self._on_chunk(Counter(kwargs['flow_name'] for _, kwargs in pending), duration)
+
+        return dispatcher_ids
+
+    def _claim_pending(self, pending):
+        """Drop flows of the chunk rejected by the claim callable, e.g. duplicates."""
+        if self._claim is None:
+            return pending
+
+        candidates = [idx for idx, (_, kwargs) in enumerate(pending)
+                      if 'selective' not in kwargs]
+        if not candidates:
+            return pending
+
+        claimed = self._claim([(pending[idx][1]['flow_name'], pending[idx][1]['node_args'])
+                               for idx in candidates])
+        rejected = {idx for idx, publish in zip(candidates, claimed) if not publish}
+        return [flow for idx, flow in enumerate(pending) if idx not in rejected]
+
+    def _discard(self, pending):
+        """Report flows that will not be published."""
+        if pending and self._on_discard is not None:
+            self._on_discard([(kwargs['flow_name'], kwargs['node_args'])
+                              for _, kwargs in pending])
+
+    def close(self):
+        """Release the producer back to the pool, pending flows are discarded."""
+        if self._pending:
+            # pending flows were not claimed yet, there is nothing to release
+            logger.warning("Discarding %d flows not published", len(self._pending))
+            self._pending = []
+        if self._producer is not None:
+            self._producer.release()
+            self._producer = None
+            self._dispatcher = None
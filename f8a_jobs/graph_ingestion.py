@@ -8,6 +8,8 @@ from f8a_utils.gh_utils import GithubUtils
 from f8a_utils.tree_generator import GolangDependencyTreeGenerator
 import time
 from f8a_jobs import user_cache
+from f8a_jobs.flow_dedupe import FLOW_DEDUPLICATOR
+from f8a_jobs.metrics import FLOW_DEDUPE_LOOKUPS
 from f8a_utils.versions import is_pkg_public
 
 
@@ -91,11 +93,20 @@ def ingest_epv_into_graph(epv_details):
         node_arguments['name'] = item.get('package')
         node_arguments['version'] = item.get('version')
 
+        # Do not run the same flow again if it was dispatched recently with the same arguments.
+        lookup = FLOW_DEDUPLICATOR.lookup(flow_name, node_arguments)
+        if lookup is not None:
+            FLOW_DEDUPE_LOOKUPS.inc(source='ingestion', flow=flow_name, result=lookup)
+        if lookup == FLOW_DEDUPLICATOR.HIT:
+            item['message'] = 'Flow was dispatched recently, skipped as a duplicate.'
+            continue
+
         try:
             # Initiate Selinon flow for current EPV ingestion.
             dispacher_id = run_flow(flow_name, node_arguments)
             item['dispacher_id'] = dispacher_id.id
         except Exception as e:
+            FLOW_DEDUPLICATOR.forget(flow_name, node_arguments)
             logger.error('Exception while initiating the worker flow %s', e)
             return {'message': 'Failed to initiate worker flow.'}, 500
 
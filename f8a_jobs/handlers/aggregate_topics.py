@@ -50,21 +50,27 @@ class AggregateTopics(BaseHandler):
             join(Ecosystem).\
             filter(WorkerResult.error.is_(False)).\
             filter(WorkerResult.worker == 'github_details').\
-            filter(Ecosystem.name == ecosystem)
+            filter(Ecosystem.name == ecosystem).\
+            order_by(desc(WorkerResult.id))
 
         if from_date is not None:
-            base_query = base_query.filter(Analysis.started_at > from_date).\
-                order_by(desc(WorkerResult.id))
+            base_query = base_query.filter(Analysis.started_at > from_date)
 
         if to_date is not None:
-            base_query = base_query.filter(Analysis.started_at < to_date).\
-                order_by(desc(WorkerResult.id))
+            base_query = base_query.filter(Analysis.started_at < to_date)
 
-        start = 0
-        topics = []
+        # topics collected so far are a part of the checkpoint as they are stored only at the end
+        checkpoint = self.load_checkpoint() or {}
+        last_id = checkpoint.get('last_id')
+        topics = checkpoint.get('topics', [])
         while True:
+            # keyset pagination, an interrupted aggregation is resumed from the last processed id
+            query = base_query
+            if last_id is not None:
+                query = query.filter(WorkerResult.id < last_id)
+
             try:
-                results = base_query.slice(start, start + 10).all()
+                results = query.limit(10).all()
             except SQLAlchemyError:
                 postgres.session.rollback()
                 raise
@@ -72,8 +78,8 @@ class AggregateTopics(BaseHandler):
             if not results:
                 break
 
-            self.log.info("Collecting topics, slice offset is %s", start)
-            start += 10
+            self.log.info("Collecting topics, last processed id is %s", last_id)
+            last_id = results[-1].id
 
             for entry in results:
                 name = entry.package.name
@@ -99,6 +105,8 @@ class AggregateTopics(BaseHandler):
                     'version': version
                 })
 
+            self.save_checkpoint({'last_id': last_id, 'topics': topics})
+
         report = {
             'ecosystem': ecosystem,
             'bucket_name': bucket_name,
@@ -7,33 +7,327 @@ analyses.
 """
 
 import logging
+import os
 import copy
-from collections import namedtuple
+import hashlib
+import json
+import random
+import requests
+import botocore.exceptions
+from time import monotonic
+from collections import namedtuple, Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
 from json2sql import select2sql
 from json2sql.select import DEFAULT_FILTER_KEY
 from selinon import run_flow
 from selinon import run_flow_selective
-from selinon import StoragePool
+from selinon import Config, StoragePool
 from f8a_worker.setup_celery import init_celery
 from f8a_worker.utils import normalize_package_name
 from f8a_worker.models import Ecosystem
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
+import f8a_jobs.defaults as configuration
+from f8a_jobs.backpressure import BACKPRESSURE
+from f8a_jobs.flow_dedupe import FLOW_DEDUPLICATOR
+from f8a_jobs.flow_dispatch import FlowDispatchBatch
+from f8a_jobs.http_cache import HTTP_CACHE
+from f8a_jobs.metrics import HANDLER_CONTEXT_SETUP
+from f8a_jobs.models import JobCheckpoint, get_session, keep_inherited
+from f8a_jobs.throttling import get_rate_limiter
 
 CountRange = namedtuple('CountRange', ['min', 'max'])
 
 
+class RetryPolicy(namedtuple('RetryPolicy', ['max_attempts', 'base_delay', 'jitter',
+                                             'retry_on'])):
+    """Retry policy of failed job runs.
+
+    A failed run is retried max_attempts - 1 times if the raised exception is one of retry_on,
+    the n-th retry is run base_delay * 2^(n-1) seconds after the failure, randomized by jitter
+    (a fraction of the delay).
+    """
+
+    __slots__ = ()
+
+    # cap of the backoff so retries are not postponed indefinitely
+    MAX_DELAY = 6 * 3600
+
+    def should_retry(self, exc, attempt):
+        """Check whether the run that failed with the given exception should be retried.
+
+        :param exc: exception raised by the failed run
+        :param attempt: number of the failed attempt, the first run is 1
+        :return: True if the run should be retried
+        """
+        return attempt < self.max_attempts and isinstance(exc, self.retry_on)
+
+    def get_delay(self, attempt):
+        """Get number of seconds to wait before the next attempt.
+
+        :param attempt: number of the failed attempt, the first run is 1
+        :return: delay in seconds
+        """
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.MAX_DELAY)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+# errors worth retrying - network issues when talking to upstream services, S3 or the importer
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    botocore.exceptions.ConnectionError, botocore.exceptions.ReadTimeoutError)
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=300, jitter=0.2,
+                                   retry_on=TRANSIENT_ERRORS)
+
+
+class EcosystemBackendCache(object):
+    """Process-wide cache of ecosystem backend names used for package name normalization.
+
+    Backends of ecosystems practically never change, entries expire after ttl seconds so
+    a change is eventually picked up without restarting the service.
+    """
+
+    def __init__(self, ttl):
+        """Construct the cache.
+
+        :param ttl: number of seconds after which a cached backend is looked up again
+        """
+        self.ttl = ttl
+        self._lock = Lock()
+        self._backends = {}
+
+    def get(self, session, ecosystem_name):
+        """Get name of the backend of the given ecosystem.
+
+        :param session: database session used if the backend is not cached
+        :param ecosystem_name: name of the ecosystem
+        :return: name of the ecosystem backend
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._backends.get(ecosystem_name)
+
+        if entry is not None and now - entry[1] < self.ttl:
+            return entry[0]
+
+        backend = Ecosystem.by_name(session, ecosystem_name).backend.name
+        with self._lock:
+            self._backends[ecosystem_name] = (backend, now)
+
+        return backend
+
+    def invalidate(self, ecosystem_name=None):
+        """Drop cached backend of the given ecosystem, or of all ecosystems if None."""
+        with self._lock:
+            if ecosystem_name is None:
+                self._backends.clear()
+            else:
+                self._backends.pop(ecosystem_name, None)
+
+
+ECOSYSTEM_BACKENDS = EcosystemBackendCache(configuration.ECOSYSTEM_BACKEND_CACHE_TTL)
+
+
+class SelectQueryCache(object):
+    """Process-wide LRU cache of SQL statements compiled from filter definitions.
+
+    Filters of periodic jobs are the same on each run, entries are keyed by a hash of the
+    canonical JSON form of the filter definition so the key ordering does not matter.
+    """
+
+    def __init__(self, size):
+        """Construct the cache.
+
+        :param size: maximum number of cached statements, 0 disables caching
+        """
+        self.size = size
+        self._lock = Lock()
+        self._statements = OrderedDict()
+
+    @staticmethod
+    def key(filter_definition):
+        """Compute cache key of the given filter definition."""
+        canonical = json.dumps(filter_definition, sort_keys=True, separators=(',', ':'),
+                               default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, filter_definition):
+        """Get SQL statement for the given filter definition, compile it if not cached.
+
+        :param filter_definition: definition of a filter as accepted by select2sql()
+        :return: SELECT statement
+        """
+        if not self.size:
+            return select2sql(filter_definition)
+
+        key = self.key(filter_definition)
+        with self._lock:
+            statement = self._statements.get(key)
+            if statement is not None:
+                self._statements.move_to_end(key)
+                return statement
+
+        # compile a copy, select2sql() should not be able to alter the cached definition
+        statement = select2sql(copy.deepcopy(filter_definition))
+        with self._lock:
+            self._statements[key] = statement
+            while len(self._statements) > self.size:
+                self._statements.popitem(last=False)
+
+        return statement
+
+    def clear(self):
+        """Drop all cached statements."""
+        with self._lock:
+            self._statements.clear()
+
+
+SELECT_QUERIES = SelectQueryCache(configuration.SELECT_QUERY_CACHE_SIZE)
+
+
+class HandlerContext(object):
+    """Process-wide context shared by all handler instances.
+
+    Celery is initialized once per process (each process pool worker initializes its own
+    context after fork) instead of once per handler instance, time spent setting up the
+    context is reported by the f8a_jobs_handler_context_setup_seconds metric. Storage adapters
+    connected by the parent and broker connections pooled by Celery are replaced in forked
+    processes, so they never share connections with the parent.
+    """
+
+    def __init__(self):
+        """Construct the context, it is set up on first use."""
+        self._lock = Lock()
+        # process the context was set up in, state is dropped once used in a forked process
+        self._pid = os.getpid()
+        self._celery_initialized = False
+        self._connected_storages = set()
+
+    def _check_process(self):
+        """Drop state inherited from the parent process, called with the lock held."""
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._reset()
+
+    @staticmethod
+    def _inherited_state(storage):
+        """Get attributes of the storage adapter, including class attributes shared by adapters."""
+        return [dict(vars(storage))] + [dict(vars(cls)) for cls in type(storage).__mro__]
+
+    def _reset(self):
+        """Drop state inherited from the parent process, called with the lock held."""
+        self._celery_initialized = False
+        self._connected_storages = set()
+
+        # selinon keeps adapters connected by the parent in its configuration, connecting them
+        # again replaces their connections without closing the ones of the parent
+        for storage_name, storage in (Config.storage_mapping or {}).items():
+            if storage.is_connected():
+                keep_inherited(self._inherited_state(storage))
+                storage.connect()
+                logging.getLogger(__name__).info("Storage %s inherited from parent process "
+                                                 "connected again in process %d",
+                                                 storage_name, self._pid)
+
+        celery_app = Config.celery_app
+        if celery_app is not None:
+            keep_inherited(vars(celery_app).get('_pool'))
+            keep_inherited(getattr(vars(celery_app).get('amqp'), '_producer_pool', None))
+            # drops broker connection and producer pools, as Celery does in processes it forks
+            celery_app._after_fork()
+
+    def reset(self):
+        """Drop state inherited from the parent process, e.g. in a new process pool worker."""
+        with self._lock:
+            self._pid = os.getpid()
+            self._reset()
+
+    def setup(self):
+        """Initialize Celery and Selinon, if not done in this process yet."""
+        with self._lock:
+            self._check_process()
+            if self._celery_initialized:
+                return
+
+            start = monotonic()
+            init_celery(result_backend=False)
+            self._celery_initialized = True
+            self._report('celery', monotonic() - start)
+
+    def get_storage(self, storage_name):
+        """Get connected Selinon storage, it is connected once per process.
+
+        :param storage_name: name of the storage as stated in Selinon configuration
+        :return: connected storage adapter
+        """
+        with self._lock:
+            self._check_process()
+            if storage_name in self._connected_storages:
+                return StoragePool.get_connected_storage(storage_name)
+
+            start = monotonic()
+            storage = StoragePool.get_connected_storage(storage_name)
+            self._connected_storages.add(storage_name)
+            self._report(storage_name, monotonic() - start)
+            return storage
+
+    @staticmethod
+    def _report(component, duration):
+        """Report time spent setting up a component of the context."""
+        HANDLER_CONTEXT_SETUP.set(duration, component=component)
+        logging.getLogger(__name__).info("Set up %s in process %d in %.3f seconds", component,
+                                         os.getpid(), duration)
+
+
+HANDLER_CONTEXT = HandlerContext()
+
+
 class BaseHandler(object):
     """Base handler class for user defined handlers."""
 
-    _initialized_celery = False
+    # executor pool jobs of the handler are run in (see JOB_SERVICE_EXECUTOR_POOLS), can be
+    # overridden per job; use a process pool for CPU bound handlers
+    executor = 'default'
+    # name of the rate limiter shared by handlers calling the same upstream service, used for
+    # requests made using http_get() (see JOB_SERVICE_RATE_LIMITS)
+    rate_limiter = None
+    # maximum number of jobs of the handler running at the same time, None for no limit
+    # (see JOB_SERVICE_CONCURRENCY_LIMITS)
+    max_concurrency = None
+    # retry policy of failed runs (see RetryPolicy), None to not retry
+    retry_policy = None
 
     def __init__(self, job_id):
         """Construct the instance of the handler class for given job id."""
         self.log = logging.getLogger(__name__)
         self.job_id = job_id
-        # initialize always as the assumption is that we will use it
+        # number of flows dispatched by the handler instance, keyed by flow name
+        self.flows_dispatched = Counter()
+        # number of flows and seconds spent publishing them for each chunk dispatched in batches
+        self.flow_dispatch_chunks = []
+        # results of duplicate dispatch lookups, keyed by flow name and result (see
+        # FlowDeduplicator.lookup())
+        self.flow_dedupe_lookups = Counter()
+        # results of lookups of pages fetched using http_get_cached(), keyed by result (see
+        # HttpCache.get())
+        self.http_cache_lookups = Counter()
+        # batch flows are added to, see flow_dispatch_batch()
+        self._flow_batch = None
+        # session keeping connections to upstream services alive, created on first use
+        self._http_session = None
+        # checkpoints are stored in a separate session so they are not committed along with
+        # changes made by the handler, created on first use
+        self._checkpoint_session = None
+        # id of checkpoints of the job run, set by job_execute() (see JobCheckpoint.compute_id()),
+        # handlers run outside of the scheduler do not store checkpoints
+        self.checkpoint_id = None
+        self._checkpoint_stored_at = monotonic()
+        self._has_checkpoint = False
+        # initialize always as the assumption is that we will use it, done once per process
         self._init_celery()
-        self.postgres = StoragePool.get_connected_storage('BayesianPostgres')
+        self.postgres = HANDLER_CONTEXT.get_storage('BayesianPostgres')
 
     @staticmethod
     def construct_select_query(filter_definition):
@@ -43,13 +337,12 @@ class BaseHandler(object):
         for SELECT construction
         :return:
         """
-        return select2sql(filter_definition)
+        return SELECT_QUERIES.get(filter_definition)
 
-    def _init_celery(self):
-        """Initialize celery and connect to the broker."""
-        if not self._initialized_celery:
-            init_celery(result_backend=False)
-            self._initialized_celery = True
+    @staticmethod
+    def _init_celery():
+        """Initialize celery and connect to the broker, if not done in this process yet."""
+        HANDLER_CONTEXT.setup()
 
     def _normalize_package_name(self, node_args):
         """Normalize package name in node arguments."""
@@ -57,23 +350,247 @@ class BaseHandler(object):
             return
 
         if 'name' in node_args and 'ecosystem' in node_args:
-            ecosystem = Ecosystem.by_name(self.postgres.session, node_args['ecosystem'])
             node_args['name'] = normalize_package_name(
-                ecosystem_backend=ecosystem.backend.name, name=node_args['name']
+                ecosystem_backend=ECOSYSTEM_BACKENDS.get(self.postgres.session,
+                                                         node_args['ecosystem']),
+                name=node_args['name']
             )
 
+    def http_get(self, url, rate_limiter=None, **kwargs):
+        """Perform a GET request respecting the rate limit of the upstream service.
+
+        :param url: URL to be requested
+        :param rate_limiter: name of the rate limiter to use instead of the handler's one
+        :param kwargs: additional arguments passed to requests.Session.get()
+        :return: requests.Response instance
+        """
+        limiter = get_rate_limiter(rate_limiter or self.rate_limiter)
+        if limiter is not None:
+            waited = limiter.acquire()
+            if waited:
+                self.log.debug("Waited %.2f seconds for rate limiter '%s'", waited, limiter.name)
+
+        return self._get_http_session().get(url, **kwargs)
+
+    def http_get_cached(self, url, rate_limiter=None, **kwargs):
+        """Perform a GET request, the response is cached on disk and revalidated once stale.
+
+        Use for pages that do not change often, such as rankings of popular packages, see
+        HttpCache. Fresh pages are served from the cache without a request (and without
+        waiting for the rate limiter).
+
+        :param url: URL to be requested
+        :param rate_limiter: name of the rate limiter to use instead of the handler's one
+        :param kwargs: additional arguments passed to requests.Session.get()
+        :return: requests.Response instance
+        """
+        if not HTTP_CACHE.enabled:
+            return self.http_get(url, rate_limiter=rate_limiter, **kwargs)
+
+        response, lookup = HTTP_CACHE.get(url, self.http_get, rate_limiter=rate_limiter,
+                                          **kwargs)
+        self.http_cache_lookups[lookup] += 1
+        self.log.debug("HTTP cache %s for '%s'", lookup, url)
+        return response
+
+    def http_get_many(self, urls, workers=None, rate_limiter=None, **kwargs):
+        """Perform GET requests concurrently, respecting the rate limit of the upstream service.
+
+        :param urls: URLs to be requested
+        :param workers: maximum number of concurrent requests, JOB_SERVICE_HTTP_FETCH_WORKERS is
+        used if not stated
+        :param rate_limiter: name of the rate limiter to use instead of the handler's one
+        :param kwargs: additional arguments passed to requests.Session.get()
+        :return: generator of requests.Response instances in the order of urls
+        """
+        urls = list(urls)
+        workers = min(workers or configuration.HTTP_FETCH_WORKERS, len(urls))
+        if workers <= 1:
+            for url in urls:
+                yield self.http_get(url, rate_limiter=rate_limiter, **kwargs)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(lambda url: self.http_get(url, rate_limiter=rate_limiter,
+                                                              **kwargs), urls)
+
+    def _get_http_session(self):
+        """Get HTTP session of the handler, connections are reused by subsequent requests."""
+        if self._http_session is None:
+            self._http_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=configuration.HTTP_FETCH_WORKERS)
+            self._http_session.mount('http://', adapter)
+            self._http_session.mount('https://', adapter)
+        return self._http_session
+
+    def _get_checkpoint_session(self):
+        """Get database session used for checkpoints of the job."""
+        if self._checkpoint_session is None:
+            self._checkpoint_session = get_session()
+        return self._checkpoint_session
+
+    def _get_checkpoint_id(self, name):
+        """Get id of the checkpoint of the given name."""
+        return self.checkpoint_id + '/' + name if name else self.checkpoint_id
+
+    def load_checkpoint(self, name=None):
+        """Get the cursor stored by an interrupted run of the job, see save_checkpoint().
+
+        :param name: name of the checkpoint, if the job stores more of them
+        :return: the stored cursor or None if the job should start from the beginning
+        """
+        if not self.checkpoint_id:
+            return None
+
+        cursor = JobCheckpoint.get(self._get_checkpoint_id(name), self.__class__.__name__,
+                                   session=self._get_checkpoint_session())
+        if cursor is not None:
+            self._has_checkpoint = True
+            if name is None:
+                self.log.info("Resuming job '%s' from checkpoint %s", self.job_id, cursor)
+
+        return cursor
+
+    def save_checkpoint(self, cursor, force=False, name=None):
+        """Store a cursor (e.g. the last processed id) the job can be resumed from.
+
+        To keep the overhead low, the cursor is stored at most once per
+        JOB_SERVICE_CHECKPOINT_INTERVAL seconds unless forced. Large data that do not change
+        while the job runs should be stored once in a named checkpoint, so they are not written
+        again with each cursor. All checkpoints are deleted once the job successfully finishes.
+
+        :param cursor: JSON serializable cursor, passed back by load_checkpoint() on the next run
+        :param force: store the cursor regardless of the time the last one was stored
+        :param name: name of the checkpoint, if the job stores more of them
+        :return: True if the cursor was stored
+        """
+        if not self.checkpoint_id:
+            return False
+
+        now = monotonic()
+        if not force and now - self._checkpoint_stored_at < configuration.CHECKPOINT_INTERVAL:
+            return False
+
+        try:
+            JobCheckpoint.store(self._get_checkpoint_id(name), self.__class__.__name__, cursor,
+                                session=self._get_checkpoint_session())
+        except SQLAlchemyError:
+            # the job can continue, it just cannot be resumed from this point
+            self.log.exception("Failed to store checkpoint of job '%s'", self.job_id)
+            return False
+
+        self._checkpoint_stored_at = now
+        self._has_checkpoint = True
+        return True
+
+    def clear_checkpoint(self):
+        """Delete checkpoints of the job so the next run starts from the beginning."""
+        if self._has_checkpoint:
+            JobCheckpoint.clear(self.checkpoint_id, session=self._get_checkpoint_session())
+            self._has_checkpoint = False
+
+    def _flow_chunk_dispatched(self, flows, duration):
+        """Record a chunk of flows dispatched in a batch."""
+        self.flows_dispatched.update(flows)
+        self.flow_dispatch_chunks.append((sum(flows.values()), duration))
+
+    def _claim_flows(self, flows):
+        """Claim flows about to be published, flows dispatched recently are suppressed.
+
+        :param flows: a list of (flow name, node_args) tuples
+        :return: a list of booleans stating which flows should be published
+        """
+        lookups = FLOW_DEDUPLICATOR.lookup_many(flows)
+        for (flow_name, node_args), lookup in zip(flows, lookups):
+            if lookup is not None:
+                self.flow_dedupe_lookups[(flow_name, lookup)] += 1
+            if lookup == FLOW_DEDUPLICATOR.HIT:
+                self.log.debug("Flow '%s' with node_args '%s' was dispatched recently, skipping",
+                               flow_name, node_args)
+        return [lookup != FLOW_DEDUPLICATOR.HIT for lookup in lookups]
+
+    @staticmethod
+    def _flows_discarded(flows):
+        """Forget flows of a batch that were not published, so they can be dispatched again."""
+        FLOW_DEDUPLICATOR.forget_many(flows)
+
+    @contextmanager
+    def flow_dispatch_batch(self, chunk_size=None):
+        """Dispatch flows run using run_selinon_flow*() in chunks instead of one by one.
+
+        Flows are published using one producer (and broker connection) in chunks of chunk_size
+        flows, the rest is published when leaving the context - even if an exception is raised,
+        so flows run before the exception are dispatched.
+
+        :param chunk_size: number of flows published at once, JOB_SERVICE_FLOW_DISPATCH_CHUNK_SIZE
+        is used if not stated
+        """
+        if self._flow_batch is not None:
+            # already batched by the caller
+            yield self._flow_batch
+            return
+
+        self._flow_batch = FlowDispatchBatch(chunk_size, on_chunk=self._flow_chunk_dispatched,
+                                             on_discard=self._flows_discarded,
+                                             claim=self._claim_flows)
+        try:
+            with self._flow_batch:
+                yield self._flow_batch
+        finally:
+            self._flow_batch = None
+
+    def _wait_for_queue(self, flow_name):
+        """Wait while dispatching of the flow is paused as its queue is backed up.
+
+        Only scheduled jobs wait, flows dispatched directly by API calls (handlers constructed
+        without a job id, e.g. the liveness probe) are never held back.
+        """
+        if not self.job_id:
+            return
+
+        waited = BACKPRESSURE.wait(flow_name)
+        if waited:
+            self.log.info("Job '%s' waited %.1f seconds for queue of flow '%s' to drain",
+                          self.job_id, waited, flow_name)
+
     def run_selinon_flow(self, flow_name, node_args):
         """Connect to broker, if not connected, and run Selinon flow.
 
+        Dispatching is paused while the queue of the flow is backed up, see
+        BackpressureController. Flows for a package version dispatched recently with the same
+        arguments (by any handler or the ingestion API) are not dispatched again, see
+        FlowDeduplicator - flows dispatched in a batch are claimed once their chunk is published.
+
         :param flow_name: flow that should be run
         :param node_args: flow arguments
+        :return: dispatcher ID, None if the flow is dispatched in a batch or suppressed as
+        a duplicate
         """
         self._normalize_package_name(node_args)
+        # the flow is claimed only once it can be published, a claim held while waiting would
+        # suppress the flow even if it is never dispatched
+        self._wait_for_queue(flow_name)
 
         if self.job_id:
             node_args['job_id'] = self.job_id
 
-        return run_flow(flow_name, node_args)
+        if self._flow_batch is not None:
+            self._flow_batch.add(flow_name, node_args)
+            return None
+
+        if not self._claim_flows([(flow_name, node_args)])[0]:
+            return None
+
+        published = False
+        try:
+            dispatcher_id = run_flow(flow_name, node_args)
+            published = True
+        finally:
+            if not published:
+                FLOW_DEDUPLICATOR.forget(flow_name, node_args)
+
+        self.flows_dispatched[flow_name] += 1
+        return dispatcher_id
 
     def run_selinon_flow_selective(self, flow_name, task_names, node_args, follow_subflows,
                                    run_subsequent):
@@ -84,6 +601,7 @@ class BaseHandler(object):
         :param node_args: flow arguments
         :param follow_subflows: follow subflows when resolving tasks to be executed
         :param run_subsequent: run tasks that follow after desired tasks stated in task_names
+        :return: dispatcher ID, None if the flow is dispatched in a batch
         """
         if flow_name in ('bayesianFlow', 'bayesianAnalysisFlow'):
             task_names = list(set(task_names) | {'FinalizeTask', 'ResultCollector',
@@ -97,8 +615,16 @@ class BaseHandler(object):
 
         self.log.debug("Scheduling selective Selinon flow '%s' with tasks '%s' and node_args: "
                        "'%s', job '%s'", flow_name, task_names, node_args, self.job_id)
-        return run_flow_selective(flow_name, task_names, node_args, follow_subflows,
-                                  run_subsequent)
+        self._wait_for_queue(flow_name)
+        if self._flow_batch is not None:
+            self._flow_batch.add_selective(flow_name, task_names, node_args, follow_subflows,
+                                           run_subsequent)
+            return None
+
+        dispatcher_id = run_flow_selective(flow_name, task_names, node_args, follow_subflows,
+                                           run_subsequent)
+        self.flows_dispatched[flow_name] += 1
+        return dispatcher_id
 
     @staticmethod
     def is_filter_query(filter_query):
@@ -109,32 +635,105 @@ class BaseHandler(object):
         """
         return isinstance(filter_query, dict) and DEFAULT_FILTER_KEY in filter_query.keys()
 
-    def expand_filter_query(self, filter_definition):
+    def expand_filter_query(self, filter_definition, fetch_size=None):
         """Expand filter arguments and perform database query.
 
+        Rows are streamed from a server-side cursor, fetch_size rows at a time, so memory
+        consumption does not grow with the number of matched rows.
+
         :param filter_definition:
-        :return: expanded filter arguments
+        :param fetch_size: number of rows fetched from database at once,
+        JOB_SERVICE_FILTER_QUERY_FETCH_SIZE is used if not stated
+        :return: generator of expanded filter arguments
         """
+        fetch_size = fetch_size or configuration.FILTER_QUERY_FETCH_SIZE
         # As filters of periodic jobs are stored in memory, copy filter
         # definition so the original is not overwritten
         filter_definition = copy.deepcopy(filter_definition)
         select_statement = self.construct_select_query(
             filter_definition.pop(DEFAULT_FILTER_KEY))
+        # the cursor stays open while records are consumed (possibly for a long time), use
+        # a dedicated connection so the shared session is not held in a transaction and its
+        # commits or rollbacks by other handlers do not close the cursor
+        connection = self.postgres.session.get_bind().connect()
+        try:
+            # stream_results makes psycopg2 use a named (server-side) cursor
+            query_result = connection.execution_options(
+                stream_results=True, max_row_buffer=fetch_size).execute(text(select_statement))
+            try:
+                rows = query_result.fetchmany(fetch_size)
+                while rows:
+                    for r in rows:
+                        # Convert RowResult to key-value pair
+                        record = dict(r)
+                        # Add additional parameters that were supplied besides $filter expansion
+                        record.update(filter_definition)
+                        yield record
+                    rows = query_result.fetchmany(fetch_size)
+            finally:
+                query_result.close()
+        finally:
+            # the transaction of the connection is rolled back when returned to the pool
+            connection.close()
+
+    def explain_select_query(self, select_statement):
+        """Get execution plan of the given SELECT statement, the statement is not executed.
+
+        :param select_statement: SELECT statement as constructed by construct_select_query()
+        :return: output of PostgreSQL EXPLAIN (FORMAT JSON)
+        """
         try:
-            query_result = self.postgres.session.execute(select_statement).fetchall()
+            plan = self.postgres.session.execute(
+                'EXPLAIN (FORMAT JSON) {}'.format(select_statement)).scalar()
         except SQLAlchemyError:
             self.postgres.session.rollback()
             raise
 
-        result = []
-        for r in query_result:
-            # Convert RowResult to key-value pair
-            record = dict(r)
-            # Add additional parameters that were supplied besides $filter expansion
-            record.update(filter_definition)
-            result.append(record)
+        return json.loads(plan) if isinstance(plan, str) else plan
 
-        return result
+    def count_filter_query(self, filter_definition, explain=False):
+        """Count rows a filter would be expanded to, without expanding it.
+
+        :param filter_definition: filter definition as passed to expand_filter_query()
+        :param explain: use the row estimate of the query planner instead of COUNT(*), cheap but
+        possibly inaccurate
+        :return: number of rows
+        """
+        select_statement = self.construct_select_query(filter_definition[DEFAULT_FILTER_KEY])
+        if explain:
+            plan = self.explain_select_query(select_statement)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        statement = 'SELECT COUNT(*) FROM ({}) AS filter_query'.format(select_statement)
+        try:
+            return self.postgres.session.execute(statement).scalar()
+        except SQLAlchemyError:
+            self.postgres.session.rollback()
+            raise
+
+    def count_flow_arguments(self, flow_arguments, explain=False):
+        """Count flows scheduled for the given flow arguments, expanding filters to their counts.
+
+        :param flow_arguments: a list of flow arguments, possibly filter queries
+        :param explain: use row estimates of the query planner for filter queries
+        :return: number of flows
+        """
+        count = 0
+        for node_args in flow_arguments:
+            if self.is_filter_query(node_args):
+                count += self.count_filter_query(node_args, explain=explain)
+            else:
+                count += 1
+        return count
+
+    def estimate_flows(self, explain=False, **kwargs):
+        """Estimate number of flows the job would dispatch, used for dry runs of jobs.
+
+        :param explain: prefer cheap estimates (query planner) over exact counts
+        :param kwargs: handler keyword arguments as passed to execute()
+        :return: CountRange with the minimal and maximal number of flows, None if unknown
+        """
+        return None
 
     def execute(self, **kwargs):
         """User defined job handler implementation."""
@@ -146,6 +745,9 @@ class AnalysesBaseHandler(BaseHandler):
 
     _DEFAULT_COUNT = 1000
     _DEFAULT_NVERSIONS = 3
+    # parsing of scraped HTML pages is CPU bound
+    executor = 'processpool'
+    retry_policy = DEFAULT_RETRY_POLICY
 
     def __init__(self, *args, **kwargs):
         """Construct the instance of the analyses handler class."""
@@ -242,6 +844,16 @@ class AnalysesBaseHandler(BaseHandler):
         if kwargs.get('recursive_limit') is not None and kwargs['recursive_limit'] < 0:
             raise ValueError("Unable to use negative recursive limit")
 
+    def estimate_flows(self, explain=False, count=None, nversions=None, **kwargs):
+        """Estimate number of flows the job would dispatch based on count and nversions.
+
+        Packages can have less versions than requested or can be skipped, the estimate is
+        an upper bound.
+        """
+        count = self.parse_count(count)
+        return CountRange(min=0, max=(count.max - count.min + 1) *
+                          (nversions or self._DEFAULT_NVERSIONS))
+
     def execute(self, ecosystem, popular=True, count=None, nversions=None,
                 force=False, recursive_limit=None, force_graph_sync=False):
         """Run analyses on maven projects.
@@ -261,7 +873,8 @@ class AnalysesBaseHandler(BaseHandler):
         self.recursive_limit = recursive_limit
         self.force_graph_sync = force_graph_sync
 
-        return self.do_execute(popular)
+        with self.flow_dispatch_batch():
+            return self.do_execute(popular)
 
     def do_execute(self, popular=True):
         """Ecosystem specific analyses handler."""
@@ -6,6 +6,7 @@ from sqlalchemy import or_
 from sqlalchemy import and_
 from f8a_worker.models import WorkerResult, Analysis, PackageAnalysis, PackageWorkerResult
 
+from f8a_jobs.models import FlowDispatch
 from .base import BaseHandler
 
 
@@ -23,8 +24,11 @@ class CleanPostgres(BaseHandler):
     """
 
     _SLICE_SIZE = 10
+    # stages of the cleanup stored in checkpoints, package data are cleaned first
+    _STAGE_PACKAGE = 'package'
+    _STAGE_PACKAGE_VERSION = 'package_version'
 
-    def _clean_package_version_data(self, from_date, to_date, clean_unfinished):
+    def _clean_package_version_data(self, from_date, to_date, clean_unfinished, last_id=0):
         # TODO: reduce cyclomatic complexity
         s3 = StoragePool.get_connected_storage('S3Data')
 
@@ -46,10 +50,10 @@ class CleanPostgres(BaseHandler):
         elif not clean_unfinished:
             query = query.filter(Analysis.finished_at.isnot(None))
 
-        start = 0
         while True:
             try:
-                results = query.slice(start, start + self._SLICE_SIZE).all()
+                # keyset pagination, an interrupted cleanup is resumed from the last processed id
+                results = query.filter(WorkerResult.id > last_id).limit(self._SLICE_SIZE).all()
             except SQLAlchemyError:
                 self.postgres.session.rollback()
                 raise
@@ -58,8 +62,8 @@ class CleanPostgres(BaseHandler):
                 self.log.info("Cleaning package-version data finished")
                 break
 
-            self.log.info("Updating results, slice offset is %s", start)
-            start += self._SLICE_SIZE
+            self.log.info("Updating results, last processed id is %s", last_id)
+            last_id = results[-1].id
 
             for entry in results:
                 if entry.worker[0].isupper() or \
@@ -89,7 +93,9 @@ class CleanPostgres(BaseHandler):
 
                 del entry
 
-    def _clean_package_data(self, from_date, to_date, clean_unfinished):
+            self.save_checkpoint({'stage': self._STAGE_PACKAGE_VERSION, 'last_id': last_id})
+
+    def _clean_package_data(self, from_date, to_date, clean_unfinished, last_id=0):
         # TODO: reduce cyclomatic complexity
         s3 = StoragePool.get_connected_storage('S3PackageData')
 
@@ -111,10 +117,11 @@ class CleanPostgres(BaseHandler):
         elif not clean_unfinished:
             query = query.filter(PackageAnalysis.finished_at.isnot(None))
 
-        start = 0
         while True:
             try:
-                results = query.slice(start, start + self._SLICE_SIZE).all()
+                # keyset pagination, an interrupted cleanup is resumed from the last processed id
+                results = query.filter(PackageWorkerResult.id > last_id).\
+                    limit(self._SLICE_SIZE).all()
             except SQLAlchemyError:
                 self.postgres.session.rollback()
                 raise
@@ -123,8 +130,8 @@ class CleanPostgres(BaseHandler):
                 self.log.info("Cleaning package data finished")
                 break
 
-            self.log.info("Updating results, slice offset is %s", start)
-            start += self._SLICE_SIZE
+            self.log.info("Updating results, last processed id is %s", last_id)
+            last_id = results[-1].id
 
             for entry in results:
                 if entry.worker[0].isupper() or \
@@ -153,14 +160,29 @@ class CleanPostgres(BaseHandler):
 
                 del entry
 
+            self.save_checkpoint({'stage': self._STAGE_PACKAGE, 'last_id': last_id})
+
     def execute(self, from_date=None, to_date=None, clean_unfinished=False):
         """Start the data cleaner."""
         if clean_unfinished:
             self.log.warning("Cleaning entries of unfinished analyses, this is DANGEROUS if some "
                              "analysis is in progress!!!")
 
-        self.log.info("Cleaning computed data in package level flow")
-        self._clean_package_data(from_date, to_date, clean_unfinished)
+        checkpoint = self.load_checkpoint() or {}
+
+        if checkpoint.get('stage') != self._STAGE_PACKAGE_VERSION:
+            self.log.info("Cleaning computed data in package level flow")
+            self._clean_package_data(from_date, to_date, clean_unfinished,
+                                     last_id=checkpoint.get('last_id', 0))
+            self.save_checkpoint({'stage': self._STAGE_PACKAGE_VERSION, 'last_id': 0},
+                                 force=True)
+            checkpoint = {}
+
         self.log.info("Cleaning computed data in package-version level flows")
-        self._clean_package_version_data(from_date, to_date, clean_unfinished)
+        self._clean_package_version_data(from_date, to_date, clean_unfinished,
+                                         last_id=checkpoint.get('last_id', 0))
+
+        # expired flows are only overwritten when claimed again, see FlowDeduplicator
+        purged = FlowDispatch.purge_expired()
+        self.log.info("Purged %d expired dispatched flows", purged)
         self.log.info("Cleaning has successfully finished")
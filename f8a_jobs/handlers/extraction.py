@@ -0,0 +1,218 @@
+"""Extraction of data from HTML pages scraped by handlers analysing popular packages.
+
+Handlers need only a handful of elements from each page. Pages are parsed by lxml, which
+builds the tree in C, BeautifulSoup with the pure Python html.parser is used if lxml is not
+installed. Both are wrapped by the same minimal interface - elements are looked up by tag name,
+class, text and attributes the same way BeautifulSoup's find_all() does.
+"""
+
+import bs4
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+LXML = 'lxml'
+BS4 = 'bs4'
+DEFAULT_BACKEND = LXML if lxml is not None else BS4
+
+_EMPTY_PAGE = '<html></html>'
+
+
+def _match_value(value, expected):
+    """Check whether an attribute value or a text matches the expected one.
+
+    :param value: value of the element, None if the element has no such attribute
+    :param expected: expected value, a compiled regular expression or a callable
+    """
+    if value is None:
+        return False
+    if hasattr(expected, 'search'):
+        return expected.search(value) is not None
+    if callable(expected):
+        return expected(value)
+    return value == expected
+
+
+def _match_class(value, expected):
+    """Check whether any of the classes or the whole class attribute matches the expected one."""
+    if value is None:
+        return False
+    return _match_value(value, expected) or \
+        any(_match_value(cls, expected) for cls in value.split())
+
+
+class Element(object):
+    """An element of a parsed HTML page."""
+
+    __slots__ = ('_element',)
+
+    def __init__(self, element):
+        """Wrap the element of the given backend."""
+        self._element = element
+
+    @property
+    def tag(self):
+        """Get tag name of the element."""
+        raise NotImplementedError()
+
+    @property
+    def text(self):
+        """Get text of the element including text of all its descendants."""
+        raise NotImplementedError()
+
+    def get(self, name, default=None):
+        """Get value of the attribute, class is returned as a string (as in HTML)."""
+        raise NotImplementedError()
+
+    def __getitem__(self, name):
+        """Get value of the attribute, raise KeyError if the element has no such attribute."""
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def _descendants(self, tag=None):
+        """Iterate over descendant elements of the given tag (any if None) in document order."""
+        raise NotImplementedError()
+
+    def _matches(self, class_, text, attrs):
+        if class_ is not None and not _match_class(self.get('class'), class_):
+            return False
+        if text is not None and not _match_value(self.text, text):
+            return False
+        return all(_match_value(self.get(name), expected) for name, expected in attrs.items())
+
+    def find_all(self, tag=None, class_=None, text=None, **attrs):
+        """Find all descendant elements matching all the given criteria.
+
+        Each criterion is a string (exact match), a compiled regular expression or a callable
+        accepting the value of the element.
+
+        :param tag: tag name
+        :param class_: one of classes of the element or the whole class attribute
+        :param text: text of the element
+        :param attrs: values of attributes
+        :return: a list of matching elements in document order
+        """
+        return [element for element in self._descendants(tag)
+                if element._matches(class_, text, attrs)]
+
+    def find(self, tag=None, class_=None, text=None, **attrs):
+        """Find the first descendant element matching all the given criteria, see find_all().
+
+        :return: the matching element or None
+        """
+        for element in self._descendants(tag):
+            if element._matches(class_, text, attrs):
+                return element
+        return None
+
+    def find_next(self, tag):
+        """Find the first element of the given tag after the start of this element.
+
+        :param tag: tag name
+        :return: descendant or following element, None if there is no such element
+        """
+        raise NotImplementedError()
+
+
+class LxmlElement(Element):
+    """An element of a page parsed by lxml."""
+
+    __slots__ = ()
+
+    @property
+    def tag(self):
+        """Get tag name of the element."""
+        return self._element.tag
+
+    @property
+    def text(self):
+        """Get text of the element including text of all its descendants."""
+        return self._element.text_content()
+
+    def get(self, name, default=None):
+        """Get value of the attribute."""
+        return self._element.get(name, default)
+
+    def _descendants(self, tag=None):
+        # filtering by tag is done by lxml, comments and processing instructions are skipped
+        for element in self._element.iterdescendants(tag or etree.Element):
+            yield LxmlElement(element)
+
+    def find_next(self, tag):
+        """Find the first element of the given tag after the start of this element."""
+        found = self._element.xpath('(descendant::{tag} | following::{tag})[1]'.format(tag=tag))
+        return LxmlElement(found[0]) if found else None
+
+
+class LxmlPage(LxmlElement):
+    """A page parsed by lxml, the root element is matched as well."""
+
+    __slots__ = ()
+
+    def _descendants(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        yield from super()._descendants(tag)
+
+
+class SoupElement(Element):
+    """An element of a page parsed by BeautifulSoup."""
+
+    __slots__ = ()
+
+    @property
+    def tag(self):
+        """Get tag name of the element."""
+        return self._element.name
+
+    @property
+    def text(self):
+        """Get text of the element including text of all its descendants."""
+        return self._element.get_text()
+
+    def get(self, name, default=None):
+        """Get value of the attribute, class is returned as a string (as in HTML)."""
+        value = self._element.get(name, default)
+        if isinstance(value, list):
+            value = ' '.join(value)
+        return value
+
+    def _descendants(self, tag=None):
+        for element in self._element.descendants:
+            if isinstance(element, bs4.Tag) and (tag is None or element.name == tag):
+                yield SoupElement(element)
+
+    def find_next(self, tag):
+        """Find the first element of the given tag after the start of this element."""
+        found = self._element.find_next(tag)
+        return SoupElement(found) if found is not None else None
+
+
+def parse(text, backend=None):
+    """Parse the HTML page.
+
+    :param text: HTML page
+    :param backend: parser to be used, LXML or BS4, lxml is used if installed by default
+    :return: Element representing the whole page
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == BS4:
+        return SoupElement(bs4.BeautifulSoup(text, 'html.parser'))
+
+    if not text or not text.strip():
+        text = _EMPTY_PAGE
+
+    try:
+        root = lxml.html.document_fromstring(text)
+    except ValueError:
+        # unicode strings with an encoding declaration are not accepted by lxml
+        root = lxml.html.document_fromstring(text.encode())
+    except etree.ParserError:
+        root = lxml.html.document_fromstring(_EMPTY_PAGE)
+
+    return LxmlPage(root)
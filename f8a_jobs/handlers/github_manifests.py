@@ -2,13 +2,14 @@
 
 import urllib.parse
 from selinon import StoragePool
-from f8a_jobs.handlers.base import BaseHandler
+from f8a_jobs.handlers.base import BaseHandler, DEFAULT_RETRY_POLICY
 
 
 class GitHubManifests(BaseHandler):
     """Collect and process manifest files from given GitHub repositories."""
 
     GITHUB_URL = 'https://github.com/'
+    retry_policy = DEFAULT_RETRY_POLICY
 
     def execute(self, repositories, skip_if_exists):
         """Collect and process manifest files from given GitHub repositories.
@@ -3,7 +3,7 @@
 import requests
 import urllib.parse
 from selinon import StoragePool
-from f8a_jobs.handlers.base import BaseHandler
+from f8a_jobs.handlers.base import BaseHandler, DEFAULT_RETRY_POLICY
 from f8a_jobs.utils import get_gh_token
 
 
@@ -24,6 +24,11 @@ class GitHubMostStarred(BaseHandler):
 
     _MIN_STARS_DEFAULT = 500
 
+    # the search API allows only a few requests per minute
+    rate_limiter = 'api.github.com'
+    max_concurrency = 1
+    retry_policy = DEFAULT_RETRY_POLICY
+
     def __init__(self, *args, **kwargs):
         """Initialize instance of the GitHubMostStarred class."""
         super().__init__(*args, **kwargs)
@@ -56,7 +61,7 @@ class GitHubMostStarred(BaseHandler):
 
         def get(lang, page_number):
             url = url_template.format(lang=lang, stars=self._get_stars_filter(), page=page_number)
-            response = requests.get(url, params={'access_token': get_gh_token()})
+            response = self.http_get(url, params={'access_token': get_gh_token()})
             result = []
             if response.status_code == 200:
                 content = response.json()
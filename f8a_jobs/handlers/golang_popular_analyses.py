@@ -1,8 +1,7 @@
 """Schedule analyses for golang packages.."""
 
-from bs4 import BeautifulSoup
-import requests
 from .base import AnalysesBaseHandler
+from .extraction import parse
 
 
 class GolangPopularAnalyses(AnalysesBaseHandler):
@@ -10,14 +9,19 @@ class GolangPopularAnalyses(AnalysesBaseHandler):
 
     # API documentation: http://go-search.org/infoapi
     _URL = 'http://go-search.org/api'
+    # used for commit pages of repositories, see _get_latest_commit()
+    _GITHUB_RATE_LIMITER = 'github.com'
+
+    # used for requests to the API, see _URL
+    rate_limiter = 'go-search.org'
 
     def _get_latest_commit(self, package):
         if package.startswith('github.com'):
             repo_base = "/".join(package.split("/")[:3])  # select base url of the github repo
             url = 'https://{p}/commits/master'.format(p=repo_base)
-            response = requests.get(url)
+            response = self.http_get(url, rate_limiter=self._GITHUB_RATE_LIMITER)
             if response.status_code == 200:
-                page = BeautifulSoup(response.text, 'html.parser')
+                page = parse(response.text)
                 commit_links = page.find_all(class_='commit-links-group BtnGroup')
                 if commit_links:
                     commit_tag = commit_links[0].find_next('a')
@@ -32,7 +36,7 @@ class GolangPopularAnalyses(AnalysesBaseHandler):
         """Schedule analyses of popular packages in golang."""
         endpoint = self._URL + '?action=tops&len=100'
 
-        response = requests.get(endpoint)
+        response = self.http_get(endpoint)
         response.raise_for_status()
 
         packages_seen = set()
@@ -76,7 +80,7 @@ class GolangPopularAnalyses(AnalysesBaseHandler):
     def _packages(self):
         """Schedule analyses of packages in golang (no sort criteria)."""
         endpoint = self._URL + '?action=packages'
-        response = requests.get(endpoint)
+        response = self.http_get(endpoint)
         response.raise_for_status()
 
         packages_scheduled = 0
@@ -90,6 +94,10 @@ class GolangPopularAnalyses(AnalysesBaseHandler):
         self.log.info("Job has finished - scheduled analyses for %d golang projects",
                       packages_scheduled)
 
+    def estimate_flows(self, explain=False, count=None, nversions=None, **kwargs):
+        """Estimate number of flows the job would dispatch, only the latest commit is analysed."""
+        return super().estimate_flows(explain=explain, count=count, nversions=1)
+
     def do_execute(self, popular=True):
         """Run core analyse on golang packages.
 
@@ -5,7 +5,7 @@ import urllib
 import concurrent.futures
 import requests
 
-from .base import BaseHandler
+from .base import BaseHandler, DEFAULT_RETRY_POLICY
 
 
 class InvokeGraphSync(BaseHandler):
@@ -27,6 +27,7 @@ class InvokeGraphSync(BaseHandler):
         host=_SERVICE_HOST, port=_SERVICE_PORT, endpoint=_INGEST_SERVICE_ENDPOINT)
 
     BATCH_SIZE = 10
+    retry_policy = DEFAULT_RETRY_POLICY
 
     def _fetch_all_counts(self, params=None):
         if params is None:
@@ -2,13 +2,17 @@
 
 from selinon import StoragePool
 from sqlalchemy import text
-from .base import BaseHandler
+from .base import BaseHandler, DEFAULT_RETRY_POLICY
 import os
 
 
 class KronosDataUpdater(BaseHandler):
     """Class to append new data for Kronos training."""
 
+    # crunching of analyses results is CPU bound
+    executor = 'processpool'
+    retry_policy = DEFAULT_RETRY_POLICY
+
     def __init__(self, *args, **kwargs):
         """Initialize instance of the KronosDataUpdater class."""
         super().__init__(*args, **kwargs)
@@ -0,0 +1,197 @@
+"""Synchronization of the maven central index used by maven-index-checker with S3.
+
+The index (a Lucene index of gigabytes) is kept in MAVEN_INDEX_CHECKER_DATA_PATH between runs,
+mount a persistent volume there to benefit from it. Files of the index are stored in the
+S3MavenIndex bucket as segments addressed by SHA-256 of their content along with a manifest
+mapping file paths to segments. Lucene never modifies written files, an index update adds new
+files and drops merged ones, so only files not present on the other side are transferred.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from shutil import rmtree
+
+import botocore.exceptions
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(path):
+    """Compute SHA-256 of the file content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _segments(manifest):
+    """Get mapping of file paths to segments (content hashes) stated in the manifest."""
+    return {path: entry['sha256'] for path, entry in manifest['files'].items()}
+
+
+class MavenIndexSync(object):
+    """Local copy of the maven central index kept in sync with the copy in S3."""
+
+    _PREFIX = 'central-index/'
+    _MANIFEST_KEY = _PREFIX + 'manifest.json'
+    _SEGMENT_KEY = _PREFIX + 'segments/{}'
+    # maximum number of keys deleted by a single request
+    _DELETE_BATCH_SIZE = 1000
+
+    def __init__(self, s3, data_dir):
+        """Construct the index synchronization.
+
+        :param s3: S3MavenIndex storage instance
+        :param data_dir: maven-index-checker data directory, the index is in its central-index/
+        """
+        self.s3 = s3
+        self.data_dir = data_dir
+        self.index_dir = os.path.join(data_dir, 'central-index')
+        # state of the last synchronization - the manifest in S3 and hashes of local files
+        self._state_path = os.path.join(data_dir, 'central-index.state.json')
+        self._bucket = s3._s3.Bucket(s3.bucket_name)
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'manifest': None, 'files': {}}
+
+    def _save_state(self, manifest, files):
+        fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'manifest': manifest, 'files': files}, f)
+        os.replace(tmp_path, self._state_path)
+
+    def _remote_manifest(self):
+        """Get the manifest of the index stored in S3, None if there is no such index."""
+        try:
+            body = self._bucket.Object(self._MANIFEST_KEY).get()['Body'].read()
+        except botocore.exceptions.ClientError as exc:
+            if exc.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(body.decode())
+
+    def _scan(self, known_files):
+        """Describe files of the local index, hashes of files not modified are reused.
+
+        :param known_files: files described by a previous scan
+        :return: dict mapping paths relative to the index directory to their size, mtime (in
+        nanoseconds) and SHA-256
+        """
+        files = {}
+        for root, _, names in os.walk(self.index_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, self.index_dir)
+                stat = os.stat(path)
+                known = known_files.get(relpath)
+                if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+                    files[relpath] = known
+                else:
+                    files[relpath] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                                      'sha256': _sha256(path)}
+        return files
+
+    def _download(self, relpath, entry):
+        path = os.path.join(self.index_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            self._bucket.download_file(self._SEGMENT_KEY.format(entry['sha256']), tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        # the index checker detects updates of the index by mtime of its files
+        os.utime(path, ns=(entry['mtime'], entry['mtime']))
+        self.bytes_downloaded += entry['size']
+
+    def pull(self):
+        """Update the local index to match the index stored in S3, if there is any.
+
+        Nothing is transferred if the index in S3 did not change since the last synchronization
+        of the local index.
+        """
+        state = self._load_state()
+        manifest = self._remote_manifest()
+        if manifest is None:
+            if not os.path.isdir(self.index_dir):
+                # the index is stored as a single archive by previous versions
+                logger.info("No maven index segments in S3, fetching index archive if available")
+                self.s3.retrieve_index_if_exists(self.data_dir)
+            return
+
+        if state['manifest'] is not None and os.path.isdir(self.index_dir) and \
+                _segments(state['manifest']) == _segments(manifest):
+            logger.info("Local maven index is up-to-date with S3")
+            return
+
+        files = self._scan(state['files'])
+        for relpath, entry in manifest['files'].items():
+            if relpath not in files or files[relpath]['sha256'] != entry['sha256']:
+                self._download(relpath, entry)
+                files[relpath] = dict(entry)
+
+        for relpath in set(files) - set(manifest['files']):
+            os.unlink(os.path.join(self.index_dir, relpath))
+            del files[relpath]
+
+        self._save_state(manifest, files)
+        logger.info("Local maven index updated from S3, %d bytes downloaded",
+                    self.bytes_downloaded)
+
+    def push(self):
+        """Store files of the local index not present in S3 yet and update the manifest.
+
+        :return: True if the index in S3 was updated, False if it did not change
+        """
+        state = self._load_state()
+        files = self._scan(state['files'])
+        manifest = {'files': files}
+        remote = self._remote_manifest() or {'files': {}}
+
+        if _segments(remote) == _segments(manifest):
+            logger.info("Maven index in S3 is up-to-date, nothing to store")
+            self._save_state(remote, files)
+            return False
+
+        stored = set(_segments(remote).values())
+        for relpath, entry in files.items():
+            if entry['sha256'] not in stored:
+                self._bucket.upload_file(os.path.join(self.index_dir, relpath),
+                                         self._SEGMENT_KEY.format(entry['sha256']))
+                stored.add(entry['sha256'])
+                self.bytes_uploaded += entry['size']
+
+        self._bucket.Object(self._MANIFEST_KEY).put(Body=json.dumps(manifest).encode())
+
+        # segments are dropped only once the new manifest no longer refers to them
+        unused = sorted(set(_segments(remote).values()) - set(_segments(manifest).values()))
+        for idx in range(0, len(unused), self._DELETE_BATCH_SIZE):
+            self._bucket.delete_objects(Delete={'Objects': [
+                {'Key': self._SEGMENT_KEY.format(segment)}
+                for segment in unused[idx:idx + self._DELETE_BATCH_SIZE]
+            ]})
+
+        self._save_state(manifest, files)
+        logger.info("Maven index stored to S3, %d bytes uploaded, %d unused segments deleted",
+                    self.bytes_uploaded, len(unused))
+        return True
+
+    def discard(self):
+        """Drop the local index, e.g. when an update failed, so it is pulled again next time."""
+        rmtree(self.index_dir, ignore_errors=True)
+        try:
+            os.unlink(self._state_path)
+        except FileNotFoundError:
+            pass
@@ -1,25 +1,94 @@
 """Analyse top maven popular projects."""
 
-import bs4
+from bisect import bisect_left
 from collections import OrderedDict
 import os
 import re
-import requests
 import tempfile
 from selinon import StoragePool
 from shutil import rmtree
 
 from .base import AnalysesBaseHandler
+from .extraction import parse
+from .maven_index import MavenIndexSync
 from f8a_worker.utils import cwd, TimedCommand
 from f8a_worker.errors import TaskError
 
 
+class AnalysedPackagesIndex(object):
+    """Sorted names of packages of an ecosystem with at least one version analysed.
+
+    Results of analyses are stored in S3 under '<ecosystem>/<package>/' keys. Package names are
+    taken from a single listing of the ecosystem grouped by package name (1000 packages per
+    request) instead of listing the keys of each package separately, unless there are only a few
+    packages to look up (see for_packages()).
+    """
+
+    # estimated number of requests listing all analysed packages of an ecosystem takes, looking
+    # up fewer packages one by one is cheaper than the listing
+    EXPECTED_LISTING_PAGES = 100
+
+    def __init__(self, names):
+        """Construct the index from package names."""
+        self._names = sorted(set(names))
+
+    @classmethod
+    def from_bucket(cls, bucket, ecosystem):
+        """Build the index by listing the bucket with results of analyses.
+
+        :param bucket: boto3 Bucket resource
+        :param ecosystem: name of the ecosystem
+        :return: AnalysedPackagesIndex instance
+        """
+        prefix = '{}/'.format(ecosystem)
+        paginator = bucket.meta.client.get_paginator('list_objects_v2')
+        names = []
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', ()):
+                # 'maven/junit:junit/' -> 'junit:junit'
+                names.append(common_prefix['Prefix'][len(prefix):-1])
+        return cls(names)
+
+    @classmethod
+    def for_packages(cls, bucket, ecosystem, names):
+        """Build the index for lookups of the given packages using the fewest requests.
+
+        :param bucket: boto3 Bucket resource
+        :param ecosystem: name of the ecosystem
+        :param names: names of packages that will be looked up in the index
+        :return: AnalysedPackagesIndex instance, complete only if built from the listing
+        """
+        names = set(names)
+        if len(names) >= cls.EXPECTED_LISTING_PAGES:
+            return cls.from_bucket(bucket, ecosystem)
+
+        analysed = []
+        for name in names:
+            response = bucket.meta.client.list_objects_v2(
+                Bucket=bucket.name, Prefix='{}/{}/'.format(ecosystem, name), MaxKeys=1)
+            if response.get('KeyCount'):
+                analysed.append(name)
+        return cls(analysed)
+
+    def __contains__(self, name):
+        """Check whether some version of the package was analysed."""
+        idx = bisect_left(self._names, name)
+        return idx < len(self._names) and self._names[idx] == name
+
+    def __len__(self):
+        """Get number of packages with at least one version analysed."""
+        return len(self._names)
+
+
 class MavenPopularAnalyses(AnalysesBaseHandler):
     """Analyse top maven popular projects."""
 
     _BASE_URL = 'http://mvnrepository.com'
     _MAX_PAGES = 10
 
+    rate_limiter = 'mvnrepository.com'
+    max_concurrency = 2
+
     def __init__(self, *args, **kwargs):
         """Create and instance of this analyse handler."""
         super().__init__(*args, **kwargs)
@@ -28,11 +97,8 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
 
     @staticmethod
     def _find_versions(project_page, latest_version_only=False):
-        def _has_numeric_usages(tag):
-            return tag.has_attr('href') and \
-                   tag.get('href').endswith('/usages') and \
-                   tag.get_text().replace(',', '').isnumeric()
-        usage_tags = project_page.find_all(_has_numeric_usages)
+        usage_tags = project_page.find_all(href=lambda href: href.endswith('/usages'),
+                                           text=lambda text: text.replace(',', '').isnumeric())
         if usage_tags and not latest_version_only:
             # sort according to usage
             usage_tags = sorted(usage_tags, key=lambda u: int(u.text.replace(',', '')),
@@ -50,11 +116,27 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
             versions = [v.text for v in versions]
         return versions
 
+    def _schedule_project(self, name, all_versions):
+        """Schedule analyses of the project if it falls into the requested count window."""
+        versions = all_versions[:self.nversions]
+        self.log.debug("Scheduling #%d. (number versions: %d)", self.nprojects, self.nversions)
+        self.projects[name] = versions
+        self.nprojects += 1
+        for version in versions:
+            if self.count.min <= self.nprojects <= self.count.max:
+                self.analyses_selinon_flow(name, version)
+            else:
+                self.log.debug("Skipping scheduling for #%d. (min=%d, max=%d, name=%s, "
+                               "version=%s)", self.nprojects, self.count.min, self.count.max,
+                               name, version)
+
     def _projects_from(self, url_suffix):
         """Scrape the selected page @ http://mvnrepository.com.
 
+        Artifact pages listed on a page are fetched concurrently (see http_get_many()), at most
+        as many as there are projects still missing, and processed in the order of popularity.
+
         :param url_suffix: to add to _BASE_URL
-        :return: 2-tuple of (dict of {project_name: [versions]}, number of found projects)
         """
         if not url_suffix.startswith('/'):
             url_suffix = '/' + url_suffix
@@ -62,34 +144,30 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
             page_link = '{base_url}{url_suffix}?p={page}'.format(base_url=self._BASE_URL,
                                                                  url_suffix=url_suffix,
                                                                  page=page)
-            pop = requests.get(page_link)
-            poppage = bs4.BeautifulSoup(pop.text, 'html.parser')
+            pop = self.http_get(page_link)
+            poppage = parse(pop.text)
+            artifacts = OrderedDict()
             for link in poppage.find_all('a', class_='im-usage'):
                 # <a class="im-usage" href="/artifact/junit/junit/usages"><b>56,752</b> usages</a>
                 artifact = link.get('href')[0:-len('/usages')]
-                artifact_link = '{url}{a}'.format(url=self._BASE_URL, a=artifact)
-                art = requests.get(artifact_link)
-                artpage = bs4.BeautifulSoup(art.text, 'html.parser')
                 name = artifact[len('/artifact/'):].replace('/', ':')
-                all_versions = self._find_versions(artpage, self.nversions == 1)
-                if name not in self.projects and all_versions:
-                    versions = all_versions[:self.nversions]
-                    self.log.debug("Scheduling #%d. (number versions: %d)",
-                                   self.nprojects, self.nversions)
-                    self.projects[name] = versions
-                    self.nprojects += 1
-                    for version in versions:
-                        # TODO: this can be unrolled
-                        if self.count.min <= self.nprojects <= self.count.max:
-                            self.analyses_selinon_flow(name, version)
-                        else:
-                            self.log.debug("Skipping scheduling for #%d. (min=%d, max=%d, "
-                                           "name=%s, version=%s)",
-                                           self.nprojects, self.count.min, self.count.max, name,
-                                           version)
-
-                    if self.nprojects >= self.count.max:
-                        return
+                if name not in self.projects:
+                    artifacts[name] = '{url}{a}'.format(url=self._BASE_URL, a=artifact)
+
+            artifacts = list(artifacts.items())
+            while artifacts and self.nprojects < self.count.max:
+                # do not fetch pages of projects that would not be needed
+                missing = self.count.max - self.nprojects
+                window, artifacts = artifacts[:missing], artifacts[missing:]
+                pages = self.http_get_many(artifact_link for _, artifact_link in window)
+                for (name, _), art in zip(window, pages):
+                    artpage = parse(art.text)
+                    all_versions = self._find_versions(artpage, self.nversions == 1)
+                    if all_versions:
+                        self._schedule_project(name, all_versions)
+
+            if self.nprojects >= self.count.max:
+                return
 
     def _top_projects(self):
         """Scrape Top Projects page @ http://mvnrepository.com/popular."""
@@ -101,8 +179,8 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
         for page in range(1, self._MAX_PAGES + 1):
             page_link = '{url}/open-source?p={page}'.format(url=self._BASE_URL, page=page)
             self.log.debug('Scraping Top Categories page %s' % page_link)
-            cat = requests.get(page_link)
-            catpage = bs4.BeautifulSoup(cat.text, 'html.parser')
+            cat = self.http_get_cached(page_link)
+            catpage = parse(cat.text)
             # [<a href="/open-source/testing-frameworks">more...</a>]
             for link in catpage.find_all('a', text='more...'):
                 category = link.get('href')
@@ -114,8 +192,8 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
         """Scrape Popular Tags page @ http://mvnrepository.com/tags."""
         page_link = '{url}/tags'.format(url=self._BASE_URL)
         self.log.debug('Scraping Popular Tags page %s' % page_link)
-        tags_page = requests.get(page_link)
-        tagspage = bs4.BeautifulSoup(tags_page.text, 'html.parser')
+        tags_page = self.http_get_cached(page_link)
+        tagspage = parse(tags_page.text)
         tags_a = tagspage.find_all('a', class_=re.compile('t[1-9]'))
         # [<a class="t4" href="/tags/accumulo">accumulo</a>,
         #  <a class="t7" href="/tags/actor">actor</a>]
@@ -135,8 +213,9 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
         timestamp_path = os.path.join(central_index_dir, 'timestamp')
 
         s3 = StoragePool.get_connected_storage('S3MavenIndex')
-        self.log.info('Fetching pre-built maven index from S3, if available.')
-        s3.retrieve_index_if_exists(maven_index_checker_data_dir)
+        index = MavenIndexSync(s3, maven_index_checker_data_dir)
+        self.log.info('Synchronizing pre-built maven index with S3, if available.')
+        index.pull()
 
         old_timestamp = 0
         try:
@@ -163,33 +242,33 @@ class MavenPopularAnalyses(AnalysesBaseHandler):
                 new_timestamp = int(os.stat(timestamp_path).st_mtime)
                 if old_timestamp != new_timestamp:
                     self.log.info('Storing pre-built maven index to S3...')
-                    s3.store_index(maven_index_checker_data_dir)
+                    index.push()
                     self.log.debug('Stored. Index in S3 is up-to-date.')
                 else:
                     self.log.info('Index in S3 is up-to-date.')
             except TaskError as e:
                 self.log.exception(e)
+                # the index may be left half-updated, start over from the copy in S3 next time
+                index.discard()
                 raise
             finally:
-                rmtree(central_index_dir)
-                self.log.debug('central-index/ deleted')
                 rmtree(java_temp_dir)
 
             s3data = StoragePool.get_connected_storage('S3Data')
-            bucket = s3data._s3.Bucket(s3data.bucket_name)
+            analysed = AnalysedPackagesIndex.for_packages(
+                s3data._s3.Bucket(s3data.bucket_name), self.ecosystem,
+                ('{}:{}'.format(release['groupId'], release['artifactId']) for release in output))
+            self.log.info("%d packages with analysed versions found in S3", len(analysed))
             for idx, release in enumerate(output):
                 name = '{}:{}'.format(release['groupId'], release['artifactId'])
                 version = release['version']
                 # For now (can change in future) we want to analyze only ONE version of each package
-                try:
-                    next(iter(bucket.objects.filter(Prefix='{e}/{p}/'.format(
-                        e=self.ecosystem, p=name)).limit(1)))
+                if name in analysed:
                     self.log.info("Analysis of some version of %s has already been scheduled, "
                                   "skipping version %s", name, version)
                     continue
-                except StopIteration:
-                    self.log.info("Scheduling #%d.", self.count.min + idx)
-                    self.analyses_selinon_flow(name, version)
+                self.log.info("Scheduling #%d.", self.count.min + idx)
+                self.analyses_selinon_flow(name, version)
 
     def do_execute(self, popular=True):
         """Run core analyse on maven projects.
@@ -10,13 +10,54 @@ from f8a_worker.errors import TaskError
 from selinon import StoragePool
 
 from .base import BaseHandler
+from .maven_index import MavenIndexSync
 
 
 class MavenReleasesAnalyses(BaseHandler):
     """Trigger analysis of newly released maven packages."""
 
+    # name of the checkpoint holding new releases found by the last index check
+    _ENTRIES_CHECKPOINT = 'entries'
+
+    def _schedule_analyses(self, s3, current_count, entries, scheduled=0):
+        """Schedule analyses of new releases and move the last offset in S3.
+
+        :param s3: S3MavenIndex storage instance
+        :param current_count: number of entries in maven index
+        :param entries: new releases as reported by maven-index-checker
+        :param scheduled: number of entries already scheduled by an interrupted run
+        """
+        self.log.info("Found %d new packages to analyse, scheduling analyses...",
+                      len(entries) - scheduled)
+        for index, entry in enumerate(entries[scheduled:], start=scheduled + 1):
+            self.log.info("{}__:__{}__:__{}"
+                          .format("MavenReleasesAnalyses", "Running ingestion for", entry))
+            self.run_selinon_flow('bayesianFlow', {
+                'ecosystem': 'maven',
+                'name': '{groupId}:{artifactId}'.format(**entry),
+                'version': entry['version'],
+                'recursive_limit': 0
+            })
+            # entries are stored once in a separate checkpoint, only the progress is updated
+            self.save_checkpoint({'count': current_count, 'scheduled': index})
+
+        self.log.info("{}__:__{}__:__{}"
+                      .format("MavenReleasesAnalyses", "current_count", current_count))
+        s3.set_last_offset(current_count)
+        self.log.info("All new maven releases scheduled for analysis, exiting..")
+
     def execute(self):
         """Start the analysis."""
+        checkpoint = self.load_checkpoint()
+        entries = self.load_checkpoint(self._ENTRIES_CHECKPOINT) if checkpoint else None
+        if entries is not None:
+            # checking the index takes hours, finish scheduling of releases found last time
+            self.log.info("Resuming scheduling of %d new releases, skipping index check",
+                          len(entries) - checkpoint['scheduled'])
+            self._schedule_analyses(StoragePool.get_connected_storage('S3MavenIndex'),
+                                    checkpoint['count'], entries, checkpoint['scheduled'])
+            return
+
         self.log.info("Checking maven index for new releases")
         maven_index_checker_dir = os.getenv('MAVEN_INDEX_CHECKER_PATH')
         maven_index_checker_data_dir = os.environ.get('MAVEN_INDEX_CHECKER_DATA_PATH',
@@ -35,8 +76,9 @@ class MavenReleasesAnalyses(BaseHandler):
                       .format("MavenReleasesAnalyses", "timestamp_path", timestamp_path))
 
         s3 = StoragePool.get_connected_storage('S3MavenIndex')
-        self.log.info('Fetching pre-built maven index from S3, if available.')
-        s3.retrieve_index_if_exists(maven_index_checker_data_dir)
+        index = MavenIndexSync(s3, maven_index_checker_data_dir)
+        self.log.info('Synchronizing pre-built maven index with S3, if available.')
+        index.pull()
 
         old_timestamp = 0
         try:
@@ -68,7 +110,7 @@ class MavenReleasesAnalyses(BaseHandler):
                 new_timestamp = int(os.stat(timestamp_path).st_mtime)
                 if old_timestamp != new_timestamp:
                     self.log.info('Storing pre-built maven index to S3...')
-                    s3.store_index(maven_index_checker_data_dir)
+                    index.push()
                     self.log.debug('Stored. Index in S3 is up-to-date.')
                     if old_timestamp == 0:
                         s3.set_last_offset(current_count)
@@ -103,25 +145,12 @@ class MavenReleasesAnalyses(BaseHandler):
                 self.log.info("{}__:__{}__:__{}"
                               .format("MavenReleasesAnalyses", "TaskError", e))
                 self.log.exception(e)
+                # the index may be left half-updated, start over from the copy in S3 next time
+                index.discard()
                 raise
             finally:
-                rmtree(central_index_dir)
-                self.log.debug('central-index/ deleted')
                 rmtree(java_temp_dir)
 
-            self.log.info("Found %d new packages to analyse, scheduling analyses...",
-                          len(output))
-            for entry in output:
-                self.log.info("{}__:__{}__:__{}"
-                              .format("MavenReleasesAnalyses", "Running ingestion for", entry))
-                self.run_selinon_flow('bayesianFlow', {
-                    'ecosystem': 'maven',
-                    'name': '{groupId}:{artifactId}'.format(**entry),
-                    'version': entry['version'],
-                    'recursive_limit': 0
-                })
-
-        self.log.info("{}__:__{}__:__{}"
-                      .format("MavenReleasesAnalyses", "current_count", current_count))
-        s3.set_last_offset(current_count)
-        self.log.info("All new maven releases scheduled for analysis, exiting..")
+        self.save_checkpoint(output, force=True, name=self._ENTRIES_CHECKPOINT)
+        self.save_checkpoint({'count': current_count, 'scheduled': 0}, force=True)
+        self._schedule_analyses(s3, current_count, output)
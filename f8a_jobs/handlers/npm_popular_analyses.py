@@ -1,9 +1,8 @@
 """Analyse top npm popular packages."""
 
 import json
-import bs4
-import requests
 from .base import AnalysesBaseHandler
+from .extraction import parse
 
 
 class NpmPopularAnalyses(AnalysesBaseHandler):
@@ -13,9 +12,15 @@ class NpmPopularAnalyses(AnalysesBaseHandler):
     _URL_POPULAR = 'https://www.npmjs.com/browse'
     _POPULAR_PACKAGES_PER_PAGE = 36
 
+    # used for requests to the registry, see _URL_REGISTRY
+    rate_limiter = 'skimdb.npmjs.com'
+    # used for browse pages, a different service than the registry
+    _POPULAR_RATE_LIMITER = 'www.npmjs.com'
+    max_concurrency = 2
+
     def _schedule_from_npm_registry(self, package, offset):
         """Schedule analyses of specific versions using skimdb.npmjs.com API."""
-        package_info = requests.get(self._URL_REGISTRY + package).json()
+        package_info = self.http_get(self._URL_REGISTRY + package).json()
 
         if self.nversions == 1:
             self.log.debug("Scheduling #%d. (latest version)", self.count.min + offset)
@@ -36,8 +41,9 @@ class NpmPopularAnalyses(AnalysesBaseHandler):
         """Schedule analyses for popular NPM packages."""
         # set offset to -2 so we skip the very first line
         offset = -2
-        stream = requests.get(self._URL_REGISTRY + '_all_docs?skip={}&limit={}'
-                              .format(self.count.min, self.count.max - self.count.min), stream=True)
+        stream = self.http_get(self._URL_REGISTRY + '_all_docs?skip={}&limit={}'
+                               .format(self.count.min, self.count.max - self.count.min),
+                               stream=True)
         stream.raise_for_status()
 
         # this solution might be ugly, but is quiet efficient compared to downloading info
@@ -68,9 +74,10 @@ class NpmPopularAnalyses(AnalysesBaseHandler):
         scheduled = 0
         count = self.count.max - self.count.min + 1
         for offset in range(self.count.min - 1, self.count.max, self._POPULAR_PACKAGES_PER_PAGE):
-            pop = requests.get('{url}/depended?offset={offset}'.format(url=self._URL_POPULAR,
-                                                                       offset=offset))
-            poppage = bs4.BeautifulSoup(pop.text, 'html.parser')
+            pop = self.http_get_cached('{url}/depended?offset={offset}'
+                                       .format(url=self._URL_POPULAR, offset=offset),
+                                       rate_limiter=self._POPULAR_RATE_LIMITER)
+            poppage = parse(pop.text)
             for link in poppage.find_all('a', class_='type-neutral-1'):
                 self._schedule_from_npm_registry(link.get('href')[len('/package/'):], scheduled)
                 scheduled += 1
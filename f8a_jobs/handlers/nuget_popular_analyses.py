@@ -1,10 +1,9 @@
 """Analyse popular nuget packages."""
 
-from bs4 import BeautifulSoup
 from re import compile as re_compile
-from requests import get
 
 from .base import AnalysesBaseHandler
+from .extraction import parse
 from f8a_worker.solver import NugetReleasesFetcher
 
 
@@ -21,11 +20,11 @@ class NugetPopularAnalyses(AnalysesBaseHandler):
         last_page = ((self.count.max - 1) // self._POPULAR_PACKAGES_PER_PAGE) + 1
         for page in range(first_page, last_page + 1):
             url = self._URL.format(page=page)
-            pop = get(url)
+            pop = self.http_get_cached(url)
             if not pop.ok:
                 self.log.warning('Couldn\'t get url %r' % url)
                 continue
-            poppage = BeautifulSoup(pop.text, 'html.parser')
+            poppage = parse(pop.text)
             packages = poppage.find_all('article', class_='package')
             if len(packages) == 0:
                 # (probably not needed anymore) previous nuget.org version had different structure
@@ -1,8 +1,7 @@
 """Analyse top npm popular packages."""
 
-import bs4
-import requests
 from .base import AnalysesBaseHandler
+from .extraction import parse
 try:
     import xmlrpclib
 except ImportError:
@@ -63,10 +62,11 @@ class PythonPopularAnalyses(AnalysesBaseHandler):
         page_offset = self.count.min % self._PACKAGES_PER_PAGE
 
         while True:
-            pop = requests.get('{url}/alltime?page={page}'.format(url=self._URL, page=page))
+            pop = self.http_get_cached('{url}/alltime?page={page}'.format(url=self._URL,
+                                                                          page=page))
             pop.raise_for_status()
 
-            poppage = bs4.BeautifulSoup(pop.text, 'html.parser')
+            poppage = parse(pop.text)
             page += 1
 
             for package_name in poppage.find_all('span', class_='list_title'):
@@ -78,9 +78,9 @@ class PythonPopularAnalyses(AnalysesBaseHandler):
                 if packages_count > to_schedule_count:
                     return
 
-                pop = requests.get('{url}/module/{pkg}'.format(url=self._URL,
-                                                               pkg=package_name.text))
-                poppage = bs4.BeautifulSoup(pop.text, 'html.parser')
+                pop = self.http_get_cached('{url}/module/{pkg}'.format(url=self._URL,
+                                                                       pkg=package_name.text))
+                poppage = parse(pop.text)
                 table = poppage.find('table', id='release_list')
                 if table is None:
                     self.log.warning('No releases in %s', pop.url)
@@ -1,11 +1,17 @@
 """Schedule multiple selective flows of a type."""
 
-from .base import BaseHandler
+from .base import BaseHandler, CountRange
 
 
 class SelectiveFlowScheduling(BaseHandler):
     """Schedule multiple selective flows of a type."""
 
+    def estimate_flows(self, flow_name, task_names, flow_arguments, follow_subflows=True,
+                       run_subsequent=False, explain=False):
+        """Estimate number of flows the job would dispatch, filters are counted in database."""
+        count = self.count_flow_arguments(flow_arguments, explain=explain)
+        return CountRange(min=count, max=count)
+
     def execute(self, flow_name, task_names, flow_arguments, follow_subflows=True,
                 run_subsequent=False):
         """Schedule a selective flow, do filter expansion if needed.
@@ -16,11 +22,12 @@ class SelectiveFlowScheduling(BaseHandler):
         :param follow_subflows: follow subflows when resolving tasks to be executed
         :param run_subsequent: run tasks that follow after desired tasks stated in task_names
         """
-        for node_args in flow_arguments:
-            if self.is_filter_query(node_args):
-                for args in self.expand_filter_query(node_args):
-                    self.run_selinon_flow_selective(flow_name, task_names, args, follow_subflows,
-                                                    run_subsequent)
-            else:
-                self.run_selinon_flow_selective(flow_name, task_names, node_args, follow_subflows,
-                                                run_subsequent)
+        with self.flow_dispatch_batch():
+            for node_args in flow_arguments:
+                if self.is_filter_query(node_args):
+                    for args in self.expand_filter_query(node_args):
+                        self.run_selinon_flow_selective(flow_name, task_names, args,
+                                                        follow_subflows, run_subsequent)
+                else:
+                    self.run_selinon_flow_selective(flow_name, task_names, node_args,
+                                                    follow_subflows, run_subsequent)
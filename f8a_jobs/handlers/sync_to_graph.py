@@ -19,23 +19,24 @@ class SyncToGraph(BaseHandler):
             join(Package).\
             join(Ecosystem).\
             filter(Analysis.finished_at.isnot(None)).\
-            filter(Analysis.id >= start).\
             order_by(Analysis.id.asc())
 
         if end:
             base_query = base_query.filter(Analysis.id <= end)
 
+        # keyset pagination, an interrupted synchronization is resumed from the last synced id
+        last_id = max(start - 1, self.load_checkpoint() or 0)
         while True:
-            self.log.info("Updating results, slice offset is %s", start)
+            self.log.info("Updating results, last synchronized id is %s", last_id)
             try:
-                results = base_query.slice(start, start + self.query_slice).all()
+                results = base_query.filter(Analysis.id > last_id).limit(self.query_slice).all()
             except SQLAlchemyError:
                 self.postgres.session.rollback()
                 raise
-            start += self.query_slice
             if not results:
                 self.log.info("No more finished analyses => syncing to GraphDB finished")
                 break
+            last_id = results[-1].id
 
             for entry in results:
                 arguments = {'ecosystem': entry.version.package.ecosystem.name,
@@ -49,3 +50,5 @@ class SyncToGraph(BaseHandler):
                     self.log.exception('Failed to synchronize {ecosystem}/{name}/{version}'.
                                        format(**arguments))
                 del entry
+
+            self.save_checkpoint(last_id)
@@ -0,0 +1,221 @@
+"""Disk-backed cache of pages fetched from upstream services.
+
+Handlers analysing popular packages download the same ranking pages on each run, often for
+overlapping count ranges. Responses are stored in JOB_SERVICE_HTTP_CACHE_DIR and used without
+a request for JOB_SERVICE_HTTP_CACHE_TTL seconds. Stale entries are revalidated using
+If-None-Match/If-Modified-Since, so an unchanged page costs a 304 response only. The cache is
+shared by all processes using the same directory and the least recently used entries are
+evicted once it grows over JOB_SERVICE_HTTP_CACHE_MAX_SIZE megabytes. The directory is not
+scanned on each store - sizes of stored entries are added to the size found by the last scan,
+which is repeated once the limit is reached or entries stored by other processes may have made
+the estimate outdated.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from threading import Lock
+from time import monotonic, time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import f8a_jobs.defaults as configuration
+
+logger = logging.getLogger(__name__)
+
+
+class HttpCache(object):
+    """Cache of successful GET responses stored in a directory, one entry per URL."""
+
+    HIT = 'hit'
+    REVALIDATED = 'revalidated'
+    MISS = 'miss'
+
+    # headers kept in cached entries
+    _STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+    # number of seconds after which the directory is scanned again even if the cache seems to
+    # fit into max_size, other processes store entries as well
+    _SCAN_INTERVAL = 300
+
+    def __init__(self, directory, ttl, max_size):
+        """Construct the cache.
+
+        :param directory: directory entries are stored in, created on first use, None or empty
+        disables the cache
+        :param ttl: number of seconds a stored entry is used without revalidation
+        :param max_size: maximum size of all entries in bytes
+        """
+        self.directory = directory or None
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = Lock()
+        # size of entries found by the last scan plus entries stored since, None before a scan
+        self._size = None
+        self._scanned_at = 0.0
+
+    @property
+    def enabled(self):
+        """Check whether responses are cached."""
+        return self.directory is not None
+
+    def _path(self, url, suffix):
+        return os.path.join(self.directory,
+                            hashlib.sha256(url.encode()).hexdigest() + suffix)
+
+    def _load(self, url):
+        """Load the entry stored for the URL, None if there is no (complete) entry."""
+        try:
+            with open(self._path(url, '.json')) as meta_file:
+                meta = json.load(meta_file)
+            with open(self._path(url, '.body'), 'rb') as body_file:
+                content = body_file.read()
+        except (OSError, ValueError):
+            return None, None
+
+        if meta.get('url') != url:
+            return None, None
+
+        return meta, content
+
+    def _write(self, path, data):
+        """Write the file atomically so other processes never read a partially written entry."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _store(self, url, response):
+        """Store the response as the entry of the URL."""
+        meta = {
+            'url': url,
+            'stored_at': time(),
+            'encoding': response.encoding,
+            'headers': {name: response.headers[name] for name in self._STORED_HEADERS
+                        if name in response.headers}
+        }
+        meta = json.dumps(meta).encode()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # body goes first, an entry is complete once its metadata exist
+            self._write(self._path(url, '.body'), response.content)
+            self._write(self._path(url, '.json'), meta)
+            self._stored(len(response.content) + len(meta))
+        except OSError:
+            # the page was fetched, failing to cache it should not fail the job
+            logger.exception("Failed to store '%s' in HTTP cache", url)
+
+    def _touch(self, url, meta=None):
+        """Mark the entry as recently used, store updated metadata if given."""
+        path = self._path(url, '.json')
+        try:
+            if meta is not None:
+                self._write(path, json.dumps(meta).encode())
+            else:
+                os.utime(path)
+        except OSError:
+            logger.warning("Failed to update entry of '%s' in HTTP cache", url)
+
+    def _stored(self, size):
+        """Account an entry of the given size stored, evict entries if the cache is full."""
+        with self._lock:
+            if self._size is not None:
+                # a replaced entry is counted twice, that only makes the next scan come earlier
+                self._size += size
+            if self._size is None or self._size > self.max_size or \
+                    monotonic() - self._scanned_at >= self._SCAN_INTERVAL:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits into max_size.
+
+        Called with the lock held.
+        """
+        entries = {}
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                key, suffix = os.path.splitext(entry.name)
+                if suffix not in ('.json', '.body'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                used_at, size = entries.get(key, (0.0, 0))
+                # metadata are touched on each use
+                if suffix == '.json':
+                    used_at = stat.st_mtime
+                entries[key] = (used_at, size + stat.st_size)
+
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_size:
+                break
+            for suffix in ('.json', '.body'):
+                try:
+                    os.unlink(os.path.join(self.directory, key + suffix))
+                except FileNotFoundError:
+                    pass
+            total -= size
+            logger.debug("Evicted entry %s from HTTP cache", key)
+
+        self._size = total
+        self._scanned_at = monotonic()
+
+    @staticmethod
+    def _response(url, meta, content):
+        """Construct a response from the stored entry."""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = url
+        response.encoding = meta.get('encoding')
+        response.headers = CaseInsensitiveDict(meta.get('headers', {}))
+        response._content = content
+        return response
+
+    def get(self, url, fetch, **kwargs):
+        """Get the page, from the cache if stored and fresh or not modified since stored.
+
+        :param url: URL of the page
+        :param fetch: function performing the request, called as fetch(url, headers=..., **kwargs)
+        :param kwargs: additional arguments passed to fetch
+        :return: tuple of requests.Response and HIT, REVALIDATED or MISS
+        """
+        meta, content = self._load(url)
+        if meta is None:
+            response = fetch(url, **kwargs)
+            if response.status_code == 200:
+                self._store(url, response)
+            return response, self.MISS
+
+        if time() - meta['stored_at'] < self.ttl:
+            self._touch(url)
+            return self._response(url, meta, content), self.HIT
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        response = fetch(url, headers=headers, **kwargs)
+        if response.status_code == 304:
+            meta['stored_at'] = time()
+            self._touch(url, meta)
+            return self._response(url, meta, content), self.REVALIDATED
+
+        if response.status_code == 200:
+            self._store(url, response)
+        return response, self.MISS
+
+
+HTTP_CACHE = HttpCache(configuration.HTTP_CACHE_DIR, configuration.HTTP_CACHE_TTL,
+                       configuration.HTTP_CACHE_MAX_SIZE * 1024 * 1024)
@@ -0,0 +1,139 @@
+"""In-memory index of jobs used for job listing.
+
+Loading jobs from the job store means unpickling each row, which gets expensive once there
+are thousands of jobs. The index keeps JSON serializable representations of jobs (see
+job2raw_dict) and is kept up to date based on scheduler events. As jobs can be manipulated
+also by other processes, the whole index is periodically reloaded from the job store.
+"""
+
+import logging
+from collections import OrderedDict
+from itertools import islice
+from threading import Lock
+from time import monotonic
+from apscheduler.events import (EVENT_JOB_ADDED, EVENT_JOB_MODIFIED, EVENT_JOB_REMOVED,
+                                EVENT_ALL_JOBS_REMOVED)
+
+from f8a_jobs.utils import job2raw_dict, is_failed_job_handler_name
+
+logger = logging.getLogger(__name__)
+
+
+class JobIndex(object):
+    """In-memory index of jobs kept up to date based on scheduler events."""
+
+    JOB_TYPES = ('all', 'failed', 'user')
+
+    def __init__(self, scheduler, jobstore, refresh_interval):
+        """Construct the index and subscribe to scheduler events.
+
+        :param scheduler: scheduler which jobs should be indexed
+        :param jobstore: job store holding jobs of the scheduler
+        :param refresh_interval: number of seconds after which the whole index is reloaded
+        """
+        self._jobstore = jobstore
+        self._refresh_interval = refresh_interval
+        self._lock = Lock()
+        self._jobs = OrderedDict()
+        # jobs added or modified by this process, loaded lazily on the next read
+        self._dirty = set()
+        self._loaded_at = None
+        scheduler.add_listener(self._on_event, EVENT_JOB_ADDED | EVENT_JOB_MODIFIED |
+                               EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+
+    def _on_event(self, event):
+        """Update index based on the scheduler event."""
+        with self._lock:
+            if event.code == EVENT_ALL_JOBS_REMOVED:
+                self._jobs.clear()
+                self._dirty.clear()
+            elif event.code == EVENT_JOB_REMOVED:
+                self._jobs.pop(event.job_id, None)
+                self._dirty.discard(event.job_id)
+            else:
+                self._dirty.add(event.job_id)
+
+    def get(self, job_id):
+        """Get indexed job without bringing the index up to date.
+
+        :param job_id: id of the job
+        :return: job dict or None if the job is not indexed
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def invalidate(self):
+        """Force reload of the whole index on the next read."""
+        with self._lock:
+            self._loaded_at = None
+
+    def _reload(self):
+        """Reload the whole index from the job store."""
+        jobs = OrderedDict((job.id, job2raw_dict(job)) for job in self._jobstore.get_all_jobs())
+        with self._lock:
+            self._jobs = jobs
+            self._loaded_at = monotonic()
+        logger.debug("Job index reloaded, %d jobs indexed", len(jobs))
+
+    def _refresh(self):
+        """Bring index up to date - reload it if it is too old or load jobs changed meanwhile."""
+        with self._lock:
+            expired = self._loaded_at is None or \
+                monotonic() - self._loaded_at > self._refresh_interval
+            dirty = self._dirty
+            self._dirty = set()
+
+        if expired:
+            self._reload()
+            return
+
+        for job_id in dirty:
+            job = self._jobstore.lookup_job(job_id)
+            with self._lock:
+                if job is not None:
+                    self._jobs[job_id] = job2raw_dict(job)
+                else:
+                    self._jobs.pop(job_id, None)
+
+    @staticmethod
+    def _matches(job, handler, state, job_type):
+        """Check whether the given job matches filters."""
+        if handler is not None and job['handler'] != handler:
+            return False
+
+        if state is not None and job['state'] != state:
+            return False
+
+        if job_type == 'failed':
+            return is_failed_job_handler_name(job['handler'])
+        elif job_type == 'user':
+            return not is_failed_job_handler_name(job['handler'])
+
+        return True
+
+    def list(self, handler=None, state=None, job_type=None, offset=0, limit=None):
+        """List indexed jobs matching the given filters.
+
+        :param handler: list only jobs of the given handler
+        :param state: list only jobs in the given state ('active', 'paused', 'pending')
+        :param job_type: one of 'all', 'failed', 'user'
+        :param offset: number of matching jobs to skip
+        :param limit: maximum number of jobs returned, None for no limit
+        :return: a tuple - list of job dicts and a flag whether there are more matching jobs
+        """
+        if job_type not in self.JOB_TYPES + (None,):
+            raise ValueError("Unknown job type filtering supplied: '%s', should be one of %s"
+                             % (job_type, self.JOB_TYPES))
+
+        self._refresh()
+
+        with self._lock:
+            matching = (job for job in self._jobs.values()
+                        if self._matches(job, handler, state, job_type))
+            if limit is None:
+                return list(islice(matching, offset, None)), False
+
+            # take one more item so we know whether there are more jobs to list
+            page = list(islice(matching, offset, offset + limit + 1))
+
+        return page[:limit], len(page) > limit
@@ -0,0 +1,109 @@
+"""Collect job execution metrics based on scheduler events.
+
+Jobs can run in process pools, so metrics are not updated by jobs themselves. Instead
+job_execute() reports its run in the return value which is available in the
+EVENT_JOB_EXECUTED event dispatched in the scheduler process.
+"""
+
+import logging
+from collections import Counter
+from threading import Lock
+from apscheduler.events import (EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR,
+                                EVENT_JOB_MISSED)
+
+from f8a_jobs.metrics import (JOB_DURATION, JOB_LAG, JOBS_FAILED, JOBS_MISSED, JOBS_IN_FLIGHT,
+                              FLOWS_DISPATCHED, FLOW_DISPATCH_CHUNK_DURATION,
+                              FLOW_DEDUPE_LOOKUPS, HTTP_CACHE_LOOKUPS)
+
+logger = logging.getLogger(__name__)
+
+
+class JobMetricsListener(object):
+    """Record job execution metrics based on scheduler events."""
+
+    UNKNOWN_HANDLER = 'unknown'
+
+    def __init__(self, scheduler, job_index):
+        """Construct the listener and subscribe to scheduler events.
+
+        :param scheduler: scheduler which jobs should be reported
+        :param job_index: index of jobs used to find handler of jobs that did not run
+        """
+        self._job_index = job_index
+        self._lock = Lock()
+        # (job id, scheduled run time) -> number of runs submitted to executors, not finished yet
+        self._in_flight = Counter()
+        scheduler.add_listener(self._on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED |
+                               EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+    def _handler_name(self, job_id):
+        """Get handler name of the given job, one-shot jobs are already removed at this point."""
+        job = self._job_index.get(job_id)
+        return job['handler'] if job else self.UNKNOWN_HANDLER
+
+    def _submitted(self, event):
+        """Count runs of the job submitted to an executor as in flight."""
+        with self._lock:
+            for run_time in event.scheduled_run_times:
+                self._in_flight[(event.job_id, run_time)] += 1
+            JOBS_IN_FLIGHT.set(sum(self._in_flight.values()))
+
+    def _finished(self, event):
+        """Stop counting the run of the job as in flight, if it was counted.
+
+        Executed and failed runs are always submitted ones. A missed run is finished only if it
+        was submitted and then not run by the executor as it was over misfire_grace_time, other
+        missed runs never were in flight.
+        """
+        key = (event.job_id, event.scheduled_run_time)
+        with self._lock:
+            if not self._in_flight.get(key):
+                return
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+            JOBS_IN_FLIGHT.set(sum(self._in_flight.values()))
+
+    def _on_event(self, event):
+        """Update metrics based on the scheduler event."""
+        try:
+            if event.code == EVENT_JOB_SUBMITTED:
+                self._submitted(event)
+                return
+
+            self._finished(event)
+            if event.code == EVENT_JOB_EXECUTED and isinstance(event.retval, dict):
+                self._job_executed(event)
+            elif event.code == EVENT_JOB_MISSED:
+                JOBS_MISSED.inc(handler=self._handler_name(event.job_id))
+            else:
+                JOBS_FAILED.inc(handler=self._handler_name(event.job_id))
+        except Exception:
+            # never let metrics break job processing in the scheduler
+            logger.exception("Failed to record metrics for job '%s'", event.job_id)
+
+    @staticmethod
+    def _job_executed(event):
+        """Record metrics of the finished job run as reported by job_execute()."""
+        report = event.retval
+        handler = report['handler']
+
+        JOB_DURATION.observe(report['duration'], handler=handler,
+                             status='succeeded' if report['succeeded'] else 'failed')
+        lag = report['started_at'] - event.scheduled_run_time.timestamp()
+        JOB_LAG.observe(max(lag, 0.0), handler=handler)
+
+        if not report['succeeded']:
+            JOBS_FAILED.inc(handler=handler)
+
+        for flow_name, count in report['flows_dispatched'].items():
+            FLOWS_DISPATCHED.inc(count, handler=handler, flow=flow_name)
+
+        for _, duration in report.get('flow_dispatch_chunks', ()):
+            FLOW_DISPATCH_CHUNK_DURATION.observe(duration, handler=handler)
+
+        for (flow_name, result), count in report.get('flow_dedupe_lookups', {}).items():
+            FLOW_DEDUPE_LOOKUPS.inc(count, source=handler, flow=flow_name, result=result)
+
+        for result, count in report.get('http_cache_lookups', {}).items():
+            HTTP_CACHE_LOOKUPS.inc(count, handler=handler, result=result)
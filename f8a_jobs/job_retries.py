@@ -0,0 +1,81 @@
+"""Retry failed job runs based on retry policies of handlers.
+
+job_execute() decides whether a failed run should be retried (see RetryPolicy) and reports it
+in its return value. Retries are scheduled here, in the scheduler process, as jobs can run in
+process pool workers which cannot safely use the scheduler.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+from apscheduler.events import EVENT_JOB_EXECUTED
+
+import f8a_jobs.handlers as handlers
+from f8a_jobs.metrics import JOBS_RETRIED
+
+logger = logging.getLogger(__name__)
+
+
+class JobRetryListener(object):
+    """Schedule retries of failed job runs as one-shot jobs."""
+
+    # job_execute() is referenced textually to avoid cyclic imports
+    JOB_FUNC = 'f8a_jobs.scheduler:job_execute'
+    # keyword argument of job_execute() carrying the attempt number, reserved so it does not
+    # collide with handler kwargs
+    ATTEMPT_KWARG = '_attempt'
+
+    def __init__(self, scheduler):
+        """Construct the listener and subscribe to scheduler events.
+
+        :param scheduler: scheduler which jobs should be retried
+        """
+        self._scheduler = scheduler
+        scheduler.add_listener(self._on_event, EVENT_JOB_EXECUTED)
+
+    @staticmethod
+    def get_retry_job_id(job_id):
+        """Get id of the job retrying failed run of the given job.
+
+        :param job_id: id of the original job
+        :return: id of the retry job
+        """
+        if job_id.endswith('-retry'):
+            return job_id
+        return job_id + '-retry'
+
+    def _on_event(self, event):
+        """Schedule a retry of the failed job run if requested by job_execute()."""
+        report = event.retval
+        if not isinstance(report, dict) or not report.get('retry'):
+            return
+
+        try:
+            self.schedule_retry(report['handler'], event.job_id, report['retry'])
+        except Exception:
+            logger.exception("Failed to schedule retry of job '%s'", event.job_id)
+
+    def schedule_retry(self, handler_name, job_id, retry):
+        """Schedule a one-shot job retrying the failed run.
+
+        :param handler_name: name of the handler of the failed job
+        :param job_id: id of the failed job
+        :param retry: a dict describing the retry as reported by job_execute()
+        """
+        run_date = datetime.now(timezone.utc) + timedelta(seconds=retry['delay'])
+        retry_job_id = self.get_retry_job_id(job_id)
+        kwargs = dict(retry['kwargs'])
+        kwargs[self.ATTEMPT_KWARG] = retry['attempt']
+
+        # the original job id is passed to the handler so flows stay associated with the job
+        self._scheduler.add_job(self.JOB_FUNC,
+                                trigger='date',
+                                run_date=run_date,
+                                id=retry_job_id,
+                                args=(handler_name, retry['job_id']),
+                                kwargs=kwargs,
+                                executor=getattr(handlers, handler_name).executor,
+                                misfire_grace_time=None,
+                                replace_existing=True)
+        JOBS_RETRIED.inc(handler=handler_name)
+        logger.info("Failed run of job '%s' will be retried as job '%s' at %s (attempt %d)",
+                    job_id, retry_job_id, run_date.isoformat(), retry['attempt'])
@@ -0,0 +1,100 @@
+"""Leader election of the job service processes based on PostgreSQL advisory locks.
+
+Only one process of the job service (the leader) executes jobs. All the other processes
+(followers) run a paused scheduler that is used only to manipulate with jobs stored in
+the shared job store. The leader holds a session-level advisory lock - once the leader
+dies, its database session is closed and the lock is released so one of the followers
+can take over on its next election round.
+"""
+
+import logging
+from threading import Event, Thread
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector(Thread):
+    """A daemon thread periodically trying to become (or to stay) the leader."""
+
+    def __init__(self, db_url, lock_id, interval, on_elected, on_demoted, on_tick=None):
+        """Construct the leader elector.
+
+        :param db_url: URL to the PostgreSQL database used for advisory locks
+        :param lock_id: advisory lock identifier shared by all processes of the job service
+        :param interval: number of seconds between election rounds
+        :param on_elected: callback called once this process became the leader
+        :param on_demoted: callback called once this process lost the leadership
+        :param on_tick: callback called on each election round while being the leader
+        """
+        super().__init__(name='LeaderElector', daemon=True)
+        # no pooling - the connection that holds the lock has to be closed on failures,
+        # autocommit so the connection does not stay idle in transaction between rounds
+        self._engine = create_engine(db_url, poolclass=NullPool, isolation_level='AUTOCOMMIT')
+        self._lock_id = lock_id
+        self._interval = interval
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._on_tick = on_tick
+        self._connection = None
+        self._stop_event = Event()
+        self.is_leader = False
+
+    def _try_acquire(self):
+        """Try to acquire the advisory lock, do not block if the lock is held by another process.
+
+        :return: True if the lock was acquired
+        """
+        if self._connection is None:
+            self._connection = self._engine.connect()
+
+        return bool(self._connection.execute(text('SELECT pg_try_advisory_lock(:lock_id)'),
+                                             {'lock_id': self._lock_id}).scalar())
+
+    def _check_connection(self):
+        """Check that the connection holding the lock is still alive."""
+        self._connection.execute(text('SELECT 1')).scalar()
+
+    def _close_connection(self):
+        """Close the connection, this also releases the advisory lock if it was held."""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                logger.exception("Failed to close leader election database connection")
+            self._connection = None
+
+    def elect(self):
+        """Perform one round of leader election."""
+        try:
+            if not self.is_leader:
+                if self._try_acquire():
+                    logger.info("Process became the job service leader")
+                    self.is_leader = True
+                    self._on_elected()
+            else:
+                self._check_connection()
+                if self._on_tick:
+                    self._on_tick()
+        except Exception:
+            logger.exception("Leader election round failed")
+            self._close_connection()
+            if self.is_leader:
+                logger.warning("Process lost the job service leadership")
+                self.is_leader = False
+                self._on_demoted()
+
+    def run(self):
+        """Run leader election rounds until stopped."""
+        while not self._stop_event.is_set():
+            self.elect()
+            self._stop_event.wait(self._interval)
+
+    def stop(self):
+        """Stop leader election and give up the leadership, if held."""
+        self._stop_event.set()
+        self._close_connection()
+        if self.is_leader:
+            self.is_leader = False
+            self._on_demoted()
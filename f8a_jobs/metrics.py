@@ -0,0 +1,264 @@
+"""In-process metrics of the job service exposed in Prometheus text format.
+
+Metrics are kept per process - if the service runs in multiple processes, each process
+reports its own values. Jobs are run by the leader only, so the API exposes metrics only
+from the leader (see get_metrics()).
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+_REGISTRY = []
+
+# buckets (in seconds) suitable for request handling, lock waits and similar
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=None, const_labels=()):
+    """Construct Prometheus label representation, e.g. {handler="FlowScheduling"}."""
+    pairs = list(zip(labelnames, labelvalues)) + list(const_labels)
+    if extra:
+        pairs.append(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                           .replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    """Format a sample value."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    """Base class for all metrics."""
+
+    _TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """Construct the metric and register it so it is exported.
+
+        :param name: metric name
+        :param documentation: metric description
+        :param labelnames: names of labels that need to be supplied on each update
+        :param registry: list the metric is registered in, metrics exported by the service if
+        not given
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values = {}
+        (_REGISTRY if registry is None else registry).append(self)
+
+    def _label_values(self, labels):
+        """Convert labels as passed to metric update to a tuple of label values."""
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError("Metric '%s' expects labels %s, got %s"
+                             % (self.name, self.labelnames, tuple(labels.keys())))
+        # label values are strings in the exposition format, converting them keeps samples
+        # sortable when e.g. None is passed
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """Return samples as (suffix, label values, extra label, value) tuples."""
+        raise NotImplementedError()
+
+    def collect(self, const_labels=None):
+        """Return text representation of the metric.
+
+        :param const_labels: dict of labels added to all samples
+        """
+        const_labels = sorted((const_labels or {}).items())
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self._TYPE)
+        ]
+        with self._lock:
+            samples = self._samples()
+
+        for suffix, labelvalues, extra, value in samples:
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            _format_labels(self.labelnames, labelvalues, extra,
+                                                           const_labels),
+                                            _format_value(value)))
+        return '\n'.join(lines)
+
+    def get(self, **labels):
+        """Get current value for the given labels, mostly for introspection and testing."""
+        with self._lock:
+            return self._values.get(self._label_values(labels))
+
+
+class Counter(_Metric):
+    """A monotonically increasing counter."""
+
+    _TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter.
+
+        :param amount: amount by which the counter should be incremented
+        :param labels: label values
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [('_total', key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    _TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        """Set the gauge to the given value.
+
+        :param value: value to be set
+        :param labels: label values
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        return [('', key, None, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    _TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=None):
+        """Construct the histogram.
+
+        :param name: metric name
+        :param documentation: metric description
+        :param labelnames: names of labels that need to be supplied on each update
+        :param buckets: sorted upper bounds of buckets, +Inf is added implicitly
+        :param registry: list the metric is registered in, metrics exported by the service if
+        not given
+        """
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Observe the given value.
+
+        :param value: observed value
+        :param labels: label values
+        """
+        key = self._label_values(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self._values[key] = entry
+            entry['buckets'][idx] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def _samples(self):
+        samples = []
+        for key, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['buckets']):
+                cumulative += count
+                samples.append(('_bucket', key, ('le', _format_value(bound)), cumulative))
+            samples.append(('_sum', key, None, entry['sum']))
+            samples.append(('_count', key, None, entry['count']))
+        return samples
+
+
+def render(registry=None, const_labels=None):
+    """Render all registered metrics in Prometheus text exposition format.
+
+    :param registry: list of metrics to render, metrics exported by the service if not given
+    :param const_labels: dict of labels added to all samples
+    """
+    return '\n'.join(metric.collect(const_labels)
+                     for metric in (_REGISTRY if registry is None else registry)) + '\n'
+
+
+LEADER = Gauge(
+    'f8a_jobs_leader',
+    'Whether the process serving the request is the leader executing jobs (1) or not (0)'
+)
+SCHEDULER_LOCK_WAIT = Histogram(
+    'f8a_jobs_scheduler_lock_wait_seconds',
+    'Time spent waiting on the scheduler lock by API calls modifying jobs',
+    labelnames=('operation',)
+)
+SCHEDULER_LOCK_CONTENDED = Counter(
+    'f8a_jobs_scheduler_lock_contended',
+    'Number of API calls that had to wait for the scheduler lock held by another call',
+    labelnames=('operation',)
+)
+JOB_DURATION = Histogram(
+    'f8a_jobs_job_duration_seconds',
+    'Time spent running jobs',
+    labelnames=('handler', 'status'),
+    buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 21600.0)
+)
+JOB_LAG = Histogram(
+    'f8a_jobs_job_lag_seconds',
+    'Delay between the scheduled run time of a job and the time it actually started',
+    labelnames=('handler',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+)
+JOBS_FAILED = Counter(
+    'f8a_jobs_jobs_failed',
+    'Number of failed job runs',
+    labelnames=('handler',)
+)
+JOBS_MISSED = Counter(
+    'f8a_jobs_jobs_missed',
+    'Number of job runs thrown away as their misfire grace time elapsed',
+    labelnames=('handler',)
+)
+JOBS_IN_FLIGHT = Gauge(
+    'f8a_jobs_jobs_in_flight',
+    'Number of jobs submitted to executors that have not finished yet'
+)
+FLOWS_DISPATCHED = Counter(
+    'f8a_jobs_flows_dispatched',
+    'Number of Selinon flows dispatched by jobs',
+    labelnames=('handler', 'flow')
+)
+FLOW_DISPATCH_CHUNK_DURATION = Histogram(
+    'f8a_jobs_flow_dispatch_chunk_seconds',
+    'Time spent publishing a chunk of Selinon flows dispatched in a batch',
+    labelnames=('handler',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+JOBS_RETRIED = Counter(
+    'f8a_jobs_jobs_retried',
+    'Number of failed job runs scheduled for a retry',
+    labelnames=('handler',)
+)
+FLOW_DEDUPE_LOOKUPS = Counter(
+    'f8a_jobs_flow_dedupe_lookups',
+    'Number of flows checked for recent dispatch of the same flow, by result (hit is suppressed)',
+    labelnames=('source', 'flow', 'result')
+)
+HANDLER_CONTEXT_SETUP = Gauge(
+    'f8a_jobs_handler_context_setup_seconds',
+    'Time spent setting up a component of the handler context shared by handlers in the process',
+    labelnames=('component',)
+)
+HTTP_CACHE_LOOKUPS = Counter(
+    'f8a_jobs_http_cache_lookups',
+    'Number of pages fetched by jobs through the HTTP cache, by result (hit, revalidated, miss)',
+    labelnames=('handler', 'result')
+)
@@ -1,8 +1,16 @@
 """Module with functions to handle database sessions and job API tokens."""
 
+import hashlib
+import json
 import logging
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, Sequence, String, DateTime, Boolean
+import os
+import re
+from threading import Lock
+from time import monotonic
+from datetime import datetime, timedelta
+from sqlalchemy import (create_engine, Column, Integer, Sequence, String, DateTime, Boolean, Text,
+                        Index, JSON, desc, or_)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -28,6 +36,57 @@ def get_session():
     return sessionmaker(bind=engine)()
 
 
+_pooled_engine = None
+_pooled_engine_pid = None
+_pooled_engine_lock = Lock()
+
+# objects holding connections a forked process inherited from its parent, see keep_inherited()
+_inherited = []
+
+
+def keep_inherited(obj):
+    """Keep an object holding connections inherited from the parent process referenced forever.
+
+    A forked process must not close connections of its parent - closing the shared socket,
+    explicitly or when the object holding it is garbage collected, terminates the connection
+    for the parent as well. Such objects are replaced by ones opening their own connections
+    and kept here instead.
+
+    :param obj: object holding inherited connections, None is ignored
+    """
+    if obj is not None:
+        _inherited.append(obj)
+
+
+def get_pooled_session():
+    """Retrieve a database session using connections pooled by the current process.
+
+    Meant for statements issued frequently, get_session() connects anew on each call. The pool
+    is created on first use in each process, connections are never shared with forked processes.
+    """
+    global _pooled_engine, _pooled_engine_pid
+
+    with _pooled_engine_lock:
+        if _pooled_engine is None or _pooled_engine_pid != os.getpid():
+            _pooled_engine = create_engine(worker_configuration.POSTGRES_CONNECTION)
+            _pooled_engine_pid = os.getpid()
+        return sessionmaker(bind=_pooled_engine)()
+
+
+def dispose_inherited_engine():
+    """Forget the connection pool inherited from the parent process, e.g. in a forked worker.
+
+    Equivalent of Engine.dispose(close=False) of newer SQLAlchemy versions - connections of the
+    parent are not closed (see keep_inherited()), get_pooled_session() creates a new pool.
+    """
+    global _pooled_engine, _pooled_engine_pid
+
+    with _pooled_engine_lock:
+        keep_inherited(_pooled_engine)
+        _pooled_engine = None
+        _pooled_engine_pid = None
+
+
 class JobToken(_Base):
     """Model for token storing."""
 
@@ -155,3 +214,420 @@ class JobToken(_Base):
             raise
 
         return entry.to_dict()
+
+
+class FailedJob(_Base):
+    """Model for failed job runs, runs failing the same way are stored once."""
+
+    __tablename__ = 'jobs_failures'
+    __table_args__ = (
+        Index('ix_jobs_failures_handler_last_seen', 'handler', 'last_seen'),
+    )
+
+    _TRACEBACK_FRAME_RE = re.compile(r'File "([^"]+)", line \d+, in (\S+)')
+    # expired failures are purged on recording at most once per the given number of seconds
+    _PURGE_INTERVAL = 3600
+    _last_purge = None
+
+    id = Column(Integer, Sequence('jobs_failure_id'), primary_key=True)
+    fingerprint = Column(String(64), unique=True, nullable=False)
+    handler = Column(String(256), nullable=False)
+    exc_type = Column(String(256))
+    occurrences = Column(Integer, nullable=False, default=1)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False, index=True)
+    # details of the last failure
+    job_id = Column(String(256))
+    exc_str = Column(Text)
+    exc_traceback = Column(Text)
+    handler_kwargs = Column(JSON)
+
+    def to_dict(self):
+        """Convert the object of type FailedJob into a dictionary."""
+        return {
+            'fingerprint': self.fingerprint,
+            'handler': self.handler,
+            'exc_type': self.exc_type,
+            'occurrences': self.occurrences,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'job_id': self.job_id,
+            'exc_str': self.exc_str,
+            'exc_traceback': self.exc_traceback,
+            'handler_kwargs': self.handler_kwargs
+        }
+
+    @classmethod
+    def compute_fingerprint(cls, handler_name, exc_traceback):
+        """Compute fingerprint of the failure so failures of the same origin are grouped.
+
+        Exception messages and line numbers are not taken into account as they usually differ
+        between runs (package names, ids) and deployments.
+
+        :param handler_name: name of the handler of the failed job
+        :param exc_traceback: formatted traceback of the exception raised
+        :return: a tuple - fingerprint and exception type name
+        """
+        lines = [line for line in exc_traceback.splitlines() if line and not line[0].isspace()]
+        exc_type = lines[-1].split(':', 1)[0] if lines else None
+        frames = ['{}:{}'.format(os.path.basename(filename), function)
+                  for filename, function in cls._TRACEBACK_FRAME_RE.findall(exc_traceback)]
+
+        digest = hashlib.sha256()
+        for part in [handler_name, exc_type or ''] + frames:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest(), exc_type
+
+    @classmethod
+    def record(cls, handler_name, job_id, handler_kwargs, exc_str, exc_traceback, session=None):
+        """Record a job failure, a single upsert statement is issued.
+
+        :param handler_name: name of the handler of the failed job
+        :param job_id: id of the failed job
+        :param handler_kwargs: keyword arguments of the failed job
+        :param exc_str: string representation of the exception raised
+        :param exc_traceback: formatted traceback of the exception raised
+        :param session: database session to use
+        :return: fingerprint of the failure
+        """
+        session = session or get_session()
+        fingerprint, exc_type = cls.compute_fingerprint(handler_name, exc_traceback)
+        now = datetime.utcnow()
+        # kwargs can hold values not serializable to JSON, such as dates parsed by the API
+        handler_kwargs = json.loads(json.dumps(handler_kwargs, default=str))
+
+        statement = insert(cls.__table__).values(
+            fingerprint=fingerprint,
+            handler=handler_name,
+            exc_type=exc_type,
+            occurrences=1,
+            first_seen=now,
+            last_seen=now,
+            job_id=job_id,
+            exc_str=exc_str,
+            exc_traceback=exc_traceback,
+            handler_kwargs=handler_kwargs
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.fingerprint],
+            set_={
+                'occurrences': cls.__table__.c.occurrences + 1,
+                'last_seen': statement.excluded.last_seen,
+                'job_id': statement.excluded.job_id,
+                'exc_str': statement.excluded.exc_str,
+                'exc_traceback': statement.excluded.exc_traceback,
+                'handler_kwargs': statement.excluded.handler_kwargs
+            }
+        )
+
+        try:
+            session.execute(statement)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        if cls._last_purge is None or monotonic() - cls._last_purge > cls._PURGE_INTERVAL:
+            cls._last_purge = monotonic()
+            cls.purge_expired(session)
+
+        return fingerprint
+
+    @classmethod
+    def list(cls, handler=None, offset=0, limit=None, session=None):
+        """List recorded failures, the most recent first.
+
+        :param handler: list only failures of the given handler
+        :param offset: number of failures to skip
+        :param limit: maximum number of failures returned, None for no limit
+        :param session: database session to use
+        :return: a list of failure dicts
+        """
+        session = session or get_session()
+        query = session.query(cls)
+        if handler is not None:
+            query = query.filter(cls.handler == handler)
+
+        try:
+            entries = query.order_by(desc(cls.last_seen)).offset(offset).limit(limit).all()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return [entry.to_dict() for entry in entries]
+
+    @classmethod
+    def clean(cls, handler=None, older_than=None, session=None):
+        """Delete recorded failures.
+
+        :param handler: delete only failures of the given handler
+        :param older_than: timedelta, delete only failures not seen for the given time
+        :param session: database session to use
+        :return: number of failures deleted
+        """
+        session = session or get_session()
+        query = session.query(cls)
+        if handler is not None:
+            query = query.filter(cls.handler == handler)
+        if older_than is not None:
+            query = query.filter(cls.last_seen < datetime.utcnow() - older_than)
+
+        try:
+            deleted = query.delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return deleted
+
+    @classmethod
+    def purge_expired(cls, session=None):
+        """Delete failures that were not seen for the configured retention time.
+
+        :param session: database session to use
+        :return: number of failures deleted
+        """
+        return cls.clean(older_than=timedelta(days=configuration.FAILED_JOBS_RETENTION_DAYS),
+                         session=session)
+
+
+class FlowDispatch(_Base):
+    """Model for flows dispatched recently, shared by all processes deduplicating flows."""
+
+    __tablename__ = 'jobs_flow_dispatches'
+
+    key = Column(String(64), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    @classmethod
+    def claim(cls, keys, ttl, session=None):
+        """Record the flows as dispatched unless they were dispatched recently.
+
+        A single upsert statement is issued for all flows, so concurrent claims of the same flow
+        cannot both succeed. Expired dispatches are overwritten, they are deleted by
+        purge_expired() called from the CleanPostgres job.
+
+        :param keys: distinct keys identifying the flows
+        :param ttl: number of seconds the dispatched flows are remembered for
+        :param session: database session to use
+        :return: a set of keys of flows that were claimed and should be dispatched, the other
+        flows were dispatched recently
+        """
+        keys = list(keys)
+        if not keys:
+            return set()
+
+        session = session or get_session()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        statement = insert(cls.__table__).values([{'key': key, 'expires_at': expires_at}
+                                                  for key in keys])
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.key],
+            set_={'expires_at': statement.excluded.expires_at},
+            where=cls.__table__.c.expires_at <= now
+        ).returning(cls.__table__.c.key)
+
+        try:
+            claimed = {row[0] for row in session.execute(statement)}
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return claimed
+
+    @classmethod
+    def release(cls, keys, session=None):
+        """Forget dispatches of the given flows, e.g. when dispatching them failed.
+
+        :param keys: keys identifying the flows
+        :param session: database session to use
+        :return: number of dispatches deleted
+        """
+        session = session or get_session()
+        try:
+            deleted = session.query(cls).filter(cls.key.in_(list(keys))).\
+                delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return deleted
+
+    @classmethod
+    def purge_expired(cls, session=None):
+        """Delete expired dispatches.
+
+        :param session: database session to use
+        :return: number of dispatches deleted
+        """
+        session = session or get_session()
+        try:
+            deleted = session.query(cls).filter(cls.expires_at <= datetime.utcnow()).\
+                delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return deleted
+
+
+class DefaultJobFingerprint(_Base):
+    """Model for fingerprints of default job definitions registered."""
+
+    __tablename__ = 'jobs_default_fingerprints'
+
+    job_id = Column(String(191), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    @classmethod
+    def get_all(cls, session=None):
+        """Get fingerprints of all registered default jobs.
+
+        :param session: database session to use
+        :return: a dict mapping job id to fingerprint of its definition
+        """
+        session = session or get_session()
+        try:
+            return dict(session.query(cls.job_id, cls.fingerprint).all())
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+    @classmethod
+    def store(cls, fingerprints, session=None):
+        """Store fingerprints of registered default jobs, a single upsert statement is issued.
+
+        :param fingerprints: a dict mapping job id to fingerprint of its definition
+        :param session: database session to use
+        """
+        if not fingerprints:
+            return
+
+        session = session or get_session()
+        now = datetime.utcnow()
+        statement = insert(cls.__table__).values([
+            {'job_id': job_id, 'fingerprint': fingerprint, 'updated_at': now}
+            for job_id, fingerprint in fingerprints.items()
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.job_id],
+            set_={
+                'fingerprint': statement.excluded.fingerprint,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+
+        try:
+            session.execute(statement)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+
+class JobCheckpoint(_Base):
+    """Model for resumable cursors of long-running jobs."""
+
+    __tablename__ = 'jobs_checkpoints'
+
+    # id of the checkpoint, see compute_id()
+    job_id = Column(String(191), primary_key=True)
+    handler = Column(String(256), nullable=False)
+    cursor = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    @staticmethod
+    def compute_id(job_id, handler_kwargs, name=None):
+        """Compute id of the checkpoint of the job run with the given arguments.
+
+        Runs of the same job with different arguments do not share checkpoints.
+
+        :param job_id: id of the job
+        :param handler_kwargs: keyword arguments of the job
+        :param name: name of the checkpoint if the job stores more of them
+        :return: checkpoint id
+        """
+        digest = hashlib.sha256(json.dumps(handler_kwargs or {}, sort_keys=True,
+                                           default=str).encode('utf-8'))
+        checkpoint_id = '{}:{}'.format(job_id, digest.hexdigest()[:16])
+        if name:
+            checkpoint_id += '/' + name
+        return checkpoint_id
+
+    @classmethod
+    def get(cls, job_id, handler_name, session=None):
+        """Get the cursor stored by the last unfinished run of the given job.
+
+        :param job_id: id of the checkpoint
+        :param handler_name: name of the handler, cursors stored by other handlers are ignored
+        :param session: database session to use
+        :return: the stored cursor or None if there is no checkpoint
+        """
+        session = session or get_session()
+        try:
+            entry = session.query(cls).filter(cls.job_id == job_id).one_or_none()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        if entry is None or entry.handler != handler_name:
+            return None
+
+        return entry.cursor
+
+    @classmethod
+    def store(cls, job_id, handler_name, cursor, session=None):
+        """Store cursor of the given job, a single upsert statement is issued.
+
+        :param job_id: id of the checkpoint
+        :param handler_name: name of the handler of the job
+        :param cursor: JSON serializable cursor the job can be resumed from
+        :param session: database session to use
+        """
+        session = session or get_session()
+        statement = insert(cls.__table__).values(job_id=job_id, handler=handler_name,
+                                                 cursor=cursor, updated_at=datetime.utcnow())
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.job_id],
+            set_={
+                'handler': statement.excluded.handler,
+                'cursor': statement.excluded.cursor,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+
+        try:
+            session.execute(statement)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+    @classmethod
+    def clear(cls, job_id, session=None):
+        """Delete checkpoint of the given job, including its named checkpoints.
+
+        :param job_id: id of the checkpoint
+        :param session: database session to use
+        :return: True if there was a checkpoint deleted
+        """
+        session = session or get_session()
+        try:
+            deleted = session.query(cls).\
+                filter(or_(cls.job_id == job_id,
+                           cls.job_id.startswith(job_id + '/', autoescape=True))).\
+                delete(synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+
+        return deleted > 0
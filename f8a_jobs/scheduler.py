@@ -3,54 +3,95 @@
 """Scheduler wrapper to ensure that we have a single scheduler per process."""
 
 import os
+import json
 import logging
 import traceback
 import yaml
 import uuid
+import pickle
+import hashlib
+from time import monotonic, time
 from datetime import timedelta
-from datetime import datetime
+from datetime import datetime, timezone
 from dateutil.parser import parse as parse_datetime
 from pytimeparse.timeparse import timeparse
 from functools import wraps
 from threading import Lock
+from apscheduler.events import JobEvent, EVENT_JOB_ADDED, EVENT_JOB_MODIFIED
+from apscheduler.job import Job
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_RUNNING
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import datetime_to_utc_timestamp
+from sqlalchemy import select, bindparam
 from f8a_worker.defaults import configuration as worker_configuration
 import f8a_jobs.handlers as handlers
+import f8a_jobs.defaults as configuration
+from f8a_jobs.executors import parse_executor_pools
+from f8a_jobs.job_index import JobIndex
+from f8a_jobs.job_metrics import JobMetricsListener
+from f8a_jobs.job_retries import JobRetryListener
+from f8a_jobs.leader_election import LeaderElector
+from f8a_jobs.metrics import SCHEDULER_LOCK_WAIT, SCHEDULER_LOCK_CONTENDED
+from f8a_jobs.models import (FailedJob, DefaultJobFingerprint, JobCheckpoint,
+                             dispose_inherited_engine, keep_inherited)
+from f8a_jobs.throttling import init_concurrency_limits
 from f8a_jobs.utils import is_failed_job_handler_name
 
 
+# limits are enforced by executors when jobs are submitted (see ConcurrencyLimitedExecutor)
+init_concurrency_limits({name: handler for name, handler in vars(handlers).items()
+                         if isinstance(handler, type)})
+
+
 class ScheduleJobError(Exception):
     """An exception raised on job creation error."""
 
     pass
 
 
+class BulkScheduleJobError(ScheduleJobError):
+    """An exception raised if any of jobs submitted in bulk is invalid."""
+
+    def __init__(self, errors):
+        """Construct the exception.
+
+        :param errors: a list of dicts describing errors, index of the job spec under 'index'
+        """
+        super().__init__("%d of submitted jobs are invalid" % len(errors))
+        self.errors = errors
+
+
 class Scheduler(object):
     """Scheduler wrapper to ensure that we have a single scheduler per process."""
 
     _scheduler = None
     _scheduler_creation_lock = Lock()
+    _leader_elector = None
+    _job_index = None
     scheduler_lock = Lock()
     log = logging.getLogger(__name__)
+    _EXECUTOR_POOLS = parse_executor_pools(configuration.EXECUTOR_POOLS)
     _SCHEDULER_CONF = {
         'apscheduler.jobstores.default': {
             'type': 'sqlalchemy',
             'url': worker_configuration.POSTGRES_CONNECTION
         },
-        'apscheduler.executors.default': {
-            'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
-            'max_workers': '20'
-        },
-        'apscheduler.executors.processpool': {
-            'type': 'processpool',
-            'max_workers': '5'
-        },
         'apscheduler.job_defaults.coalesce': 'true',
         'apscheduler.job_defaults.max_instances': '1',
         'apscheduler.timezone': 'UTC'
     }
+    # scheduler used only for feeding jobs does not need to start any process pools
+    _FEEDING_SCHEDULER_CONF = dict(_SCHEDULER_CONF)
+    _SCHEDULER_CONF.update(('apscheduler.executors.' + name, pool)
+                           for name, pool in _EXECUTOR_POOLS.items())
+    _paused_scheduler = None
+    # a separate lock, process pool workers are forked while the creation lock is held
+    _paused_scheduler_creation_lock = Lock()
+    # parameters of schedule_job() that are not handler kwargs
+    _JOB_OPTIONS = frozenset(('job_id', 'when', 'periodically', 'misfire_grace_time', 'state',
+                              'executor', 'jitter', 'spread', 'modify_existing_job'))
 
     def __init__(self):
         """Raise a exception because the Scheduler class must be instantiated via factory method."""
@@ -60,16 +101,62 @@ class Scheduler(object):
     def get_scheduler(cls):
         """Get scheduler instance.
 
+        If leader election is turned on, the scheduler is started paused and it is resumed
+        only once this process becomes the leader.
+
         :return: scheduler instance
         """
         if cls._scheduler is None:
             with cls._scheduler_creation_lock:
                 if cls._scheduler is None:
-                    cls._scheduler = BackgroundScheduler(cls._SCHEDULER_CONF)
-                    cls._scheduler.start(paused=bool(os.environ.get('JOB_SERVICE_PAUSED')))
+                    scheduler = BackgroundScheduler(cls._SCHEDULER_CONF)
+                    cls._job_index = JobIndex(scheduler, scheduler._lookup_jobstore('default'),
+                                              configuration.JOB_INDEX_REFRESH_INTERVAL)
+                    JobMetricsListener(scheduler, cls._job_index)
+                    JobRetryListener(scheduler)
+                    if configuration.LEADER_ELECTION:
+                        scheduler.start(paused=True)
+                        cls._scheduler = scheduler
+                        cls._start_leader_election(scheduler)
+                    else:
+                        scheduler.start(paused=bool(os.environ.get('JOB_SERVICE_PAUSED')))
+                        cls._scheduler = scheduler
 
         return cls._scheduler
 
+    @classmethod
+    def _start_leader_election(cls, scheduler):
+        """Start leader election that resumes the given scheduler once this process is elected.
+
+        :param scheduler: scheduler that should execute jobs only in the leader process
+        """
+        def on_elected():
+            if os.environ.get('JOB_SERVICE_PAUSED'):
+                cls.log.info("Elected as a leader, but job service is configured to be paused")
+                return
+            scheduler.resume()
+
+        cls._leader_elector = LeaderElector(
+            db_url=configuration.LEADER_ELECTION_DB_URL or worker_configuration.POSTGRES_CONNECTION,
+            lock_id=configuration.LEADER_ELECTION_LOCK_ID,
+            interval=configuration.LEADER_ELECTION_INTERVAL,
+            on_elected=on_elected,
+            on_demoted=scheduler.pause,
+            # jobs can be added by followers, make sure the leader checks the job store regularly
+            on_tick=scheduler.wakeup
+        )
+        cls._leader_elector.start()
+
+    @classmethod
+    def is_leader(cls):
+        """Check whether this process executes jobs.
+
+        :return: True if this process is the leader, None if leader election is not turned on
+        """
+        if cls._leader_elector is None:
+            return None
+        return cls._leader_elector.is_leader
+
     @classmethod
     def get_paused_scheduler(cls):
         """Return paused scheduler for feeding jobs.
@@ -80,10 +167,23 @@ class Scheduler(object):
         # we start scheduler in paused mode.
         if cls._scheduler is not None:
             return cls._scheduler
-        else:
-            scheduler = BackgroundScheduler(cls._SCHEDULER_CONF)
-            scheduler.start(paused=True)
-            return scheduler
+
+        with cls._paused_scheduler_creation_lock:
+            if cls._paused_scheduler is None:
+                scheduler = BackgroundScheduler(cls._FEEDING_SCHEDULER_CONF)
+                scheduler.start(paused=True)
+                cls._paused_scheduler = scheduler
+
+        return cls._paused_scheduler
+
+    @classmethod
+    def get_job_index(cls):
+        """Get in-memory index of jobs of the process-wide scheduler.
+
+        :return: job index instance
+        """
+        cls.get_scheduler()
+        return cls._job_index
 
     @staticmethod
     def check_job_state(state):
@@ -97,6 +197,20 @@ class Scheduler(object):
         if not hasattr(handlers, handler_name):
             raise ValueError("Unknown handler '%s'" % handler_name)
 
+    @classmethod
+    def process_executor_parameter(cls, handler_name, executor):
+        """Process the 'executor' parameter - executor pool the job should be run in.
+
+        :param handler_name: name of the job handler, its executor is used if not stated
+        :param executor: name of the executor pool or None
+        :return: name of the executor pool
+        """
+        executor = executor or getattr(handlers, handler_name).executor
+        if executor not in cls._EXECUTOR_POOLS:
+            raise ValueError("Unknown executor '%s', configured executor pools: %s"
+                             % (executor, tuple(cls._EXECUTOR_POOLS.keys())))
+        return executor
+
     @staticmethod
     def process_when_parameter(when):
         """Process the 'when' parameter when the job should be fired."""
@@ -123,10 +237,88 @@ class Scheduler(object):
             misfire_grace_time = seconds
         return misfire_grace_time
 
+    @staticmethod
+    def process_jitter_parameter(jitter):
+        """Process the 'jitter' parameter - random delay added to runs of periodic jobs."""
+        if jitter is None:
+            jitter = configuration.PERIODIC_JOBS_JITTER
+
+        if jitter:
+            seconds = timeparse(jitter)
+
+            if seconds is None:
+                raise ScheduleJobError("Unable to parse format for 'jitter': '%s'" % jitter)
+
+            return seconds
+
+        return None
+
+    @staticmethod
+    def compute_spread_start_date(job_id, seconds, now=None):
+        """Compute the first run of a periodic job so that periodic jobs are spread across time.
+
+        Each job is given an offset within its interval derived from its id - runs of jobs with
+        the same interval are spaced apart and a job keeps its offset when it is registered again.
+
+        :param job_id: id of the job
+        :param seconds: interval of the job in seconds
+        :param now: current time as a UNIX timestamp, the current time if omitted
+        :return: timezone aware datetime of the first run, within one interval from now
+        """
+        now = time() if now is None else now
+        offset = int(hashlib.sha256(job_id.encode()).hexdigest(), 16) % seconds
+        return datetime.fromtimestamp(now + (offset - now) % seconds, timezone.utc)
+
+    @staticmethod
+    def process_trigger_parameters(when, periodically, state, job_id=None, jitter=None,
+                                   spread=None):
+        """Construct trigger specification for apscheduler based on job parameters.
+
+        :param when: already processed 'when' parameter
+        :param periodically: string representation of the periodical execution
+        :param state: a string ('paused'/'running') representation of job state
+        :param job_id: id of the job, required for spreading periodic jobs
+        :param jitter: string representation of the random delay added to periodic runs
+        :param spread: spread the periodic job across its interval if 'when' is not stated,
+        JOB_SERVICE_PERIODIC_JOBS_SPREAD is used if None
+        :return: a tuple - trigger name and trigger keyword arguments
+        """
+        if periodically:
+            seconds = timeparse(periodically)
+
+            if seconds is None:
+                raise ScheduleJobError("Unable to parse format for 'periodically': '%s'" %
+                                       periodically)
+
+            if spread is None:
+                spread = configuration.PERIODIC_JOBS_SPREAD
+
+            if spread and not when and job_id:
+                when = Scheduler.compute_spread_start_date(job_id, seconds)
+
+            trigger = 'interval'
+            trigger_kwargs = {
+                'seconds': seconds,
+                'start_date': when,
+                'jitter': Scheduler.process_jitter_parameter(jitter)
+            }
+        else:
+            # One time job
+            trigger = 'date'
+            trigger_kwargs = {
+                'run_date': when
+            }
+
+        if state == 'paused':
+            trigger_kwargs['next_run_time'] = None
+
+        return trigger, trigger_kwargs
+
     @classmethod
     def schedule_job(cls, scheduler, handler_name,
                      job_id=None, when=None, periodically=None, misfire_grace_time=None,
-                     state=None, modify_existing_job=False, **kwargs):
+                     state=None, executor=None, jitter=None, spread=None,
+                     modify_existing_job=False, **kwargs):
         """Schedule a job.
 
         :param scheduler: scheduler that should be used to schedule a job
@@ -138,6 +330,12 @@ class Scheduler(object):
         :param misfire_grace_time: time after which the given job should be
         thrown away because of misfire
         :param state: a string ('paused'/'running') representation of job state
+        :param executor: executor pool the job should be run in, if None, executor
+        stated by the handler is used
+        :param jitter: string representation of the random delay added to each run of
+        a periodic job
+        :param spread: if True, the first run of a periodic job without 'when' is placed within
+        its interval based on the job id
         :param modify_existing_job: if True, existing job will be modified
         according to new job spec
         :param kwargs: handler kwargs
@@ -152,42 +350,29 @@ class Scheduler(object):
         cls.log.info("{}__:__{}__:__{}".format("schedule_job", "misfire_grace_time",
                                                misfire_grace_time))
         cls.log.info("{}__:__{}__:__{}".format("schedule_job", "state", state))
+        cls.log.info("{}__:__{}__:__{}".format("schedule_job", "executor", executor))
+        cls.log.info("{}__:__{}__:__{}".format("schedule_job", "jitter", jitter))
+        cls.log.info("{}__:__{}__:__{}".format("schedule_job", "spread", spread))
         cls.log.info("{}__:__{}__:__{}".format("schedule_job", "modify_existing_job",
                                                modify_existing_job))
         cls.log.info("{}__:__{}__:__{}".format("schedule_job", "kwargs", kwargs))
 
         Scheduler.check_job_state(state)
         Scheduler.check_handler_name(handlers, handler_name)
+        executor = Scheduler.process_executor_parameter(handler_name, executor)
 
         # parameters that needs to be parsed/processed
         when = Scheduler.process_when_parameter(when)
         misfire_grace_time = Scheduler.process_misfire_grace_time(misfire_grace_time)
 
-        if periodically:
-            seconds = timeparse(periodically)
+        if not job_id:
+            # explicitly assign job id so we have this ID in logs and job is trackable
+            job_id = str(uuid.uuid4())
 
-            if seconds is None:
-                raise ScheduleJobError("Unable to parse format for 'periodically': '%s'" %
-                                       periodically)
-
-            trigger = 'interval'
-            trigger_kwargs = {
-                'seconds': seconds,
-                'start_date': when
-            }
-            cls.log.info("{}__:__{}__:__{}"
-                         .format("schedule_job", "trigger_kwargs", trigger_kwargs))
-        else:
-            # One time job
-            trigger = 'date'
-            trigger_kwargs = {
-                'run_date': when
-            }
-            cls.log.info("{}__:__{}__:__{}"
-                         .format("schedule_job", "trigger_kwargs", trigger_kwargs))
-
-        if state == 'paused':
-            trigger_kwargs['next_run_time'] = None
+        trigger, trigger_kwargs = Scheduler.process_trigger_parameters(when, periodically, state,
+                                                                       job_id, jitter, spread)
+        cls.log.info("{}__:__{}__:__{}".format("schedule_job", "trigger_kwargs", trigger_kwargs))
+        seconds = trigger_kwargs.get('seconds')
 
         try:
             job = scheduler.get_job(job_id)
@@ -196,6 +381,7 @@ class Scheduler(object):
                 job.modify(
                     kwargs=kwargs or {},
                     misfire_grace_time=misfire_grace_time,
+                    executor=executor
                 )
                 # Check for trigger configuration changes
                 old_trigger = job.trigger
@@ -214,16 +400,17 @@ class Scheduler(object):
                                      "modifying entry...",
                                      old_trigger.interval, timedelta(seconds=seconds))
                         job.reschedule(trigger=trigger, **trigger_kwargs)
+                    elif isinstance(old_trigger, IntervalTrigger) \
+                            and old_trigger.jitter != trigger_kwargs['jitter']:
+                        cls.log.info("Job jitter has changed from %s to %s, modifying entry...",
+                                     old_trigger.jitter, trigger_kwargs['jitter'])
+                        job.reschedule(trigger=trigger, **trigger_kwargs)
                     else:
                         cls.log.info("Job execution time was left untouched - no change performed")
                 else:
                     cls.log.info("Trigger type has changed, force rescheduling job")
                     job.reschedule(trigger, **trigger_kwargs)
             else:
-                if not job_id:
-                    # explicitly assign job id so we have this ID in logs and job is trackable
-                    job_id = str(uuid.uuid4())
-
                 # force replace existing one
                 job = scheduler.add_job(
                     job_execute,
@@ -233,6 +420,7 @@ class Scheduler(object):
                     replace_existing=True,
                     trigger=trigger,
                     misfire_grace_time=misfire_grace_time,
+                    executor=executor,
                     **trigger_kwargs
                 )
         except Exception as e:
@@ -242,23 +430,275 @@ class Scheduler(object):
         return job
 
     @classmethod
-    def register_default_jobs(cls, job_dir):
-        """Register default jobs as stated in configuration files.
+    def estimate_job_flows(cls, handler_name, explain=False, **kwargs):
+        """Estimate number of flows a job would dispatch, without scheduling it.
 
-        :param job_dir: directory in which the default jobs sit (YAML files)
+        :param handler_name: name of handler that is used to handle the given job
+        :param explain: prefer cheap estimates (query planner) over exact counts
+        :param kwargs: job parameters as accepted by schedule_job(), only handler kwargs are used
+        :return: CountRange with the minimal and maximal number of flows, None if the handler
+        cannot estimate it
         """
-        cls.log.info("Registering default jobs")
-        scheduler = cls.get_paused_scheduler()
+        Scheduler.check_handler_name(handlers, handler_name)
+        # options of schedule_job() are not passed to the handler
+        handler_kwargs = {key: value for key, value in kwargs.items()
+                          if key not in cls._JOB_OPTIONS}
+        handler = getattr(handlers, handler_name)(job_id=None)
+        return handler.estimate_flows(explain=explain, **handler_kwargs)
 
-        for job_file_basename in os.listdir(job_dir):
-            cls.log.info("Processing file '%s'" % job_file_basename)
+    @classmethod
+    def _prepare_bulk_job(cls, scheduler, spec, used_job_ids):
+        """Validate job spec submitted in bulk and construct the corresponding job.
+
+        :param scheduler: scheduler the job will belong to
+        :param spec: job spec accepting the same keys as schedule_job, handler name under 'handler'
+        :param used_job_ids: ids of jobs already prepared in the same bulk
+        :return: apscheduler.Job instance that is not stored in any job store yet
+        """
+        spec = dict(spec)
+        handler_name = spec.pop('handler', None)
+        job_id = spec.pop('job_id', None) or str(uuid.uuid4())
+        state = spec.pop('state', None)
+
+        if not handler_name:
+            raise ScheduleJobError("Expected handler name under 'handler' key")
+
+        if job_id in used_job_ids:
+            raise ScheduleJobError("Job id '%s' used multiple times" % job_id)
+
+        try:
+            Scheduler.check_job_state(state)
+            Scheduler.check_handler_name(handlers, handler_name)
+            executor = Scheduler.process_executor_parameter(handler_name,
+                                                            spec.pop('executor', None))
+        except ValueError as exc:
+            raise ScheduleJobError(str(exc)) from exc
+
+        when = Scheduler.process_when_parameter(spec.pop('when', None))
+        misfire_grace_time = Scheduler.process_misfire_grace_time(
+            spec.pop('misfire_grace_time', None))
+        trigger, trigger_kwargs = Scheduler.process_trigger_parameters(
+            when, spec.pop('periodically', None), state, job_id, spec.pop('jitter', None),
+            spec.pop('spread', None))
+        # the rest are handler kwargs, the same way as in post_schedule_job()
+        spec.update(spec.pop('kwargs', None) or {})
+
+        job_kwargs = {
+            'func': job_execute,
+            'args': (handler_name, job_id),
+            'kwargs': spec,
+            'executor': executor,
+            'misfire_grace_time': misfire_grace_time
+        }
+        paused = 'next_run_time' in trigger_kwargs
+        trigger_kwargs.pop('next_run_time', None)
+
+        try:
+            job_kwargs['trigger'] = scheduler._create_trigger(trigger, trigger_kwargs)
+            job_kwargs['next_run_time'] = None if paused else \
+                job_kwargs['trigger'].get_next_fire_time(None, datetime.now(scheduler.timezone))
+            # fill in defaults the same way apscheduler does when adding a job
+            for key, value in scheduler._job_defaults.items():
+                job_kwargs.setdefault(key, value)
+            return Job(scheduler, id=job_id, **job_kwargs)
+        except (TypeError, ValueError) as exc:
+            raise ScheduleJobError(str(exc)) from exc
+
+    @staticmethod
+    def _merge_bulk_job(job, new_job):
+        """Apply job spec submitted in bulk to the already existing job.
+
+        The same rules as in schedule_job() apply - the next run time of the job is left
+        untouched (e.g. the job stays paused or resumed) unless the trigger has changed.
+
+        :param job: existing job as stored in the job store
+        :param new_job: job constructed from the submitted job spec
+        :return: the existing job with changes applied
+        """
+        changes = {
+            'args': new_job.args,
+            'kwargs': new_job.kwargs,
+            'misfire_grace_time': new_job.misfire_grace_time,
+            'executor': new_job.executor
+        }
+
+        old_trigger, new_trigger = job.trigger, new_job.trigger
+        trigger_change = type(old_trigger) is not type(new_trigger) or \
+            (isinstance(new_trigger, DateTrigger) and
+             old_trigger.run_date != new_trigger.run_date) or \
+            (isinstance(new_trigger, IntervalTrigger) and
+             (old_trigger.interval != new_trigger.interval or
+              old_trigger.jitter != new_trigger.jitter))
+        if trigger_change:
+            changes['trigger'] = new_trigger
+            changes['next_run_time'] = new_job.next_run_time
+
+        job._modify(**changes)
+        return job
+
+    @classmethod
+    def schedule_jobs_bulk(cls, scheduler, job_specs, replace_existing=False,
+                           modify_existing=False):
+        """Schedule multiple jobs, all of them are stored in a single job store transaction.
+
+        All job specs are validated before storing any job - if any of them is invalid, no job
+        is scheduled. Jobs are stored directly in the table of the SQLAlchemy job store using
+        internals of apscheduler, which is pinned exactly in requirements.in for this reason.
+
+        :param scheduler: scheduler that should be used to schedule jobs
+        :param job_specs: a list of job specs, see _prepare_bulk_job()
+        :param replace_existing: if True, existing jobs with the same id are replaced
+        :param modify_existing: if True, existing jobs with the same id are modified according
+        to job specs the same way as schedule_job() does; existing jobs are left untouched
+        if neither replace_existing nor modify_existing is set
+        :return: a list of tuples (job, status) in the order of job specs, status is one of
+        'scheduled', 'replaced', 'modified' or 'exists'
+        """
+        jobs = []
+        errors = []
+        used_job_ids = set()
+        for idx, spec in enumerate(job_specs):
+            try:
+                job = cls._prepare_bulk_job(scheduler, spec, used_job_ids)
+            except ScheduleJobError as exc:
+                errors.append({'index': idx, 'error': str(exc)})
+                continue
+
+            used_job_ids.add(job.id)
+            jobs.append(job)
+
+        if errors:
+            raise BulkScheduleJobError(errors)
+
+        if not jobs:
+            return []
+
+        jobstore = scheduler._lookup_jobstore('default')
+        jobs_t = jobstore.jobs_t
+        result = []
+        try:
+            with jobstore.engine.begin() as connection:
+                columns = [jobs_t.c.id, jobs_t.c.job_state] if modify_existing else [jobs_t.c.id]
+                existing = {row[0]: row for row in connection.execute(
+                    select(columns).where(jobs_t.c.id.in_(used_job_ids)))}
+
+                if replace_existing and not modify_existing and existing:
+                    connection.execute(jobs_t.delete().where(jobs_t.c.id.in_(existing.keys())))
+
+                insert_rows = []
+                update_rows = []
+                for job in jobs:
+                    if job.id not in existing:
+                        status = 'scheduled'
+                    elif modify_existing:
+                        status = 'modified'
+                        job = cls._merge_bulk_job(
+                            jobstore._reconstitute_job(existing[job.id].job_state), job)
+                    elif replace_existing:
+                        status = 'replaced'
+                    else:
+                        result.append((job, 'exists'))
+                        continue
+
+                    row = {
+                        'next_run_time': datetime_to_utc_timestamp(job.next_run_time),
+                        'job_state': pickle.dumps(job.__getstate__(), jobstore.pickle_protocol)
+                    }
+                    if status == 'modified':
+                        row['job_id'] = job.id
+                        update_rows.append({'b_' + key: value for key, value in row.items()})
+                    else:
+                        row['id'] = job.id
+                        insert_rows.append(row)
+                    result.append((job, status))
+
+                # single executemany statements
+                if insert_rows:
+                    connection.execute(jobs_t.insert(), insert_rows)
+                if update_rows:
+                    connection.execute(jobs_t.update().where(
+                        jobs_t.c.id == bindparam('b_job_id')
+                    ).values(
+                        next_run_time=bindparam('b_next_run_time'),
+                        job_state=bindparam('b_job_state')
+                    ), update_rows)
+        except Exception as exc:
+            cls.log.exception(str(exc))
+            raise ScheduleJobError("Unable to schedule jobs: '%s'" % str(exc)) from exc
+
+        for job, status in result:
+            if status == 'exists':
+                continue
+
+            job._jobstore_alias = 'default'
+            event_code = EVENT_JOB_MODIFIED if status == 'modified' else EVENT_JOB_ADDED
+            scheduler._dispatch_event(JobEvent(event_code, job.id, 'default'))
+
+        cls.log.info("Bulk of %d jobs stored, %d jobs already existed",
+                     len(jobs), len(existing))
+
+        if cls._job_index is not None:
+            # cheaper than loading added jobs one by one
+            cls._job_index.invalidate()
+
+        if scheduler.state == STATE_RUNNING:
+            scheduler.wakeup()
+
+        return result
+
+    @staticmethod
+    def _get_existing_job_ids(scheduler, job_ids):
+        """Get ids of jobs that exist in the job store, using a single query.
+
+        :param scheduler: scheduler which job store should be queried
+        :param job_ids: ids of jobs to check
+        :return: a set of ids of existing jobs
+        """
+        jobstore = scheduler._lookup_jobstore('default')
+        jobs_t = jobstore.jobs_t
+        query = select([jobs_t.c.id]).where(jobs_t.c.id.in_(list(job_ids)))
+        return {row[0] for row in jobstore.engine.execute(query)}
+
+    @staticmethod
+    def _effective_job_options(job_info):
+        """Get options of the default job not stated in its definition but taken from defaults.
+
+        They affect how the job is registered, so they are a part of its fingerprint - the job
+        is registered again once e.g. the handler is moved to another executor pool.
+
+        :param job_info: definition of the default job
+        :return: a dict with the executor, jitter and spread the job is registered with
+        """
+        handler = getattr(handlers, job_info['handler'], None)
+        jitter = job_info.get('jitter')
+        spread = job_info.get('spread')
+        return {
+            'executor': job_info.get('executor') or getattr(handler, 'executor', None),
+            'jitter': configuration.PERIODIC_JOBS_JITTER if jitter is None else jitter,
+            'spread': configuration.PERIODIC_JOBS_SPREAD if spread is None else spread
+        }
+
+    @classmethod
+    def _read_default_jobs(cls, job_dir):
+        """Read definitions of default jobs.
+
+        :param job_dir: directory in which the default jobs sit (YAML files)
+        :return: a dict mapping job id to a tuple - job definition, its fingerprint (of the file
+        content and effective job options) and file
+        """
+        default_jobs = {}
+        for job_file_basename in sorted(os.listdir(job_dir)):
             job_file = os.path.join(job_dir, job_file_basename)
 
             if not os.path.isfile(job_file) or job_file_basename.startswith("."):
                 cls.log.warning("Skipping file '%s'", job_file)
+                continue
+
+            cls.log.info("Processing file '%s'" % job_file_basename)
+            with open(job_file, 'rb') as f:
+                content = f.read()
 
-            with open(job_file, 'r') as f:
-                job_info = yaml.load(f, Loader=yaml.SafeLoader)
+            job_info = yaml.load(content, Loader=yaml.SafeLoader)
 
             if 'handler' not in job_info:
                 raise ValueError("Expected handler name under 'handler' key in file '%s'", job_file)
@@ -266,14 +706,93 @@ class Scheduler(object):
             if 'job_id' not in job_info:
                 raise ValueError("Expected job ID under 'job_id' key in file '%s'", job_file)
 
-            cls.log.info("Registering default job '%s'", job_info['job_id'])
+            digest = hashlib.sha256(content)
+            digest.update(json.dumps(cls._effective_job_options(job_info),
+                                     sort_keys=True).encode())
+            default_jobs[job_info['job_id']] = (job_info, digest.hexdigest(), job_file)
+
+        return default_jobs
+
+    @classmethod
+    def register_default_jobs(cls, job_dir):
+        """Register default jobs as stated in configuration files.
+
+        Default jobs which definition did not change since the last registration (based on
+        fingerprints of their definitions) are skipped, changes are applied in one batch.
 
+        :param job_dir: directory in which the default jobs sit (YAML files)
+        """
+        cls.log.info("Registering default jobs")
+        scheduler = cls.get_paused_scheduler()
+
+        default_jobs = cls._read_default_jobs(job_dir)
+        fingerprints = DefaultJobFingerprint.get_all()
+        existing = cls._get_existing_job_ids(scheduler, default_jobs.keys())
+        # jobs could be removed meanwhile, re-register them even if the definition is the same
+        changed = [job_id for job_id, (_, fingerprint, _) in default_jobs.items()
+                   if fingerprints.get(job_id) != fingerprint or job_id not in existing]
+
+        cls.log.info("Default jobs changed since the last registration: %d of %d",
+                     len(changed), len(default_jobs))
+
+        while changed:
             try:
-                job = cls.schedule_job(scheduler, job_info.pop('handler'),
-                                       modify_existing_job=True, **job_info)
-                cls.log.info("Job '%s' from file '%s' successfully added", job_file, job.id)
+                cls.schedule_jobs_bulk(scheduler, [default_jobs[job_id][0] for job_id in changed],
+                                       modify_existing=True)
+                break
+            except BulkScheduleJobError as exc:
+                for error in exc.errors:
+                    cls.log.error("Failed to register job from file '%s': %s",
+                                  default_jobs[changed[error['index']]][2], error['error'])
+                invalid = {error['index'] for error in exc.errors}
+                changed = [job_id for idx, job_id in enumerate(changed) if idx not in invalid]
             except ScheduleJobError as exc:
-                cls.log.exception("Failed to register job from file '%s': %s", job_file, str(exc))
+                cls.log.exception("Failed to register default jobs: %s", str(exc))
+                return
+
+        for job_id in changed:
+            cls.log.info("Job '%s' from file '%s' successfully registered",
+                         job_id, default_jobs[job_id][2])
+
+        DefaultJobFingerprint.store({job_id: default_jobs[job_id][1] for job_id in changed})
+
+    @classmethod
+    def migrate_failed_jobs(cls):
+        """Move failures stored as paused ErrorHandler jobs to the failed job store."""
+        scheduler = cls.get_paused_scheduler()
+        migrated = 0
+
+        for job in scheduler.get_jobs():
+            if not is_failed_job_handler_name(job.args[0]):
+                continue
+
+            details = job.kwargs.get('kwargs', job.kwargs)
+            try:
+                FailedJob.record(details.get('failed_job_handler') or 'unknown',
+                                 details.get('failed_job_id'),
+                                 details.get('failed_handler_kwargs'),
+                                 details.get('exc_str'),
+                                 details.get('exc_traceback') or '')
+            except Exception as exc:
+                cls.log.exception("Failed to migrate failed job '%s': %s", job.id, str(exc))
+                continue
+
+            scheduler.remove_job(job.id)
+            migrated += 1
+
+        cls.log.info("Migrated %d failed jobs to the failed job store", migrated)
+
+
+def init_worker():
+    """Drop connections inherited from the parent process in a forked job worker.
+
+    Run by PreforkedProcessPoolExecutor in each worker process. Inherited connections are kept
+    open, closing them would close connections of the parent as well (see keep_inherited()).
+    """
+    keep_inherited(Scheduler._leader_elector)
+    Scheduler._leader_elector = None
+    dispose_inherited_engine()
+    handlers.base.HANDLER_CONTEXT.reset()
 
 
 def job_execute(handler_name, job_id, **handler_kwargs):
@@ -281,39 +800,95 @@ def job_execute(handler_name, job_id, **handler_kwargs):
 
     :param handler_name: name of the handler that should be run
     :param job_id: id of the handler that should be run
-    :param handler_kwargs: handler keyword arguments
+    :param handler_kwargs: handler keyword arguments, the number of the attempt to run the job
+    is passed under JobRetryListener.ATTEMPT_KWARG by retries of failed runs
+    :return: a dict describing the job run, used for job metrics (see JobMetricsListener) and
+    retries (see JobRetryListener)
     """
     # This has to ba a function as apscheduler does not handler classmethods transparently
     handler = getattr(handlers, handler_name)
+    attempt = handler_kwargs.pop(JobRetryListener.ATTEMPT_KWARG, 1)
+    succeeded = False
+    retry = None
+
+    # time spent waiting for a free slot (see ConcurrencyLimitedExecutor) is reported as job
+    # lag, not as job duration
+    started_at = time()
+    start = monotonic()
     instance = handler(job_id)
+    # retries of failed runs do not resume from checkpoints of the job (see JobRetryListener)
+    checkpoint_job_id = JobRetryListener.get_retry_job_id(job_id) if attempt > 1 else job_id
+    instance.checkpoint_id = JobCheckpoint.compute_id(checkpoint_job_id, handler_kwargs)
 
     try:
         instance.execute(**handler_kwargs)
     except Exception as exc:
-        logging.exception("Job '%s' failed, registering ErrorHandler: %s", job_id, str(exc))
-        if not is_failed_job_handler_name(handler_name):
-            exc_traceback = traceback.format_exc()
-            error_handler_kwargs = {
-                'exc_str': str(exc),
-                'exc_traceback': exc_traceback,
-                'failed_job_id': job_id,
-                'failed_job_handler': handler_name,
-                'failed_handler_kwargs': handler_kwargs
+        logging.exception("Job '%s' failed, recording failure: %s", job_id, str(exc))
+        try:
+            FailedJob.record(handler_name, job_id, handler_kwargs, str(exc),
+                             traceback.format_exc())
+        except Exception:
+            Scheduler.log.exception("Failed to record failure of job '%s'", job_id)
+
+        if handler.retry_policy is not None and handler.retry_policy.should_retry(exc, attempt):
+            retry = {
+                'job_id': job_id,
+                'attempt': attempt + 1,
+                'delay': handler.retry_policy.get_delay(attempt),
+                'kwargs': handler_kwargs
             }
-            Scheduler.schedule_job(Scheduler.get_paused_scheduler(), handlers.ErrorHandler.__name__,
-                                   state='paused', kwargs=error_handler_kwargs)
-        else:
-            Scheduler.log.exception("Failed to record job failure job")
     else:
+        succeeded = True
         logging.info("Job '%s' successfully finished", job_id)
+        try:
+            instance.clear_checkpoint()
+        except Exception:
+            Scheduler.log.exception("Failed to clear checkpoint of job '%s'", job_id)
+
+    return {
+        'handler': handler_name,
+        'succeeded': succeeded,
+        'started_at': started_at,
+        'duration': monotonic() - start,
+        'flows_dispatched': dict(instance.flows_dispatched),
+        'flow_dispatch_chunks': instance.flow_dispatch_chunks,
+        'flow_dedupe_lookups': dict(instance.flow_dedupe_lookups),
+        'http_cache_lookups': dict(instance.http_cache_lookups),
+        'retry': retry
+    }
 
 
 def uses_scheduler(func):
-    """Wrap the specified function - add a scheduler instance as a first argument."""
+    """Wrap the specified function - add a scheduler instance as a first argument.
+
+    Calls are serialized using the scheduler lock, use it for functions that modify jobs.
+    """
     @wraps(func)
     def wrapper(*args, **kwargs):
         # possible bottleneck here - I'm not sure if apscheduler implementation
         # is thread safe - suppose not
-        with Scheduler.scheduler_lock:
+        if not Scheduler.scheduler_lock.acquire(blocking=False):
+            SCHEDULER_LOCK_CONTENDED.inc(operation=func.__name__)
+            start = monotonic()
+            Scheduler.scheduler_lock.acquire()
+            SCHEDULER_LOCK_WAIT.observe(monotonic() - start, operation=func.__name__)
+        else:
+            SCHEDULER_LOCK_WAIT.observe(0.0, operation=func.__name__)
+
+        try:
             return func(Scheduler.get_scheduler(), *args, **kwargs)
+        finally:
+            Scheduler.scheduler_lock.release()
+    return wrapper
+
+
+def reads_scheduler(func):
+    """Wrap the specified function - add a scheduler instance as a first argument.
+
+    No lock is acquired so read-only calls never wait on calls modifying jobs. Use
+    Scheduler.get_job_index() for listing jobs in wrapped functions.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(Scheduler.get_scheduler(), *args, **kwargs)
     return wrapper
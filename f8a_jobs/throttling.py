@@ -0,0 +1,253 @@
+"""Outbound rate limiting and per-handler concurrency limits shared by job handlers.
+
+Rate limiters are named token buckets, typically one per upstream host (e.g. 'api.github.com'),
+handlers declare the one they use (see BaseHandler.rate_limiter). They keep their state in
+shared memory and are created before process pool workers are forked, so limits apply across
+all executor pools of the scheduler process, not per worker.
+
+Concurrency limits cap the number of jobs of a handler running at the same time (see
+BaseHandler.max_concurrency). They are enforced by executors in the scheduler process when jobs
+are submitted (see ConcurrencyLimitedExecutor), runs over the limit wait in the scheduler
+process instead of occupying executor workers.
+"""
+
+import logging
+import multiprocessing
+from collections import Counter, defaultdict, deque
+from threading import Lock
+from time import monotonic, sleep
+
+import f8a_jobs.defaults as configuration
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter shared across threads and forked processes."""
+
+    def __init__(self, name, rate, burst):
+        """Construct the token bucket, it starts full.
+
+        :param name: name of the rate limiter
+        :param rate: number of tokens (requests) refilled per second
+        :param burst: maximum number of tokens available at once
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate limiter '%s' requires positive rate and burst of at least 1"
+                             % name)
+
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.RawValue('d', self.burst)
+        self._updated_at = multiprocessing.RawValue('d', monotonic())
+
+    def _take(self, tokens):
+        """Take tokens if available.
+
+        :return: 0 if tokens were taken, number of seconds to wait for tokens otherwise
+        """
+        with self._lock:
+            now = monotonic()
+            elapsed = max(now - self._updated_at.value, 0.0)
+            self._tokens.value = min(self.burst, self._tokens.value + elapsed * self.rate)
+            self._updated_at.value = now
+
+            if self._tokens.value >= tokens:
+                self._tokens.value -= tokens
+                return 0.0
+
+            return (tokens - self._tokens.value) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until the given number of tokens is available and take them.
+
+        :param tokens: number of tokens to take
+        :return: number of seconds spent waiting
+        """
+        if tokens > self.burst:
+            raise ValueError("Cannot acquire %d tokens from rate limiter '%s' with burst %d"
+                             % (tokens, self.name, self.burst))
+
+        waited = 0.0
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return waited
+            sleep(wait)
+            waited += wait
+
+
+def parse_rate_limits(rate_limits):
+    """Parse configuration of rate limiters.
+
+    :param rate_limits: comma separated definitions in the form of 'name:rate:burst', rate is
+    number of requests per second, e.g. 'api.github.com:0.5:5,mvnrepository.com:1:3'
+    :return: a dict mapping rate limiter name to a tuple (rate, burst)
+    """
+    result = {}
+    for limit in rate_limits.split(','):
+        limit = limit.strip()
+        if not limit:
+            continue
+
+        try:
+            # host names can contain colons only with a port, split from the right
+            name, rate, burst = limit.rsplit(':', 2)
+            result[name] = (float(rate), int(burst))
+        except ValueError as exc:
+            raise ValueError("Unable to parse rate limiter definition '%s', expected "
+                             "'name:rate:burst'" % limit) from exc
+
+    return result
+
+
+def parse_concurrency_limits(concurrency_limits):
+    """Parse configuration of per-handler concurrency limits.
+
+    :param concurrency_limits: comma separated definitions in the form of 'handler:limit',
+    e.g. 'GitHubMostStarred:1,MavenPopularAnalyses:2'
+    :return: a dict mapping handler name to maximum number of concurrently running jobs
+    """
+    result = {}
+    for limit in concurrency_limits.split(','):
+        limit = limit.strip()
+        if not limit:
+            continue
+
+        try:
+            handler_name, max_concurrency = limit.split(':')
+            result[handler_name] = int(max_concurrency)
+        except ValueError as exc:
+            raise ValueError("Unable to parse concurrency limit definition '%s', expected "
+                             "'handler:limit'" % limit) from exc
+
+    return result
+
+
+class ConcurrencyLimiter(object):
+    """Limits of the number of jobs of a handler running at the same time."""
+
+    def __init__(self):
+        """Construct the limiter, no handler is limited."""
+        self._lock = Lock()
+        self._limits = {}
+        self._running = Counter()
+        # handler name -> submissions waiting for a free slot, in order of arrival
+        self._waiting = defaultdict(deque)
+
+    def set_limit(self, handler_name, max_concurrency):
+        """Limit number of jobs of the handler running at the same time.
+
+        :param handler_name: name of the handler
+        :param max_concurrency: maximum number of jobs running at the same time
+        """
+        if max_concurrency < 1:
+            raise ValueError("Concurrency limit of handler '%s' has to be positive" % handler_name)
+
+        with self._lock:
+            self._limits[handler_name] = max_concurrency
+
+    def get_limit(self, handler_name):
+        """Get concurrency limit of the handler, None if it is not limited."""
+        return self._limits.get(handler_name)
+
+    def get_limits(self):
+        """Get a dict mapping names of limited handlers to their limits."""
+        with self._lock:
+            return dict(self._limits)
+
+    def waiting(self, handler_name):
+        """Get number of jobs of the handler waiting for a free slot."""
+        with self._lock:
+            return len(self._waiting.get(handler_name, ()))
+
+    def submit(self, handler_name, submit, submit_deferred=None):
+        """Submit a job of the handler now if there is a free slot, once a slot is freed if not.
+
+        Each submitted job holds a slot until release() is called for it.
+
+        :param handler_name: name of the handler which job is about to be submitted
+        :param submit: callable submitting the job right away, exceptions it raises are
+        propagated and the slot is released
+        :param submit_deferred: callable submitting the job once a slot is freed, submit is
+        used if not given
+        :return: True if the job was submitted right away, False if it waits for a free slot
+        """
+        with self._lock:
+            max_concurrency = self._limits.get(handler_name)
+            if max_concurrency is not None and self._running[handler_name] >= max_concurrency:
+                self._waiting[handler_name].append(submit_deferred or submit)
+                logger.info("Concurrency limit of %d jobs reached for handler '%s', job waits "
+                            "for a free slot", max_concurrency, handler_name)
+                return False
+            self._running[handler_name] += 1
+
+        try:
+            submit()
+        except BaseException:
+            self.release(handler_name)
+            raise
+
+        return True
+
+    def release(self, handler_name):
+        """Release a slot of the finished job of the handler, the next waiting job is submitted.
+
+        :param handler_name: name of the handler which job finished
+        """
+        while True:
+            with self._lock:
+                waiting = self._waiting.get(handler_name)
+                if not waiting:
+                    self._running[handler_name] = max(self._running[handler_name] - 1, 0)
+                    return
+                # the slot is handed over to the waiting job
+                submit = waiting.popleft()
+
+            try:
+                submit()
+                return
+            except Exception:
+                logger.exception("Failed to submit job of handler '%s' waiting for a free slot",
+                                 handler_name)
+
+
+_RATE_LIMITERS = {name: TokenBucket(name, rate, burst)
+                  for name, (rate, burst) in parse_rate_limits(configuration.RATE_LIMITS).items()}
+# names of rate limiters requested but not configured, reported once
+_MISSING_RATE_LIMITERS = set()
+CONCURRENCY_LIMITER = ConcurrencyLimiter()
+
+
+def get_rate_limiter(name):
+    """Get rate limiter of the given name.
+
+    :param name: name of the rate limiter
+    :return: TokenBucket instance or None if no such rate limiter is configured
+    """
+    limiter = _RATE_LIMITERS.get(name)
+    if limiter is None and name and name not in _MISSING_RATE_LIMITERS:
+        _MISSING_RATE_LIMITERS.add(name)
+        logger.warning("Rate limiter '%s' is not configured (JOB_SERVICE_RATE_LIMITS), requests "
+                       "using it are not rate limited", name)
+    return limiter
+
+
+def init_concurrency_limits(handler_classes, limiter=CONCURRENCY_LIMITER):
+    """Set concurrency limits of handlers.
+
+    Limits stated by handlers (BaseHandler.max_concurrency) can be overridden using
+    JOB_SERVICE_CONCURRENCY_LIMITS.
+
+    :param handler_classes: a dict mapping handler name to handler class
+    :param limiter: ConcurrencyLimiter the limits are set on
+    """
+    limits = {name: getattr(handler_class, 'max_concurrency', None)
+              for name, handler_class in handler_classes.items()}
+    limits.update(parse_concurrency_limits(configuration.CONCURRENCY_LIMITS))
+
+    for handler_name, max_concurrency in limits.items():
+        if max_concurrency is not None:
+            limiter.set_limit(handler_name, max_concurrency)
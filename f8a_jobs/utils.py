@@ -156,7 +156,7 @@ def requires_aws_sqs_access(func):
                               aws_access_key_id=configuration.AWS_ACCESS_KEY_ID,
                               aws_secret_access_key=configuration.AWS_SECRET_ACCESS_KEY,
                               region_name=configuration.AWS_SQS_REGION)
-        func(client, *args, **kwargs)
+        return func(client, *args, **kwargs)
 
     return wrapper
 
@@ -2,6 +2,12 @@
 
 set -ex
 
+JOB_SERVICE_WORKERS=${JOB_SERVICE_WORKERS:-1}
+if [ "${JOB_SERVICE_WORKERS}" -gt 1 ]; then
+    # jobs would be executed in each process otherwise
+    export JOB_SERVICE_LEADER_ELECTION=true
+fi
+
 f8a-jobs.py initjobs
 cd /usr/local/bin/
-exec uwsgi --http 0.0.0.0:34000 -p 1 -w f8a-jobs --enable-threads
+exec uwsgi --http 0.0.0.0:34000 -p "${JOB_SERVICE_WORKERS}" -w f8a-jobs --enable-threads --lazy-apps
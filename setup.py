@@ -15,7 +15,7 @@ def get_requirements():
     needed to run the application.
     """
     with open('requirements.in') as fd:
-        return fd.read().splitlines()
+        return [line for line in fd.read().splitlines() if not line.startswith('#')]
 
 
 install_requires = get_requirements()
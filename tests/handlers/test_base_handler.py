@@ -1,7 +1,17 @@
 """Tests for base.py."""
 
+from unittest import mock
+
 import pytest
-from f8a_jobs.handlers.base import AnalysesBaseHandler
+import requests
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.elements import TextClause
+from f8a_jobs.handlers.base import (AnalysesBaseHandler, BaseHandler, CountRange, RetryPolicy,
+                                    EcosystemBackendCache, HandlerContext, SelectQueryCache)
+from f8a_jobs.flow_dedupe import FlowDeduplicator
+from f8a_jobs.http_cache import HttpCache
+from f8a_jobs.handlers.flow import FlowScheduling
 
 
 class TestAnalysesBaseHandler(object):
@@ -14,3 +24,596 @@ class TestAnalysesBaseHandler(object):
     def test_parse_count(self, count, expected):
         """Test parse_count()."""
         assert AnalysesBaseHandler.parse_count(count) == expected
+
+
+class TestBaseHandlerCheckpoints(object):
+    """Tests for checkpoints of BaseHandler."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool'),
+            mock.patch('f8a_jobs.handlers.base.get_session'),
+            mock.patch('f8a_jobs.handlers.base.configuration.CHECKPOINT_INTERVAL', 30)
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.handler = BaseHandler('job-1')
+        self.handler.checkpoint_id = 'job-1:0123'
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_load_checkpoint(self):
+        """Test that the cursor stored for the job and handler is returned."""
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint:
+            checkpoint.get.return_value = {'last_id': 42}
+            assert self.handler.load_checkpoint() == {'last_id': 42}
+        assert checkpoint.get.call_args[0] == ('job-1:0123', 'BaseHandler')
+
+    def test_save_checkpoint_interval(self):
+        """Test that checkpoints are stored at most once per interval unless forced."""
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint, \
+                mock.patch('f8a_jobs.handlers.base.monotonic') as monotonic:
+            monotonic.return_value = self.handler._checkpoint_stored_at + 10
+            assert not self.handler.save_checkpoint(1)
+            assert self.handler.save_checkpoint(1, force=True)
+
+            monotonic.return_value += 10
+            assert not self.handler.save_checkpoint(2)
+            monotonic.return_value += 30
+            assert self.handler.save_checkpoint(3)
+
+        assert [c[0][2] for c in checkpoint.store.call_args_list] == [1, 3]
+
+    def test_save_checkpoint_error(self):
+        """Test that a failure to store a checkpoint does not fail the job."""
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint:
+            checkpoint.store.side_effect = SQLAlchemyError()
+            assert not self.handler.save_checkpoint(1, force=True)
+            self.handler.clear_checkpoint()
+        checkpoint.clear.assert_not_called()
+
+    def test_clear_checkpoint(self):
+        """Test that a checkpoint is deleted only if there is one."""
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint:
+            self.handler.clear_checkpoint()
+            checkpoint.clear.assert_not_called()
+
+            self.handler.save_checkpoint(1, force=True)
+            self.handler.clear_checkpoint()
+        assert checkpoint.clear.call_args[0] == ('job-1:0123',)
+
+    def test_named_checkpoint(self):
+        """Test that named checkpoints are stored along the checkpoint of the job."""
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint:
+            assert self.handler.save_checkpoint([1, 2, 3], force=True, name='entries')
+            self.handler.load_checkpoint('entries')
+        assert checkpoint.store.call_args[0][:3] == ('job-1:0123/entries', 'BaseHandler',
+                                                     [1, 2, 3])
+        assert checkpoint.get.call_args[0] == ('job-1:0123/entries', 'BaseHandler')
+
+    def test_no_job_id(self):
+        """Test that handlers run outside of the scheduler do not use checkpoints."""
+        handler = BaseHandler(None)
+        with mock.patch('f8a_jobs.handlers.base.JobCheckpoint') as checkpoint:
+            assert handler.load_checkpoint() is None
+            assert not handler.save_checkpoint(1, force=True)
+        checkpoint.get.assert_not_called()
+        checkpoint.store.assert_not_called()
+
+
+class TestEstimateFlows(object):
+    """Tests for estimates of flows dispatched by jobs."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool'),
+            mock.patch.object(BaseHandler, 'construct_select_query',
+                              return_value='SELECT * FROM packages')
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_flow_scheduling(self):
+        """Test that filters are counted in database and other flow arguments one by one."""
+        handler = FlowScheduling(None)
+        handler.postgres.session.execute.return_value.scalar.return_value = 1000
+        estimate = handler.estimate_flows('bayesianFlow', [
+            {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'},
+            {'$filter': {'table': 'packages'}}
+        ])
+        assert estimate == CountRange(min=1001, max=1001)
+        statement = handler.postgres.session.execute.call_args[0][0]
+        assert statement == 'SELECT COUNT(*) FROM (SELECT * FROM packages) AS filter_query'
+
+    def test_flow_scheduling_explain(self):
+        """Test that row estimates of the query planner are used if requested."""
+        handler = FlowScheduling(None)
+        handler.postgres.session.execute.return_value.scalar.return_value = \
+            '[{"Plan": {"Plan Rows": 250}}]'
+        estimate = handler.estimate_flows('bayesianFlow', [{'$filter': {'table': 'packages'}}],
+                                          explain=True)
+        assert estimate == CountRange(min=250, max=250)
+        statement = handler.postgres.session.execute.call_args[0][0]
+        assert statement.startswith('EXPLAIN (FORMAT JSON) ')
+
+    def test_explain_select_query(self):
+        """Test that execution plan is parsed from the EXPLAIN output."""
+        handler = BaseHandler(None)
+        handler.postgres.session.execute.return_value.scalar.return_value = \
+            '[{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 250}}]'
+        plan = handler.explain_select_query('SELECT * FROM packages')
+        assert plan == [{'Plan': {'Node Type': 'Seq Scan', 'Plan Rows': 250}}]
+        handler.postgres.session.execute.assert_called_once_with(
+            'EXPLAIN (FORMAT JSON) SELECT * FROM packages')
+
+    @pytest.mark.parametrize(('count', 'nversions', 'expected'), [
+        (None, None, CountRange(min=0, max=3000)),
+        ('10', 1, CountRange(min=0, max=10)),
+        ('11-20', 2, CountRange(min=0, max=20))
+    ])
+    def test_analyses(self, count, nversions, expected):
+        """Test that analyses are estimated based on count and nversions."""
+        handler = AnalysesBaseHandler(None)
+        assert handler.estimate_flows(ecosystem='npm', count=count, nversions=nversions) == \
+            expected
+
+    def test_unknown(self):
+        """Test that handlers do not estimate flows by default."""
+        assert BaseHandler(None).estimate_flows(foo='bar') is None
+
+
+class TestHttpGet(object):
+    """Tests for requests made to upstream services."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool')
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.handler = BaseHandler(None)
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    @mock.patch('f8a_jobs.handlers.base.requests.Session')
+    def test_session_reused(self, session):
+        """Test that requests share one session keeping connections alive."""
+        self.handler.http_get('http://localhost/a')
+        self.handler.http_get('http://localhost/b', timeout=10)
+        session.assert_called_once_with()
+        assert session.return_value.get.call_args_list == [
+            mock.call('http://localhost/a'), mock.call('http://localhost/b', timeout=10)
+        ]
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_http_get_many_ordered(self, workers):
+        """Test that responses of concurrent requests are yielded in the order of URLs."""
+        urls = ['http://localhost/{}'.format(idx) for idx in range(20)]
+        self.handler.http_get = mock.Mock(side_effect=lambda url, **kwargs: url)
+        assert list(self.handler.http_get_many(urls, workers=workers, timeout=10)) == urls
+        self.handler.http_get.assert_called_with(urls[-1], rate_limiter=None, timeout=10)
+
+    def test_http_get_cached(self, tmpdir):
+        """Test that pages are fetched through the HTTP cache and lookups are counted."""
+        response = mock.Mock(status_code=200, content=b'<html></html>', encoding='utf-8',
+                             headers={'ETag': '"v1"'})
+        self.handler.http_get = mock.Mock(return_value=response)
+        cache = HttpCache(str(tmpdir), ttl=60, max_size=1024 * 1024)
+        with mock.patch('f8a_jobs.handlers.base.HTTP_CACHE', cache):
+            assert self.handler.http_get_cached('http://localhost/a', timeout=10) is response
+            assert self.handler.http_get_cached('http://localhost/a', timeout=10).content == \
+                b'<html></html>'
+
+        self.handler.http_get.assert_called_once_with('http://localhost/a', rate_limiter=None,
+                                                      timeout=10)
+        assert self.handler.http_cache_lookups == {'hit': 1, 'miss': 1}
+
+    def test_http_get_cached_disabled(self):
+        """Test that pages are fetched directly if the HTTP cache is disabled."""
+        self.handler.http_get = mock.Mock()
+        with mock.patch('f8a_jobs.handlers.base.HTTP_CACHE', HttpCache('', ttl=60, max_size=0)):
+            self.handler.http_get_cached('http://localhost/a', rate_limiter='foo')
+            self.handler.http_get_cached('http://localhost/a', rate_limiter='foo')
+
+        assert self.handler.http_get.call_count == 2
+        self.handler.http_get.assert_called_with('http://localhost/a', rate_limiter='foo')
+        assert self.handler.http_cache_lookups == {}
+
+
+class TestHandlerContext(object):
+    """Tests for HandlerContext class."""
+
+    @mock.patch('f8a_jobs.handlers.base.os.getpid', return_value=1)
+    @mock.patch('f8a_jobs.handlers.base.init_celery')
+    def test_setup_once_per_process(self, init_celery, getpid):
+        """Test that Celery is initialized once per process."""
+        context = HandlerContext()
+        context.setup()
+        context.setup()
+        init_celery.assert_called_once_with(result_backend=False)
+
+        # forked process pool worker
+        getpid.return_value = 2
+        context.setup()
+        context.setup()
+        assert init_celery.call_count == 2
+
+    @mock.patch('f8a_jobs.handlers.base.os.getpid', return_value=1)
+    @mock.patch('f8a_jobs.handlers.base.keep_inherited')
+    @mock.patch('f8a_jobs.handlers.base.Config')
+    @mock.patch('f8a_jobs.handlers.base.StoragePool')
+    def test_storages_reconnected_after_fork(self, storage_pool, config, keep_inherited,
+                                             getpid):
+        """Test that storages and broker pools connected by the parent are not used after fork."""
+        connected, disconnected = mock.Mock(), mock.Mock()
+        connected.is_connected.return_value = True
+        disconnected.is_connected.return_value = False
+        config.storage_mapping = {'BayesianPostgres': connected, 'S3Data': disconnected}
+        context = HandlerContext()
+        context.get_storage('BayesianPostgres')
+        connected.connect.assert_not_called()
+
+        # forked process pool worker
+        getpid.return_value = 2
+        context.get_storage('BayesianPostgres')
+        connected.connect.assert_called_once_with()
+        disconnected.connect.assert_not_called()
+        config.celery_app._after_fork.assert_called_once_with()
+        # connections of the parent are kept referenced, not closed
+        connected.disconnect.assert_not_called()
+        assert keep_inherited.called
+
+        context.get_storage('BayesianPostgres')
+        assert connected.connect.call_count == 1
+
+    @mock.patch('f8a_jobs.handlers.base.HANDLER_CONTEXT_SETUP')
+    @mock.patch('f8a_jobs.handlers.base.StoragePool')
+    def test_get_storage(self, storage_pool, handler_context_setup):
+        """Test that time spent connecting storages is reported once per storage."""
+        context = HandlerContext()
+        for _ in range(3):
+            assert context.get_storage('BayesianPostgres') is \
+                storage_pool.get_connected_storage.return_value
+        context.get_storage('S3Data')
+
+        assert storage_pool.get_connected_storage.call_count == 4
+        reported = [c[1]['component'] for c in handler_context_setup.set.call_args_list]
+        assert reported == ['BayesianPostgres', 'S3Data']
+
+
+class TestRunSelinonFlow(object):
+    """Tests for dispatching of Selinon flows."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.deduplicator = FlowDeduplicator(ttl=60, max_size=100)
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch.object(BaseHandler, '_normalize_package_name'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool'),
+            mock.patch('f8a_jobs.handlers.base.FLOW_DEDUPLICATOR', self.deduplicator)
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    @mock.patch('f8a_jobs.handlers.base.run_flow', return_value='dispatcher-id')
+    @mock.patch('f8a_jobs.handlers.base.BACKPRESSURE')
+    def test_backpressure_scheduled_jobs_only(self, backpressure, run_flow):
+        """Test that only scheduled jobs wait for backed up queues, API calls never do."""
+        backpressure.wait.return_value = 0.0
+        BaseHandler(None).run_selinon_flow('livenessFlow', None)
+        backpressure.wait.assert_not_called()
+
+        BaseHandler('job-1').run_selinon_flow('livenessFlow', {})
+        backpressure.wait.assert_called_once_with('livenessFlow')
+        assert run_flow.call_count == 2
+
+    @mock.patch('f8a_jobs.handlers.base.run_flow', return_value='dispatcher-id')
+    def test_duplicates_suppressed(self, run_flow):
+        """Test that flows dispatched recently with the same arguments are not dispatched again."""
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        assert BaseHandler('job-1').run_selinon_flow('bayesianFlow', dict(node_args)) == \
+            'dispatcher-id'
+
+        handler = BaseHandler('job-2')
+        assert handler.run_selinon_flow('bayesianFlow', dict(node_args)) is None
+        assert run_flow.call_count == 1
+        assert handler.flows_dispatched == {}
+        assert handler.flow_dedupe_lookups == {('bayesianFlow', 'hit'): 1}
+
+    @mock.patch('f8a_jobs.handlers.base.run_flow', return_value='dispatcher-id')
+    def test_forced_dispatched(self, run_flow):
+        """Test that forced flows are always dispatched."""
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        handler = BaseHandler('job-1')
+        handler.run_selinon_flow('bayesianFlow', dict(node_args))
+        for _ in range(2):
+            assert handler.run_selinon_flow('bayesianFlow', dict(node_args, force=True)) == \
+                'dispatcher-id'
+        assert run_flow.call_count == 3
+        assert handler.flow_dedupe_lookups == {('bayesianFlow', 'miss'): 1}
+
+    @mock.patch('f8a_jobs.handlers.base.run_flow', return_value='dispatcher-id')
+    @mock.patch('f8a_jobs.handlers.base.BACKPRESSURE')
+    def test_claimed_after_wait(self, backpressure, run_flow):
+        """Test that a flow is not claimed if waiting for its queue fails."""
+        backpressure.wait.side_effect = RuntimeError
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        with pytest.raises(RuntimeError):
+            BaseHandler('job-1').run_selinon_flow('bayesianFlow', dict(node_args))
+
+        backpressure.wait.side_effect = None
+        backpressure.wait.return_value = 0.0
+        assert BaseHandler('job-2').run_selinon_flow('bayesianFlow', dict(node_args)) == \
+            'dispatcher-id'
+
+    @mock.patch('f8a_jobs.flow_dispatch.Config.dispatcher_queues',
+                {'bayesianFlow': 'bayesian_queue'}, create=True)
+    @mock.patch('f8a_jobs.flow_dispatch.Dispatcher')
+    def test_batch_claimed_per_chunk(self, dispatcher):
+        """Test that flows of a batch are claimed once their chunk is published."""
+        handler = BaseHandler('job-1')
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        with mock.patch.object(self.deduplicator, 'lookup_many',
+                               wraps=self.deduplicator.lookup_many) as lookup_many:
+            with handler.flow_dispatch_batch(chunk_size=3):
+                for version in ('1.0.0', '1.0.1', '1.0.0', '1.0.2'):
+                    handler.run_selinon_flow('bayesianFlow', dict(node_args, version=version))
+
+        assert lookup_many.call_count == 2
+        assert dispatcher.return_value.apply_async.call_count == 3
+        assert handler.flow_dedupe_lookups == {('bayesianFlow', 'hit'): 1,
+                                               ('bayesianFlow', 'miss'): 3}
+
+    @mock.patch('f8a_jobs.handlers.base.run_flow', side_effect=RuntimeError)
+    def test_failed_dispatch_forgotten(self, run_flow):
+        """Test that flows which failed to be dispatched are not considered as duplicates."""
+        handler = BaseHandler(None)
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                handler.run_selinon_flow('bayesianFlow', dict(node_args))
+
+        assert handler.flow_dedupe_lookups == {('bayesianFlow', 'miss'): 2}
+
+    @mock.patch('f8a_jobs.flow_dispatch.Config.dispatcher_queues',
+                {'bayesianFlow': 'bayesian_queue'}, create=True)
+    @mock.patch('f8a_jobs.flow_dispatch.Dispatcher')
+    def test_failed_batch_forgotten(self, dispatcher):
+        """Test that flows of a batch which failed to be published are forgotten."""
+        dispatcher.return_value.apply_async.side_effect = ConnectionError
+        handler = BaseHandler('job-1')
+        node_args = {'ecosystem': 'npm', 'name': 'foo', 'version': '1.0.0'}
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                with handler.flow_dispatch_batch():
+                    handler.run_selinon_flow('bayesianFlow', dict(node_args))
+
+        assert handler.flow_dedupe_lookups == {('bayesianFlow', 'miss'): 2}
+
+
+class TestExpandFilterQuery(object):
+    """Tests for streamed expansion of filter queries."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool'),
+            mock.patch.object(BaseHandler, 'construct_select_query',
+                              return_value='SELECT * FROM packages')
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.handler = BaseHandler(None)
+        self.connection = self.handler.postgres.session.get_bind.return_value.connect.return_value
+        self.result = self.connection.execution_options.return_value.execute.return_value
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_streamed(self):
+        """Test that rows are fetched in chunks using a server-side cursor."""
+        self.result.fetchmany.side_effect = [
+            [{'name': 'foo'}, {'name': 'bar'}],
+            [{'name': 'baz'}],
+            []
+        ]
+        filter_definition = {'$filter': {'table': 'packages'}, 'force': True}
+        records = self.handler.expand_filter_query(filter_definition, fetch_size=2)
+        # nothing is queried until records are consumed
+        self.handler.postgres.session.get_bind.return_value.connect.assert_not_called()
+
+        assert list(records) == [
+            {'name': 'foo', 'force': True},
+            {'name': 'bar', 'force': True},
+            {'name': 'baz', 'force': True}
+        ]
+        self.connection.execution_options.assert_called_once_with(stream_results=True,
+                                                                  max_row_buffer=2)
+        statement = self.connection.execution_options.return_value.execute.call_args[0][0]
+        # text() escapes '%' in LIKE patterns for psycopg2
+        assert isinstance(statement, TextClause)
+        assert statement.text == 'SELECT * FROM packages'
+        self.result.fetchmany.assert_called_with(2)
+        self.result.close.assert_called_once_with()
+        self.connection.close.assert_called_once_with()
+        # the shared session is not used for streaming
+        self.handler.postgres.session.connection.assert_not_called()
+        # the original definition is kept untouched
+        assert '$filter' in filter_definition
+
+    def test_closed_early(self):
+        """Test that the cursor is released if not all records are consumed."""
+        self.result.fetchmany.return_value = [{'name': 'foo'}, {'name': 'bar'}]
+        records = self.handler.expand_filter_query({'$filter': {'table': 'packages'}})
+        assert next(records) == {'name': 'foo'}
+        records.close()
+        self.result.close.assert_called_once_with()
+        self.connection.close.assert_called_once_with()
+
+    def test_error(self):
+        """Test that the dedicated connection is released on database errors."""
+        self.connection.execution_options.return_value.execute.side_effect = SQLAlchemyError
+        with pytest.raises(SQLAlchemyError):
+            list(self.handler.expand_filter_query({'$filter': {'table': 'packages'}}))
+        self.connection.close.assert_called_once_with()
+        self.handler.postgres.session.rollback.assert_not_called()
+
+    def test_like_pattern(self):
+        """Test that '%' in LIKE patterns is not taken for a psycopg2 placeholder."""
+        self.result.fetchmany.return_value = []
+        with mock.patch.object(BaseHandler, 'construct_select_query',
+                               return_value="SELECT * FROM packages WHERE name LIKE '%junit%'"):
+            list(self.handler.expand_filter_query({'$filter': {'table': 'packages'}}))
+
+        statement = self.connection.execution_options.return_value.execute.call_args[0][0]
+        assert "LIKE '%%junit%%'" in str(statement.compile(dialect=postgresql.dialect()))
+
+
+class TestSelectQueryCache(object):
+    """Tests for SelectQueryCache class."""
+
+    @mock.patch('f8a_jobs.handlers.base.select2sql', return_value='SELECT 1')
+    def test_cached(self, select2sql):
+        """Test that equal filter definitions are compiled once regardless of key order."""
+        cache = SelectQueryCache(size=10)
+        assert cache.get({'table': 'packages', 'select': ['id']}) == 'SELECT 1'
+        assert cache.get({'select': ['id'], 'table': 'packages'}) == 'SELECT 1'
+        select2sql.assert_called_once_with({'table': 'packages', 'select': ['id']})
+
+        cache.get({'table': 'versions'})
+        assert select2sql.call_count == 2
+
+        cache.clear()
+        cache.get({'table': 'packages', 'select': ['id']})
+        assert select2sql.call_count == 3
+
+    @mock.patch('f8a_jobs.handlers.base.select2sql', side_effect=lambda d: d['table'])
+    def test_lru(self, select2sql):
+        """Test that least recently used statements are evicted."""
+        cache = SelectQueryCache(size=2)
+        cache.get({'table': 'a'})
+        cache.get({'table': 'b'})
+        cache.get({'table': 'a'})
+        cache.get({'table': 'c'})
+        assert select2sql.call_count == 3
+
+        # 'b' was evicted, 'a' and 'c' are still cached
+        cache.get({'table': 'a'})
+        cache.get({'table': 'c'})
+        assert select2sql.call_count == 3
+        cache.get({'table': 'b'})
+        assert select2sql.call_count == 4
+
+    @mock.patch('f8a_jobs.handlers.base.select2sql', return_value='SELECT 1')
+    def test_disabled(self, select2sql):
+        """Test that statements are compiled on each call if the cache is disabled."""
+        cache = SelectQueryCache(size=0)
+        cache.get({'table': 'packages'})
+        cache.get({'table': 'packages'})
+        assert select2sql.call_count == 2
+
+
+class TestEcosystemBackendCache(object):
+    """Tests for EcosystemBackendCache class."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.cache = EcosystemBackendCache(ttl=60)
+        self.session = mock.Mock()
+
+    @mock.patch('f8a_jobs.handlers.base.Ecosystem.by_name')
+    def test_cached(self, by_name):
+        """Test that the backend is looked up in database once per ecosystem."""
+        by_name.return_value.backend.name = 'npm'
+        for _ in range(3):
+            assert self.cache.get(self.session, 'npm') == 'npm'
+        by_name.assert_called_once_with(self.session, 'npm')
+
+        self.cache.get(self.session, 'pypi')
+        assert by_name.call_count == 2
+
+    @mock.patch('f8a_jobs.handlers.base.monotonic')
+    @mock.patch('f8a_jobs.handlers.base.Ecosystem.by_name')
+    def test_ttl(self, by_name, monotonic):
+        """Test that cached backends expire."""
+        monotonic.return_value = 1000.0
+        self.cache.get(self.session, 'npm')
+        monotonic.return_value = 1059.0
+        self.cache.get(self.session, 'npm')
+        assert by_name.call_count == 1
+
+        monotonic.return_value = 1060.0
+        self.cache.get(self.session, 'npm')
+        assert by_name.call_count == 2
+
+    @mock.patch('f8a_jobs.handlers.base.Ecosystem.by_name')
+    def test_invalidate(self, by_name):
+        """Test explicit invalidation of cached backends."""
+        self.cache.get(self.session, 'npm')
+        self.cache.get(self.session, 'pypi')
+
+        self.cache.invalidate('npm')
+        self.cache.get(self.session, 'npm')
+        self.cache.get(self.session, 'pypi')
+        assert by_name.call_count == 3
+
+        self.cache.invalidate()
+        self.cache.get(self.session, 'pypi')
+        assert by_name.call_count == 4
+
+
+class TestRetryPolicy(object):
+    """Tests for RetryPolicy class."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.policy = RetryPolicy(max_attempts=3, base_delay=60, jitter=0.5,
+                                  retry_on=(requests.exceptions.ConnectionError,))
+
+    def test_should_retry(self):
+        """Test that only retryable errors are retried, up to max_attempts."""
+        exc = requests.exceptions.ConnectionError()
+        assert self.policy.should_retry(exc, 1)
+        assert self.policy.should_retry(exc, 2)
+        assert not self.policy.should_retry(exc, 3)
+        assert not self.policy.should_retry(ValueError(), 1)
+
+    @pytest.mark.parametrize(('attempt', 'jitter', 'expected'), [
+        (1, 0.0, 60),
+        (2, 0.0, 120),
+        (3, 0.0, 240),
+        (2, 0.5, 180),
+        (2, -0.5, 60),
+        (30, 0.0, RetryPolicy.MAX_DELAY)
+    ])
+    def test_get_delay(self, attempt, jitter, expected):
+        """Test exponential backoff with jitter."""
+        with mock.patch('f8a_jobs.handlers.base.random.uniform', return_value=jitter) as uniform:
+            assert self.policy.get_delay(attempt) == expected
+        uniform.assert_called_once_with(-0.5, 0.5)
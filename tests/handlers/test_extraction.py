@@ -0,0 +1,94 @@
+"""Tests for extraction of data from HTML pages."""
+
+import re
+
+import pytest
+
+from f8a_jobs.handlers.extraction import parse, BS4, LXML
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<html class="page">
+<body>
+  <!-- popular artifacts -->
+  <div class="commit-links-group BtnGroup">
+    <span>copy</span>
+  </div>
+  <a class="sha" href="/owner/repo/commit/0123abc">0123abc</a>
+  <a class="im-usage" href="/artifact/junit/junit/usages"><b>56,752</b> usages</a>
+  <a class="vbtn release" href="junit/4.12">4.12</a>
+  <a class="vbtn beta" href="junit/5.0-beta">5.0-beta</a>
+  <a class="t4" href="/tags/accumulo">accumulo</a>
+  <a href="/open-source/testing-frameworks">more...</a>
+  <table id="release_list">
+<tr>
+<td>1.0.0</td>
+<td>x</td>
+<td>y</td>
+<td>1,234</td>
+</tr>
+  </table>
+</body>
+</html>
+"""
+
+pytestmark = pytest.mark.parametrize('backend', [LXML, BS4])
+
+
+def test_find_all_by_tag_and_class(backend):
+    """Test lookup by tag name and any of classes or the whole class attribute."""
+    page = parse(PAGE, backend)
+    assert [a.get('href') for a in page.find_all('a', class_='vbtn')] == \
+        ['junit/4.12', 'junit/5.0-beta']
+    assert [a.text for a in page.find_all('a', class_='vbtn release')] == ['4.12']
+    assert [a.text for a in page.find_all('a', class_=re.compile('t[1-9]'))] == ['accumulo']
+    assert page.find_all('span', class_='vbtn') == []
+    # the root element is matched as well
+    assert page.find(class_='page').tag == 'html'
+
+
+def test_find_all_by_text_and_attributes(backend):
+    """Test lookup by text and attributes given as strings, regular expressions and callables."""
+    page = parse(PAGE, backend)
+    assert [a['href'] for a in page.find_all('a', text='more...')] == \
+        ['/open-source/testing-frameworks']
+    usages = page.find_all(href=lambda href: href.endswith('/usages'),
+                           text=lambda text: text.replace(',', '').isnumeric())
+    assert usages == []
+    usages = page.find_all(href=re.compile('/usages$'), text=re.compile('usages'))
+    assert [a.text for a in usages] == ['56,752 usages']
+    assert page.find(href=re.compile('^/tags/')).get('class') == 't4'
+    assert page.find('table', id='release_list').tag == 'table'
+    assert page.find('table', id='unknown') is None
+
+
+def test_text_of_rows(backend):
+    """Test text of elements keeps whitespace between nested elements."""
+    rows = parse(PAGE, backend).find('table', id='release_list').find_all('tr')
+    assert len(rows) == 1
+    assert rows[0].text.split('\n')[1] == '1.0.0'
+    assert rows[0].text.split('\n')[4] == '1,234'
+
+
+def test_attributes(backend):
+    """Test access to attributes."""
+    link = parse(PAGE, backend).find('a', class_='sha')
+    assert link.get('class') == 'sha'
+    assert link.get('title') is None
+    assert link.get('title', '') == ''
+    with pytest.raises(KeyError):
+        link['title']
+
+
+def test_find_next(backend):
+    """Test lookup of the first element following the start of an element."""
+    page = parse(PAGE, backend)
+    group = page.find_all(class_='commit-links-group BtnGroup')[0]
+    assert group.find_next('span').text == 'copy'
+    assert group.find_next('a').get('href') == '/owner/repo/commit/0123abc'
+    assert page.find('table').find_next('a') is None
+
+
+def test_empty_page(backend):
+    """Test parsing of empty pages."""
+    assert parse('', backend).find_all('a') == []
+    assert parse(' \n', backend).find('a') is None
@@ -1,7 +1,10 @@
 """Tests for GolangPopularAnalyses class."""
 
+from unittest import mock
+
 import pytest
 
+from f8a_jobs.handlers.base import BaseHandler, CountRange
 from f8a_jobs.handlers.golang_popular_analyses import GolangPopularAnalyses
 
 
@@ -14,3 +17,24 @@ class TestGolangPopularAnalyses(object):
             job_id = 1
             GolangPopularAnalyses(job_id)
             assert e is not None
+
+    @mock.patch.object(BaseHandler, '_init_celery')
+    @mock.patch('f8a_jobs.handlers.base.StoragePool')
+    def test_rate_limited(self, _storage_pool, _init_celery):
+        """Test that requests are made using rate limited http_get()."""
+        handler = GolangPopularAnalyses(None)
+        handler.count = CountRange(min=1, max=1)
+        handler.analyses_selinon_flow = mock.Mock()
+        api_response = mock.Mock(status_code=200)
+        api_response.json.return_value = ['github.com/foo/bar']
+        commits_response = mock.Mock(status_code=404)
+        with mock.patch.object(handler, 'http_get',
+                               side_effect=[api_response, commits_response]) as http_get:
+            handler._packages()
+
+        assert http_get.call_args_list == [
+            mock.call('http://go-search.org/api?action=packages'),
+            mock.call('https://github.com/foo/bar/commits/master', rate_limiter='github.com')
+        ]
+        assert handler.rate_limiter == 'go-search.org'
+        handler.analyses_selinon_flow.assert_not_called()
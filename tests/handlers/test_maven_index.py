@@ -0,0 +1,168 @@
+"""Tests for synchronization of the maven index with S3."""
+
+import io
+import os
+from unittest import mock
+
+import botocore.exceptions
+import pytest
+
+from f8a_jobs.handlers.maven_index import MavenIndexSync
+
+
+class FakeBucket(object):
+    """In-memory stand-in of boto3 Bucket resource."""
+
+    def __init__(self):
+        """Construct an empty bucket."""
+        self.objects = {}
+        self.downloads = []
+        self.uploads = []
+
+    def Object(self, key):  # noqa: N802
+        """Get object of the given key."""
+        obj = mock.Mock()
+        if key in self.objects:
+            obj.get.return_value = {'Body': io.BytesIO(self.objects[key])}
+        else:
+            obj.get.side_effect = botocore.exceptions.ClientError(
+                {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        obj.put.side_effect = lambda Body: self.objects.__setitem__(key, Body)
+        return obj
+
+    def download_file(self, key, path):
+        """Download the object to the file."""
+        self.downloads.append(key)
+        with open(path, 'wb') as f:
+            f.write(self.objects[key])
+
+    def upload_file(self, path, key):
+        """Upload the file as the object."""
+        self.uploads.append(key)
+        with open(path, 'rb') as f:
+            self.objects[key] = f.read()
+
+    def delete_objects(self, Delete):  # noqa: N803
+        """Delete the given objects."""
+        for obj in Delete['Objects']:
+            del self.objects[obj['Key']]
+
+    def segments(self):
+        """Get number of stored segments."""
+        return len([key for key in self.objects if '/segments/' in key])
+
+
+def _write(directory, files):
+    os.makedirs(os.path.join(directory, 'central-index'), exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(directory, 'central-index', name), 'w') as f:
+            f.write(content)
+
+
+def _read(directory):
+    index_dir = os.path.join(directory, 'central-index')
+    result = {}
+    for name in os.listdir(index_dir):
+        with open(os.path.join(index_dir, name)) as f:
+            result[name] = f.read()
+    return result
+
+
+class TestMavenIndexSync(object):
+    """Tests for the class MavenIndexSync."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.bucket = FakeBucket()
+        self.s3 = mock.Mock(bucket_name='bayesian-maven-index')
+        self.s3._s3.Bucket.return_value = self.bucket
+
+    def _sync(self, directory):
+        return MavenIndexSync(self.s3, str(directory))
+
+    def test_push_and_pull(self, tmpdir):
+        """Test that the index is transferred to a new machine."""
+        first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+        _write(str(first), {'_0.cfs': 'segment 0', 'segments_1': 'gen 1', 'timestamp': ''})
+        assert self._sync(first).push()
+        assert self.bucket.segments() == 3
+
+        sync = self._sync(second)
+        sync.pull()
+        assert _read(str(second)) == _read(str(first))
+        assert sync.bytes_downloaded == len('segment 0') + len('gen 1')
+        # mtime of files is preserved, the index checker relies on it
+        assert os.stat(str(second.join('central-index', 'timestamp'))).st_mtime_ns == \
+            os.stat(str(first.join('central-index', 'timestamp'))).st_mtime_ns
+        self.s3.retrieve_index_if_exists.assert_not_called()
+
+    def test_only_changes_transferred(self, tmpdir):
+        """Test that only files not present on the other side are transferred."""
+        first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+        _write(str(first), {'_0.cfs': 'segment 0', 'segments_1': 'gen 1'})
+        self._sync(first).push()
+        self._sync(second).pull()
+
+        # the index was updated on the second machine - a segment added, one merged away
+        os.unlink(str(second.join('central-index', 'segments_1')))
+        _write(str(second), {'_1.cfs': 'segment 1', 'segments_2': 'gen 2'})
+        self.bucket.uploads.clear()
+        sync = self._sync(second)
+        assert sync.push()
+        assert len(self.bucket.uploads) == 2
+        assert sync.bytes_uploaded == len('segment 1') + len('gen 2')
+        # the merged segment is not referenced anymore
+        assert self.bucket.segments() == 3
+
+        self.bucket.downloads.clear()
+        self._sync(first).pull()
+        assert len(self.bucket.downloads) == 2
+        assert _read(str(first)) == {'_0.cfs': 'segment 0', '_1.cfs': 'segment 1',
+                                     'segments_2': 'gen 2'}
+
+    def test_nothing_changed(self, tmpdir):
+        """Test that nothing is transferred if the index did not change."""
+        _write(str(tmpdir), {'_0.cfs': 'segment 0', 'segments_1': 'gen 1'})
+        assert self._sync(tmpdir).push()
+        self.bucket.uploads.clear()
+
+        sync = self._sync(tmpdir)
+        sync.pull()
+        assert not sync.push()
+        assert self.bucket.downloads == []
+        assert self.bucket.uploads == []
+
+    def test_unmodified_files_not_hashed(self, tmpdir):
+        """Test that hashes of files not modified since the last synchronization are reused."""
+        _write(str(tmpdir), {'_0.cfs': 'segment 0'})
+        self._sync(tmpdir).push()
+        _write(str(tmpdir), {'segments_1': 'gen 1'})
+
+        with mock.patch('f8a_jobs.handlers.maven_index._sha256',
+                        return_value='0' * 64) as sha256:
+            self._sync(tmpdir).push()
+        sha256.assert_called_once_with(str(tmpdir.join('central-index', 'segments_1')))
+
+    def test_archive_fallback(self, tmpdir):
+        """Test that the index archive stored by previous versions is used if there is no other."""
+        self._sync(tmpdir).pull()
+        self.s3.retrieve_index_if_exists.assert_called_once_with(str(tmpdir))
+
+    def test_discard(self, tmpdir):
+        """Test that the discarded index is pulled again in full."""
+        _write(str(tmpdir), {'_0.cfs': 'segment 0', 'segments_1': 'gen 1'})
+        self._sync(tmpdir).push()
+        self._sync(tmpdir).discard()
+        assert not tmpdir.join('central-index').exists()
+
+        self._sync(tmpdir).pull()
+        assert _read(str(tmpdir)) == {'_0.cfs': 'segment 0', 'segments_1': 'gen 1'}
+        assert len(self.bucket.downloads) == 2
+
+    def test_s3_errors_propagated(self, tmpdir):
+        """Test that errors other than a missing manifest are not hidden."""
+        self.bucket.Object = mock.Mock()
+        self.bucket.Object.return_value.get.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+        with pytest.raises(botocore.exceptions.ClientError):
+            self._sync(tmpdir).pull()
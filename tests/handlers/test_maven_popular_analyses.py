@@ -1,8 +1,21 @@
 """Tests for MavenPopularAnalyses class."""
 
+import json
+import os.path
+from unittest import mock
+
 import pytest
 
-from f8a_jobs.handlers.maven_popular_analyses import MavenPopularAnalyses
+from f8a_jobs.handlers.base import BaseHandler, CountRange
+from f8a_jobs.handlers.maven_popular_analyses import AnalysedPackagesIndex, MavenPopularAnalyses
+
+GROUPS = ['org.apache.commons', 'com.google.guava', 'junit', 'org.slf4j',
+          'com.fasterxml.jackson.core', 'org.mockito', 'org.springframework', 'log4j',
+          'commons-io', 'org.projectlombok']
+
+
+def _project(idx):
+    return '{}:artifact-{}'.format(GROUPS[idx % len(GROUPS)], idx)
 
 
 class TestMavenPopularAnalyses(object):
@@ -14,3 +27,192 @@ class TestMavenPopularAnalyses(object):
             job_id = 1
             MavenPopularAnalyses(job_id)
             assert e is not None
+
+
+class TestMavenPopularProjects(object):
+    """Tests for scraping of popular projects from pages in the mvnrepository.com format."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        data = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'mvnrepository_pages.json')
+        with open(data) as rd:
+            self.pages = json.load(rd)
+
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool')
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        self.handler = MavenPopularAnalyses(None)
+        self.handler.http_get = mock.Mock(side_effect=self._get)
+        self.handler.analyses_selinon_flow = mock.Mock()
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def _get(self, url, **kwargs):
+        path = url[len(MavenPopularAnalyses._BASE_URL):]
+        return mock.Mock(text=self.pages.get(path, '<html><body></body></html>'))
+
+    def _fetched_artifacts(self):
+        return [c[0][0] for c in self.handler.http_get.call_args_list if '/artifact/' in c[0][0]]
+
+    def test_count_window(self):
+        """Test that only projects in the count window are scheduled, in order of popularity."""
+        self.handler.count = CountRange(min=3, max=5)
+        self.handler.nversions = 1
+        self.handler._projects_from('popular')
+
+        assert self.handler.analyses_selinon_flow.call_args_list == [
+            mock.call(_project(idx), '3.2.{}'.format(idx)) for idx in (2, 3, 4)
+        ]
+        assert self.handler.nprojects == 5
+        # pages of projects that would not be scheduled are not fetched
+        assert len(self._fetched_artifacts()) == 5
+
+    def test_multiple_pages(self):
+        """Test that duplicates and projects without versions are skipped across pages."""
+        self.handler.count = CountRange(min=1, max=15)
+        self.handler.nversions = 2
+        self.handler._projects_from('/popular')
+
+        expected = [idx for idx in range(16) if idx != 12]
+        assert list(self.handler.projects.keys()) == [_project(idx) for idx in expected]
+        assert self.handler.projects[_project(0)] == ['3.1.0', '3.2.0']
+        # no usage statistics, versions ordered by version buttons
+        assert self.handler.projects[_project(7)] == ['2.1.0', '2.0.1']
+        assert self.handler.analyses_selinon_flow.call_count == 30
+        # the project listed on both pages is fetched once
+        assert len(self._fetched_artifacts()) == 16
+
+    def test_not_enough_projects(self):
+        """Test that all listing pages are scraped if there are not enough projects."""
+        self.handler.count = CountRange(min=1, max=100)
+        self.handler.nversions = 1
+        self.handler._projects_from('/popular')
+
+        assert self.handler.nprojects == 29
+        listing_pages = [c[0][0] for c in self.handler.http_get.call_args_list
+                         if '/popular' in c[0][0]]
+        assert len(listing_pages) == MavenPopularAnalyses._MAX_PAGES
+
+
+def _bucket(*pages):
+    """Construct a mock of the bucket with results of analyses listed in the given pages."""
+    bucket = mock.Mock()
+    bucket.name = 'bayesian-core-data'
+    bucket.meta.client.get_paginator.return_value.paginate.return_value = [
+        {'CommonPrefixes': [{'Prefix': 'maven/{}/'.format(name)} for name in page]}
+        for page in pages
+    ]
+    return bucket
+
+
+class TestAnalysedPackagesIndex(object):
+    """Tests for the class AnalysedPackagesIndex."""
+
+    def test_from_bucket(self):
+        """Test that the index is built from a single paginated listing grouped by package."""
+        bucket = _bucket(['junit:junit', 'log4j:log4j'], ['org.slf4j:slf4j-api'], [])
+        index = AnalysedPackagesIndex.from_bucket(bucket, 'maven')
+
+        bucket.meta.client.get_paginator.assert_called_once_with('list_objects_v2')
+        bucket.meta.client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bayesian-core-data', Prefix='maven/', Delimiter='/')
+        assert len(index) == 3
+        assert 'junit:junit' in index
+        assert 'org.slf4j:slf4j-api' in index
+        assert 'junit:junit-dep' not in index
+        assert 'junit' not in index
+        assert 'zzz:zzz' not in index
+
+    def test_empty(self):
+        """Test the index of an ecosystem without analyses."""
+        index = AnalysedPackagesIndex.from_bucket(_bucket([]), 'maven')
+        assert len(index) == 0
+        assert 'junit:junit' not in index
+
+    def test_for_packages_listing(self):
+        """Test that the bucket is listed once there are many packages to look up."""
+        bucket = _bucket(['junit:junit'])
+        with mock.patch.object(AnalysedPackagesIndex, 'EXPECTED_LISTING_PAGES', 2):
+            index = AnalysedPackagesIndex.for_packages(bucket, 'maven',
+                                                       ['junit:junit', 'log4j:log4j'])
+        assert 'junit:junit' in index
+        assert 'log4j:log4j' not in index
+        assert not bucket.meta.client.list_objects_v2.called
+
+    def test_for_packages_few(self):
+        """Test that a few packages are looked up one by one instead of listing the bucket."""
+        bucket = _bucket(['junit:junit'])
+        bucket.meta.client.list_objects_v2.side_effect = \
+            lambda Prefix, **kwargs: {'KeyCount': int(Prefix == 'maven/junit:junit/')}
+        index = AnalysedPackagesIndex.for_packages(bucket, 'maven',
+                                                   ['junit:junit', 'log4j:log4j', 'junit:junit'])
+        assert 'junit:junit' in index
+        assert 'log4j:log4j' not in index
+        assert bucket.meta.client.list_objects_v2.call_count == 2
+        bucket.meta.client.list_objects_v2.assert_any_call(
+            Bucket='bayesian-core-data', Prefix='maven/log4j:log4j/', MaxKeys=1)
+        assert not bucket.meta.client.get_paginator.called
+
+    def test_for_packages_none(self):
+        """Test that nothing is requested if there are no packages to look up."""
+        bucket = _bucket(['junit:junit'])
+        assert len(AnalysedPackagesIndex.for_packages(bucket, 'maven', [])) == 0
+        assert not bucket.meta.client.list_objects_v2.called
+        assert not bucket.meta.client.get_paginator.called
+
+
+class TestMavenIndexChecker(object):
+    """Tests for scheduling of analyses of releases reported by maven-index-checker."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.patches = [
+            mock.patch.object(BaseHandler, '_init_celery'),
+            mock.patch('f8a_jobs.handlers.base.StoragePool')
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        self.handler = MavenPopularAnalyses(None)
+        self.handler.analyses_selinon_flow = mock.Mock()
+        self.handler.ecosystem = 'maven'
+        self.handler.count = CountRange(min=1, max=3)
+        self.handler.nversions = 1
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_analysed_skipped(self, tmpdir, monkeypatch):
+        """Test that packages with an analysed version are looked up in a single listing."""
+        tmpdir.mkdir('central-index').join('timestamp').write('')
+        monkeypatch.setenv('MAVEN_INDEX_CHECKER_DATA_PATH', str(tmpdir))
+        releases = [{'groupId': 'junit', 'artifactId': 'junit', 'version': '4.12'},
+                    {'groupId': 'log4j', 'artifactId': 'log4j', 'version': '1.2.17'},
+                    {'groupId': 'org.slf4j', 'artifactId': 'slf4j-api', 'version': '1.7.30'}]
+        bucket = _bucket(['junit:junit'], ['org.slf4j:slf4j-api'])
+        storage_pool = mock.Mock()
+        storage_pool.get_connected_storage.return_value._s3.Bucket.return_value = bucket
+
+        module = 'f8a_jobs.handlers.maven_popular_analyses'
+        with mock.patch(module + '.StoragePool', storage_pool), \
+                mock.patch(module + '.TimedCommand.get_command_output', return_value=releases), \
+                mock.patch(module + '.MavenIndexSync'), \
+                mock.patch(module + '.cwd'), mock.patch(module + '.rmtree'), \
+                mock.patch(module + '.tempfile.mkdtemp', return_value=str(tmpdir)), \
+                mock.patch.object(AnalysedPackagesIndex, 'EXPECTED_LISTING_PAGES', 3):
+            self.handler._use_maven_index_checker()
+
+        self.handler.analyses_selinon_flow.assert_called_once_with('log4j:log4j', '1.2.17')
+        bucket.meta.client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='bayesian-core-data', Prefix='maven/', Delimiter='/')
+        assert not bucket.objects.filter.called
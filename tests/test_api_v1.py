@@ -1,7 +1,8 @@
 """Tests for the module 'api_v1'."""
 
-# TODO enable when new test(s) will be added
-# from f8a_jobs.api_v1 import *
+from unittest import mock
+
+from f8a_jobs.api_v1 import get_metrics
 
 
 class TestApiV1Functions(object):
@@ -14,3 +15,28 @@ class TestApiV1Functions(object):
     def teardown_method(self, method):
         """Teardown any state that was previously setup with a setup_method call."""
         assert method
+
+    @mock.patch('f8a_jobs.api_v1.Scheduler.is_leader', return_value=True)
+    def test_get_metrics_leader(self, is_leader):
+        """Test that the leader exposes all metrics."""
+        text, status, _ = get_metrics()
+        assert status == 200
+        assert 'f8a_jobs_leader{leader="true"} 1.0' in text
+        assert '# TYPE f8a_jobs_job_duration_seconds histogram' in text
+
+    @mock.patch('f8a_jobs.api_v1.Scheduler.is_leader', return_value=False)
+    def test_get_metrics_follower(self, is_leader):
+        """Test that a follower exposes only the fact it is not the leader."""
+        text, status, _ = get_metrics()
+        assert status == 200
+        assert text == ('# HELP f8a_jobs_leader Whether the process serving the request is the '
+                        'leader executing jobs (1) or not (0)\n'
+                        '# TYPE f8a_jobs_leader gauge\n'
+                        'f8a_jobs_leader{leader="false"} 0.0\n')
+
+    @mock.patch('f8a_jobs.api_v1.Scheduler.is_leader', return_value=None)
+    def test_get_metrics_no_leader_election(self, is_leader):
+        """Test that all metrics are exposed if leader election is not turned on."""
+        text, _, _ = get_metrics()
+        assert 'f8a_jobs_leader{leader="true"} 1.0' in text
+        assert '# TYPE f8a_jobs_job_duration_seconds histogram' in text
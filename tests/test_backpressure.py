@@ -0,0 +1,129 @@
+"""Tests for the module 'backpressure'."""
+
+from unittest import mock
+
+import pytest
+
+from f8a_jobs.backpressure import (BackpressureController, QueueDepthMonitor,
+                                   parse_watermarks)
+
+
+def test_parse_watermarks():
+    """Test parsing of watermarks configuration."""
+    assert parse_watermarks('bayesianFlow:1000:100, *:5000:1000,') == {
+        'bayesianFlow': (1000, 100),
+        '*': (5000, 1000)
+    }
+    assert parse_watermarks('') == {}
+
+
+@pytest.mark.parametrize('watermarks', ['bayesianFlow:1000', 'bayesianFlow:many:100',
+                                        'bayesianFlow:100:1000'])
+def test_parse_watermarks_invalid(watermarks):
+    """Test that invalid watermarks are reported."""
+    with pytest.raises(ValueError):
+        parse_watermarks(watermarks)
+
+
+class TestQueueDepthMonitor(object):
+    """Tests for the class QueueDepthMonitor."""
+
+    @mock.patch('f8a_jobs.backpressure.configuration.DEPLOYMENT_PREFIX', 'test')
+    @mock.patch('f8a_jobs.backpressure.monotonic')
+    @mock.patch('f8a_jobs.backpressure.construct_queue_attributes')
+    def test_sampled_periodically(self, construct_queue_attributes, monotonic):
+        """Test that queue depths are sampled at most once per sample interval."""
+        construct_queue_attributes.return_value = {
+            'test_ingestion_bayesianFlow_v0': {'ApproximateNumberOfMessages': 10}
+        }
+        monitor = QueueDepthMonitor(sample_interval=60)
+        monotonic.return_value = 1000.0
+        assert monitor.get_depth('test_ingestion_bayesianFlow_v0') == 10
+        # queues can be stated without the deployment prefix
+        monotonic.return_value = 1059.0
+        assert monitor.get_depth('ingestion_bayesianFlow_v0') == 10
+        assert monitor.get_depth('unknown_queue') is None
+        assert construct_queue_attributes.call_count == 1
+
+        monotonic.return_value = 1060.0
+        monitor.get_depth('ingestion_bayesianFlow_v0')
+        assert construct_queue_attributes.call_count == 2
+
+    @mock.patch('f8a_jobs.backpressure.construct_queue_attributes', side_effect=ValueError)
+    def test_sampling_failed(self, construct_queue_attributes):
+        """Test that queues which cannot be inspected are reported as of unknown depth."""
+        assert QueueDepthMonitor(sample_interval=60).get_depth('queue') is None
+
+
+class TestBackpressureController(object):
+    """Tests for the class BackpressureController."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.monitor = mock.Mock(sample_interval=60)
+        self.sleep = mock.Mock()
+        self.patches = [
+            mock.patch('f8a_jobs.backpressure.Config.dispatcher_queues',
+                       {'bayesianFlow': 'bayesian_queue', 'otherFlow': 'other_queue'},
+                       create=True),
+            mock.patch('f8a_jobs.backpressure.sleep', self.sleep)
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.controller = BackpressureController(self.monitor, {'bayesianFlow': (100, 10)},
+                                                 max_wait=3600)
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_below_high_water_mark(self):
+        """Test that flows are dispatched without waiting while the queue is not backed up."""
+        self.monitor.get_depth.return_value = 99
+        assert self.controller.wait('bayesianFlow') == 0.0
+        assert not self.controller.is_paused('bayesianFlow')
+        self.monitor.get_depth.assert_called_once_with('bayesian_queue')
+        self.sleep.assert_not_called()
+
+    def test_paused_until_low_water_mark(self):
+        """Test that dispatching is paused until the queue drains below the low-water mark."""
+        self.monitor.get_depth.side_effect = [100, 50, 11, 10]
+        self.controller.wait('bayesianFlow')
+        assert self.sleep.call_count == 3
+        assert not self.controller.is_paused('bayesianFlow')
+
+    def test_hysteresis(self):
+        """Test that a flow stays paused between the watermarks once paused."""
+        self.monitor.get_depth.side_effect = [50, 150, 50, 10]
+        self.controller.wait('bayesianFlow')
+        self.sleep.assert_not_called()
+
+        self.controller.wait('bayesianFlow')
+        assert self.sleep.call_count == 2
+
+    @mock.patch('f8a_jobs.backpressure.monotonic')
+    def test_max_wait(self, monotonic):
+        """Test that flows are dispatched once the maximum wait time elapses."""
+        monotonic.side_effect = [0.0, 3570.0, 3600.0]
+        self.monitor.get_depth.return_value = 1000
+        assert self.controller.wait('bayesianFlow') == 3600.0
+        # the last sleep is shortened so the maximum wait time is not exceeded
+        self.sleep.assert_called_once_with(30.0)
+
+    def test_not_configured(self):
+        """Test that flows without watermarks and unknown queue depths are not paused."""
+        self.monitor.get_depth.return_value = 1000
+        assert self.controller.wait('otherFlow') == 0.0
+        self.monitor.get_depth.assert_not_called()
+
+        self.monitor.get_depth.return_value = None
+        assert self.controller.wait('bayesianFlow') == 0.0
+
+    def test_any_flow(self):
+        """Test that watermarks of '*' apply to flows not stated explicitly."""
+        controller = BackpressureController(self.monitor, {'*': (100, 10)}, max_wait=3600)
+        self.monitor.get_depth.side_effect = [100, 10]
+        controller.wait('otherFlow')
+        self.monitor.get_depth.assert_called_with('other_queue')
+        assert self.sleep.call_count == 1
@@ -0,0 +1,136 @@
+"""Tests for the module 'executors'."""
+
+import os
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from threading import RLock
+from unittest import mock
+
+import pytest
+from apscheduler.job import Job
+from apscheduler.triggers.date import DateTrigger
+
+from f8a_jobs.executors import (parse_executor_pools, LimitedThreadPoolExecutor,
+                                PreforkedProcessPoolExecutor)
+from f8a_jobs.throttling import ConcurrencyLimiter
+
+
+class TestExecutors(object):
+    """Tests for the module 'executors'."""
+
+    def test_parse_executor_pools(self):
+        """Test parsing of executor pools configuration."""
+        pools = parse_executor_pools('default:thread:20, processpool:process:5,maven:thread:1')
+
+        assert pools == {
+            'default': {
+                'class': 'f8a_jobs.executors:LimitedThreadPoolExecutor',
+                'max_workers': '20'
+            },
+            'processpool': {
+                'class': 'f8a_jobs.executors:PreforkedProcessPoolExecutor',
+                'max_workers': '5'
+            },
+            'maven': {
+                'class': 'f8a_jobs.executors:LimitedThreadPoolExecutor',
+                'max_workers': '1'
+            }
+        }
+
+    @pytest.mark.parametrize('pools', [
+        'processpool:process:5',
+        'default:thread',
+        'default:thread:many',
+        'default:greenlet:20',
+        'default:thread:0',
+    ])
+    def test_parse_executor_pools_error(self, pools):
+        """Test that invalid configuration is reported."""
+        with pytest.raises(ValueError):
+            parse_executor_pools(pools)
+
+
+class TestConcurrencyLimitedExecutor(object):
+    """Tests for enforcing concurrency limits of handlers by executors."""
+
+    # stands for job_execute(), any callable accepting handler name and job id
+    JOB_FUNC = 'os.path:join'
+    RUN_TIME = datetime(2020, 10, 16, tzinfo=timezone.utc)
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.limiter = ConcurrencyLimiter()
+        self.limiter.set_limit('Limited', 1)
+        self.scheduler = mock.Mock()
+        self.scheduler._create_lock.side_effect = RLock
+        self.executor = LimitedThreadPoolExecutor(max_workers=5)
+        self.executor.limiter = self.limiter
+        self.executor.JOB_FUNC = self.JOB_FUNC
+        self.executor.start(self.scheduler, 'default')
+        self.futures = []
+        self.executor._pool = mock.Mock()
+        self.executor._pool.submit.side_effect = self._submit
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        self.executor.shutdown()
+
+    def _submit(self, *args):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+    def _job(self, job_id, handler_name):
+        return Job(self.scheduler, id=job_id, func=self.JOB_FUNC, args=(handler_name, job_id),
+                   kwargs={}, name=job_id, trigger=DateTrigger(self.RUN_TIME, timezone='UTC'),
+                   executor='default', misfire_grace_time=1, coalesce=True, max_instances=1,
+                   next_run_time=self.RUN_TIME)
+
+    def test_limited(self):
+        """Test that jobs over the limit wait without occupying a worker."""
+        run_times = [self.RUN_TIME]
+        self.executor.submit_job(self._job('job-1', 'Limited'), run_times)
+        self.executor.submit_job(self._job('job-2', 'Limited'), run_times)
+        self.executor.submit_job(self._job('job-3', 'Unlimited'), run_times)
+        assert self.executor._pool.submit.call_count == 2
+        assert self.limiter.waiting('Limited') == 1
+
+        # the waiting run is not considered as missed once submitted
+        self.futures[0].set_result([])
+        assert self.executor._pool.submit.call_count == 3
+        deferred = self.executor._pool.submit.call_args[0][1]
+        assert deferred.id == 'job-2'
+        assert deferred.misfire_grace_time is None
+
+        # slot of a run which worker died is released too
+        self.futures[2].set_exception(RuntimeError('worker died'))
+        self.executor.submit_job(self._job('job-4', 'Limited'), run_times)
+        assert self.executor._pool.submit.call_count == 4
+        assert self.executor._instances == {'job-3': 1, 'job-4': 1}
+
+
+def _worker_state():
+    """Get connection state of the process pool worker running this function."""
+    from f8a_jobs import models
+    from f8a_jobs.handlers.base import HANDLER_CONTEXT
+    return os.getpid(), models._pooled_engine, HANDLER_CONTEXT._pid
+
+
+class TestPreforkedProcessPoolExecutor(object):
+    """Tests for the executor forking worker processes in advance."""
+
+    def test_worker_connections_not_shared(self):
+        """Test that workers do not use connections inherited from the parent process."""
+        scheduler = mock.Mock()
+        scheduler._create_lock.side_effect = RLock
+        executor = PreforkedProcessPoolExecutor(max_workers=2)
+        with mock.patch('f8a_jobs.models._pooled_engine', 'parent-engine'), \
+                mock.patch('f8a_jobs.models._pooled_engine_pid', os.getpid()):
+            executor.start(scheduler, 'processpool')
+            try:
+                pid, engine, handler_context_pid = executor._pool.submit(_worker_state).result()
+            finally:
+                executor.shutdown()
+
+        assert pid != os.getpid()
+        assert engine is None
+        assert handler_context_pid == pid
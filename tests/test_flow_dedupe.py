@@ -0,0 +1,161 @@
+"""Tests for the module 'flow_dedupe'."""
+
+from unittest import mock
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from f8a_jobs.flow_dedupe import FlowDeduplicator
+
+EPV = {'ecosystem': 'npm', 'name': 'serve-static', 'version': '1.7.1'}
+
+
+class TestFlowDeduplicator(object):
+    """Tests for the class FlowDeduplicator."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.deduplicator = FlowDeduplicator(ttl=60, max_size=100)
+
+    def test_duplicate(self):
+        """Test that a flow dispatched recently is reported as a duplicate."""
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV, job_id='foo')) == \
+            FlowDeduplicator.HIT
+        # different flows and arguments are distinguished
+        assert self.deduplicator.lookup('bayesianPackageFlow', dict(EPV)) == \
+            FlowDeduplicator.MISS
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV, recursive_limit=1)) == \
+            FlowDeduplicator.MISS
+
+    @pytest.mark.parametrize('force', [{'force': True}, {'force_graph_sync': True}])
+    def test_forced(self, force):
+        """Test that forced flows are always dispatched."""
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        for _ in range(2):
+            assert self.deduplicator.lookup('bayesianFlow', dict(EPV, **force)) is None
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV, force=False)) == \
+            FlowDeduplicator.HIT
+
+    def test_lookup_many(self):
+        """Test that duplicates within the looked up flows are detected."""
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        other = dict(EPV, version='1.7.2')
+        assert self.deduplicator.lookup_many([
+            ('bayesianFlow', dict(EPV)),
+            ('bayesianFlow', other),
+            ('bayesianFlow', dict(other, job_id='foo')),
+            ('bayesianFlow', dict(other, force=True)),
+            ('bayesianFlow', None)
+        ]) == [FlowDeduplicator.HIT, FlowDeduplicator.MISS, FlowDeduplicator.HIT, None, None]
+
+    def test_equivalent_flows(self):
+        """Test that flows running the same analyses are deduplicated as one flow."""
+        assert self.deduplicator.lookup('bayesianApiFlow', dict(EPV)) == FlowDeduplicator.MISS
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.HIT
+
+    @pytest.mark.parametrize('node_args', [
+        None,
+        {'ecosystem': 'npm', 'name': 'serve-static'}
+    ])
+    def test_not_deduplicated(self, node_args):
+        """Test that flows not bound to a package version are not checked."""
+        assert self.deduplicator.lookup('bayesianFlow', node_args) is None
+        assert self.deduplicator.lookup('bayesianFlow', node_args) is None
+
+    def test_disabled(self):
+        """Test that zero ttl disables deduplication."""
+        deduplicator = FlowDeduplicator(ttl=0, max_size=100)
+        assert deduplicator.lookup('bayesianFlow', dict(EPV)) is None
+        assert deduplicator.lookup('bayesianFlow', dict(EPV)) is None
+
+    @mock.patch('f8a_jobs.flow_dedupe.monotonic')
+    def test_ttl(self, monotonic):
+        """Test that remembered flows expire."""
+        monotonic.return_value = 1000.0
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        monotonic.return_value = 1059.0
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.HIT
+        monotonic.return_value = 1060.0
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        assert len(self.deduplicator) == 1
+
+    def test_max_size(self):
+        """Test that the oldest flows are forgotten once the maximum size is reached."""
+        deduplicator = FlowDeduplicator(ttl=60, max_size=2)
+        for version in ('1', '2', '3'):
+            deduplicator.lookup('bayesianFlow', dict(EPV, version=version))
+
+        assert len(deduplicator) == 2
+        assert deduplicator.lookup('bayesianFlow', dict(EPV, version='3')) == \
+            FlowDeduplicator.HIT
+        assert deduplicator.lookup('bayesianFlow', dict(EPV, version='1')) == \
+            FlowDeduplicator.MISS
+
+    def test_forget(self):
+        """Test that forgotten flows can be dispatched again."""
+        self.deduplicator.lookup('bayesianFlow', dict(EPV))
+        self.deduplicator.forget('bayesianFlow', dict(EPV))
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+
+        self.deduplicator.clear()
+        assert len(self.deduplicator) == 0
+
+
+class TestSharedFlowDeduplicator(object):
+    """Tests for the class FlowDeduplicator sharing dispatched flows through the database."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.session = mock.Mock()
+        self.deduplicator = FlowDeduplicator(ttl=60, max_size=100,
+                                             session_factory=lambda: self.session)
+
+    @mock.patch('f8a_jobs.flow_dedupe.FlowDispatch')
+    def test_dispatched_by_other_process(self, flow_dispatch):
+        """Test that flows claimed by other processes are reported as duplicates."""
+        flow_dispatch.claim.return_value = set()
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.HIT
+        keys = list(flow_dispatch.claim.call_args[0][0])
+        assert len(keys) == 1 and len(keys[0]) == 64
+        assert flow_dispatch.claim.call_args[0][1:] == (60,)
+        assert flow_dispatch.claim.call_args[1] == {'session': self.session}
+        self.session.close.assert_called_once_with()
+
+    @mock.patch('f8a_jobs.flow_dedupe.FlowDispatch')
+    def test_claimed(self, flow_dispatch):
+        """Test that flows claimed by this process are not looked up again."""
+        flow_dispatch.claim.side_effect = lambda keys, ttl, session: set(keys)
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.HIT
+        assert flow_dispatch.claim.call_count == 1
+
+        self.deduplicator.forget('bayesianFlow', dict(EPV))
+        flow_dispatch.release.assert_called_once_with(mock.ANY, session=self.session)
+        assert len(flow_dispatch.release.call_args[0][0]) == 1
+        assert len(self.deduplicator) == 0
+
+    @mock.patch('f8a_jobs.flow_dedupe.FlowDispatch')
+    def test_claimed_in_bulk(self, flow_dispatch):
+        """Test that flows are claimed using a single query, only claimed flows are dispatched."""
+        claimed = []
+        flow_dispatch.claim.side_effect = \
+            lambda keys, ttl, session: claimed.append(list(keys)) or {claimed[0][1]}
+        flows = [('bayesianFlow', dict(EPV, version=str(version))) for version in range(3)]
+        assert self.deduplicator.lookup_many(flows) == \
+            [FlowDeduplicator.HIT, FlowDeduplicator.MISS, FlowDeduplicator.HIT]
+        assert len(claimed) == 1
+        assert len(claimed[0]) == 3
+
+    @mock.patch('f8a_jobs.flow_dedupe.FlowDispatch')
+    def test_forced_not_claimed(self, flow_dispatch):
+        """Test that forced flows are not looked up in the database."""
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV, force=True)) is None
+        flow_dispatch.claim.assert_not_called()
+
+    @mock.patch('f8a_jobs.flow_dedupe.FlowDispatch')
+    def test_database_error(self, flow_dispatch):
+        """Test that flows are dispatched if the database is not available."""
+        flow_dispatch.claim.side_effect = OperationalError('INSERT', {}, Exception('down'))
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.MISS
+        assert self.deduplicator.lookup('bayesianFlow', dict(EPV)) == FlowDeduplicator.HIT
@@ -0,0 +1,115 @@
+"""Tests for the module 'flow_dispatch'."""
+
+from unittest import mock
+
+import pytest
+from selinon import UnknownFlowError
+
+from f8a_jobs.flow_dispatch import FlowDispatchBatch
+
+
+class TestFlowDispatchBatch(object):
+    """Tests for the class FlowDispatchBatch."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.dispatcher = mock.Mock()
+        self.dispatcher.apply_async.side_effect = lambda **kwargs: mock.Mock(id='dispatcher-id')
+        self.producer = self.dispatcher.app.producer_pool.acquire.return_value
+        self.on_chunk = mock.Mock()
+        self.patches = [
+            mock.patch('f8a_jobs.flow_dispatch.Config.dispatcher_queues',
+                       {'bayesianFlow': 'bayesian_queue'}, create=True),
+            mock.patch('f8a_jobs.flow_dispatch.Dispatcher', return_value=self.dispatcher),
+            mock.patch('f8a_jobs.flow_dispatch.compute_selective_run',
+                       return_value={'selective': True})
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_chunks(self):
+        """Test that flows are published in chunks using a single producer."""
+        with FlowDispatchBatch(chunk_size=2, on_chunk=self.on_chunk) as batch:
+            for idx in range(5):
+                batch.add('bayesianFlow', {'name': 'foo', 'version': str(idx)})
+                assert len(batch) == (idx + 1) % 2
+
+        assert self.dispatcher.apply_async.call_count == 5
+        for call in self.dispatcher.apply_async.call_args_list:
+            assert call[1]['producer'] is self.producer
+            assert call[1]['queue'] == 'bayesian_queue'
+        self.dispatcher.app.producer_pool.acquire.assert_called_once_with(block=True)
+        self.producer.release.assert_called_once_with()
+
+        assert [call[0][0]['bayesianFlow'] for call in self.on_chunk.call_args_list] == [2, 2, 1]
+
+    def test_selective(self):
+        """Test that the selective run is computed once per batch."""
+        with mock.patch('f8a_jobs.flow_dispatch.compute_selective_run',
+                        return_value={'selective': True}) as compute_selective_run:
+            with FlowDispatchBatch(chunk_size=10) as batch:
+                batch.add_selective('bayesianFlow', ['TaskA', 'TaskB'], {'name': 'foo'})
+                batch.add_selective('bayesianFlow', ['TaskB', 'TaskA'], {'name': 'bar'})
+
+        compute_selective_run.assert_called_once_with('bayesianFlow', ['TaskA', 'TaskB'],
+                                                      False, False)
+
+        assert [call[1]['kwargs']['selective'] for call in
+                self.dispatcher.apply_async.call_args_list] == [{'selective': True}] * 2
+
+    def test_unknown_flow(self):
+        """Test that unknown flows are rejected when added."""
+        batch = FlowDispatchBatch(chunk_size=10)
+        with pytest.raises(UnknownFlowError):
+            batch.add('unknownFlow', {})
+        assert len(batch) == 0
+
+    def test_flushed_on_error(self):
+        """Test that flows added before an error are published."""
+        with pytest.raises(ValueError):
+            with FlowDispatchBatch(chunk_size=10) as batch:
+                batch.add('bayesianFlow', {'name': 'foo'})
+                raise ValueError()
+
+        assert self.dispatcher.apply_async.call_count == 1
+        self.producer.release.assert_called_once_with()
+
+    def test_discarded_on_publish_error(self):
+        """Test that flows not published due to an error are reported as discarded."""
+        published = [mock.Mock(id='dispatcher-id'), ConnectionError('broker unavailable')]
+        self.dispatcher.apply_async.side_effect = published
+        on_discard = mock.Mock()
+        with pytest.raises(ConnectionError):
+            with FlowDispatchBatch(chunk_size=10, on_discard=on_discard) as batch:
+                for idx in range(3):
+                    batch.add('bayesianFlow', {'name': 'foo', 'version': str(idx)})
+
+        on_discard.assert_called_once_with([('bayesianFlow', {'name': 'foo', 'version': '1'}),
+                                            ('bayesianFlow', {'name': 'foo', 'version': '2'})])
+        self.producer.release.assert_called_once_with()
+
+    def test_claimed(self):
+        """Test that flows rejected when claimed are not published, selective flows are kept."""
+        claim = mock.Mock(side_effect=lambda flows: [flow[1]['version'] != '1' for flow in flows])
+        with FlowDispatchBatch(chunk_size=10, on_chunk=self.on_chunk, claim=claim) as batch:
+            for idx in range(3):
+                batch.add('bayesianFlow', {'name': 'foo', 'version': str(idx)})
+            batch.add_selective('bayesianFlow', ['TaskA'], {'name': 'foo', 'version': '1'})
+
+        claim.assert_called_once_with([('bayesianFlow', {'name': 'foo', 'version': str(idx)})
+                                       for idx in range(3)])
+        assert [call[1]['kwargs']['node_args']['version'] for call in
+                self.dispatcher.apply_async.call_args_list] == ['0', '2', '1']
+        assert self.on_chunk.call_args[0][0] == {'bayesianFlow': 3}
+
+    def test_all_rejected(self):
+        """Test that no producer is acquired if all flows of a chunk are rejected."""
+        with FlowDispatchBatch(chunk_size=10, claim=lambda flows: [False] * len(flows)) as batch:
+            batch.add('bayesianFlow', {'name': 'foo', 'version': '1'})
+
+        self.dispatcher.app.producer_pool.acquire.assert_not_called()
@@ -1,6 +1,9 @@
 """Tests for the module 'graph_ingestion'."""
 
+import copy
 from unittest import mock
+
+import pytest
 from f8a_jobs.graph_ingestion import (ingest_epv_into_graph,
                                       ingest_epv,
                                       ingest_selective_epv_into_graph,
@@ -10,6 +13,7 @@ from f8a_jobs.graph_ingestion import (ingest_epv_into_graph,
                                       trigger_workerflow,
                                       trigger_workerflow_internal)
 from f8a_jobs import graph_ingestion
+from f8a_jobs.flow_dedupe import FlowDeduplicator
 
 data_v1 = {
             'body': {
@@ -224,6 +228,37 @@ class DispacherError:
     dummy_id = None
 
 
+@pytest.fixture(autouse=True)
+def flow_deduplicator():
+    """Remember dispatched flows in memory only, flows dispatched by other tests are forgotten."""
+    with mock.patch('f8a_jobs.graph_ingestion.FLOW_DEDUPLICATOR',
+                    FlowDeduplicator(ttl=60, max_size=100)) as deduplicator:
+        yield deduplicator
+
+
+@mock.patch('f8a_jobs.graph_ingestion.run_flow', return_value=Dispacher())
+def test_ingest_epv_into_graph_duplicate(_mock):
+    """Tests that recently dispatched flows are not dispatched again with the same arguments."""
+    data = copy.deepcopy(data_v1)
+    data['body']['force_graph_sync'] = False
+    ingest_epv_into_graph(copy.deepcopy(data))
+    result, status = ingest_epv_into_graph(copy.deepcopy(data))
+    assert status == 201
+    assert result['packages'][0]['message'] == \
+        'Flow was dispatched recently, skipped as a duplicate.'
+    assert 'dispacher_id' not in result['packages'][0]
+    assert _mock.call_count == 1
+
+    # forced flows are always dispatched
+    for force in ('force', 'force_graph_sync'):
+        forced = copy.deepcopy(data)
+        forced['body'][force] = True
+        for _ in range(2):
+            result, _ = ingest_epv_into_graph(copy.deepcopy(forced))
+            assert result['packages'][0]['dispacher_id'] == 'dummy_dispacher_id'
+    assert _mock.call_count == 5
+
+
 @mock.patch('f8a_jobs.graph_ingestion.run_flow', return_value=Dispacher())
 def test_ingest_epv_into_graph(_mock):
     """Tests for 'ingest_epv_into_graph'."""
@@ -0,0 +1,129 @@
+"""Tests for the module 'http_cache'."""
+
+import os
+from unittest import mock
+
+import requests
+
+from f8a_jobs.http_cache import HttpCache
+
+URL = 'https://www.npmjs.com/browse/depended?offset=0'
+
+
+def _response(status_code, content=b'', **headers):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = URL
+    response.encoding = 'utf-8'
+    response.headers.update(headers)
+    response._content = content
+    return response
+
+
+class TestHttpCache(object):
+    """Tests for the class HttpCache."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.fetch = mock.Mock()
+
+    def test_disabled(self):
+        """Test that the cache is disabled without a directory."""
+        assert not HttpCache('', ttl=60, max_size=1024).enabled
+        assert not HttpCache(None, ttl=60, max_size=1024).enabled
+
+    def test_fresh_hit(self, tmpdir):
+        """Test that a fresh page is served without a request."""
+        cache = HttpCache(str(tmpdir), ttl=60, max_size=1024 * 1024)
+        self.fetch.return_value = _response(200, b'<html>1</html>', ETag='"v1"',
+                                            **{'Content-Type': 'text/html', 'Server': 'x'})
+
+        response, lookup = cache.get(URL, self.fetch, timeout=10)
+        assert lookup == HttpCache.MISS
+        assert response.text == '<html>1</html>'
+        self.fetch.assert_called_once_with(URL, timeout=10)
+
+        response, lookup = cache.get(URL, self.fetch, timeout=10)
+        assert lookup == HttpCache.HIT
+        assert self.fetch.call_count == 1
+        assert response.ok
+        assert response.url == URL
+        assert response.text == '<html>1</html>'
+        assert response.headers['content-type'] == 'text/html'
+        assert 'Server' not in response.headers
+
+    def test_revalidated(self, tmpdir):
+        """Test that a stale page is revalidated using a conditional request."""
+        cache = HttpCache(str(tmpdir), ttl=0, max_size=1024 * 1024)
+        self.fetch.return_value = _response(200, b'<html>1</html>', ETag='"v1"',
+                                            **{'Last-Modified': 'Fri, 16 Oct 2020 10:00:00 GMT'})
+        cache.get(URL, self.fetch)
+
+        self.fetch.return_value = _response(304)
+        response, lookup = cache.get(URL, self.fetch, headers={'Accept': 'text/html'})
+        assert lookup == HttpCache.REVALIDATED
+        assert response.status_code == 200
+        assert response.text == '<html>1</html>'
+        self.fetch.assert_called_with(URL, headers={
+            'Accept': 'text/html',
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Fri, 16 Oct 2020 10:00:00 GMT'
+        })
+
+        # the page changed, it is replaced
+        self.fetch.return_value = _response(200, b'<html>2</html>', ETag='"v2"')
+        response, lookup = cache.get(URL, self.fetch)
+        assert lookup == HttpCache.MISS
+        assert response.text == '<html>2</html>'
+        self.fetch.return_value = _response(304)
+        assert cache.get(URL, self.fetch)[0].text == '<html>2</html>'
+        assert self.fetch.call_args[1]['headers'] == {'If-None-Match': '"v2"'}
+
+    def test_errors_not_cached(self, tmpdir):
+        """Test that unsuccessful responses are not cached."""
+        cache = HttpCache(str(tmpdir), ttl=60, max_size=1024 * 1024)
+        self.fetch.return_value = _response(503, b'unavailable')
+        for _ in range(2):
+            response, lookup = cache.get(URL, self.fetch)
+            assert lookup == HttpCache.MISS
+            assert response.status_code == 503
+        assert self.fetch.call_count == 2
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_eviction(self, tmpdir):
+        """Test that the least recently used pages are evicted once over the size limit."""
+        cache = HttpCache(str(tmpdir), ttl=60, max_size=1500)
+        urls = ['https://www.nuget.org/packages?page={}'.format(page) for page in range(3)]
+        for idx, url in enumerate(urls):
+            self.fetch.return_value = _response(200, b'x' * 300)
+            cache.get(url, self.fetch)
+            # make the order of use unambiguous regardless of timestamp resolution
+            os.utime(cache._path(url, '.json'), (idx, idx))
+        # the first page is used again, the second one is the least recently used now
+        cache._touch(urls[0])
+
+        self.fetch.return_value = _response(200, b'x' * 300)
+        cache.get('https://www.nuget.org/packages?page=3', self.fetch)
+
+        assert cache.get(urls[0], self.fetch)[1] == HttpCache.HIT
+        assert cache.get(urls[2], self.fetch)[1] == HttpCache.HIT
+        assert cache.get(urls[1], self.fetch)[1] == HttpCache.MISS
+
+    def test_directory_not_scanned_on_each_store(self, tmpdir):
+        """Test that the directory is scanned only once the cache may be over the size limit."""
+        cache = HttpCache(str(tmpdir), ttl=60, max_size=1500)
+        self.fetch.return_value = _response(200, b'x' * 300)
+        with mock.patch('f8a_jobs.http_cache.os.scandir', wraps=os.scandir) as scandir:
+            for page in range(3):
+                cache.get('https://www.nuget.org/packages?page={}'.format(page), self.fetch)
+            # the first store scans the directory, then sizes of stored entries are added up
+            assert scandir.call_count == 1
+
+            cache.get('https://www.nuget.org/packages?page=3', self.fetch)
+            assert scandir.call_count == 2
+            assert len(os.listdir(str(tmpdir))) == 6
+
+            # entries may have been stored by other processes meanwhile
+            cache._scanned_at -= HttpCache._SCAN_INTERVAL
+            cache.get('https://www.nuget.org/packages?page=4', self.fetch)
+            assert scandir.call_count == 3
@@ -0,0 +1,93 @@
+"""Tests for the module 'job_index'."""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from apscheduler.events import JobEvent, EVENT_JOB_ADDED, EVENT_JOB_REMOVED
+from apscheduler.triggers.date import DateTrigger
+
+from f8a_jobs.job_index import JobIndex
+
+
+def _job(job_id, handler, paused=False):
+    """Construct an object resembling apscheduler.Job."""
+    job = mock.Mock(spec=['id', 'args', 'kwargs', 'trigger', 'next_run_time'])
+    job.id = job_id
+    job.args = (handler, job_id)
+    job.kwargs = {}
+    job.trigger = DateTrigger(run_date=datetime(2030, 1, 1, tzinfo=timezone.utc))
+    job.next_run_time = None if paused else job.trigger.run_date
+    return job
+
+
+class TestJobIndex(object):
+    """Tests for the class JobIndex."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.scheduler = mock.Mock()
+        self.jobstore = mock.Mock()
+        self.jobstore.get_all_jobs.return_value = [
+            _job('flow-1', 'FlowScheduling'),
+            _job('error-1', 'ErrorHandler', paused=True),
+            _job('clean-1', 'CleanPostgres', paused=True),
+            _job('flow-2', 'FlowScheduling'),
+        ]
+        self.index = JobIndex(self.scheduler, self.jobstore, refresh_interval=3600)
+
+    def test_list_all(self):
+        """Test listing of all jobs, the job store is queried only once."""
+        jobs, has_more = self.index.list()
+        assert [job['job_id'] for job in jobs] == ['flow-1', 'error-1', 'clean-1', 'flow-2']
+        assert has_more is False
+
+        self.index.list()
+        self.jobstore.get_all_jobs.assert_called_once_with()
+
+    @pytest.mark.parametrize(('filters', 'expected'), [
+        ({'job_type': 'failed'}, ['error-1']),
+        ({'job_type': 'user'}, ['flow-1', 'clean-1', 'flow-2']),
+        ({'handler': 'FlowScheduling'}, ['flow-1', 'flow-2']),
+        ({'state': 'paused'}, ['error-1', 'clean-1']),
+        ({'state': 'paused', 'job_type': 'user'}, ['clean-1']),
+    ])
+    def test_list_filters(self, filters, expected):
+        """Test server-side filtering."""
+        jobs, _ = self.index.list(**filters)
+        assert [job['job_id'] for job in jobs] == expected
+
+    def test_list_paging(self):
+        """Test paging using offset and limit."""
+        jobs, has_more = self.index.list(offset=1, limit=2)
+        assert [job['job_id'] for job in jobs] == ['error-1', 'clean-1']
+        assert has_more is True
+
+        jobs, has_more = self.index.list(offset=2, limit=2)
+        assert [job['job_id'] for job in jobs] == ['clean-1', 'flow-2']
+        assert has_more is False
+
+    def test_list_unknown_job_type(self):
+        """Test that unknown job types are reported."""
+        with pytest.raises(ValueError):
+            self.index.list(job_type='foo')
+
+    def test_events(self):
+        """Test that the index is updated based on scheduler events."""
+        self.index.list()
+
+        self.jobstore.lookup_job.return_value = _job('flow-3', 'FlowScheduling')
+        self.index._on_event(JobEvent(EVENT_JOB_ADDED, 'flow-3', 'default'))
+        self.index._on_event(JobEvent(EVENT_JOB_REMOVED, 'flow-1', 'default'))
+
+        jobs, _ = self.index.list(handler='FlowScheduling')
+        assert [job['job_id'] for job in jobs] == ['flow-2', 'flow-3']
+        self.jobstore.lookup_job.assert_called_once_with('flow-3')
+        self.jobstore.get_all_jobs.assert_called_once_with()
+
+    def test_invalidate(self):
+        """Test that the index is reloaded once invalidated."""
+        self.index.list()
+        self.index.invalidate()
+        self.index.list()
+        assert self.jobstore.get_all_jobs.call_count == 2
@@ -0,0 +1,131 @@
+"""Tests for the module 'job_metrics'."""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from apscheduler.events import (JobExecutionEvent, JobSubmissionEvent, EVENT_JOB_SUBMITTED,
+                                EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED)
+
+from f8a_jobs.job_metrics import JobMetricsListener
+from f8a_jobs.metrics import (JOB_DURATION, JOB_LAG, JOBS_FAILED, JOBS_MISSED, JOBS_IN_FLIGHT,
+                              FLOWS_DISPATCHED, FLOW_DISPATCH_CHUNK_DURATION,
+                              FLOW_DEDUPE_LOOKUPS, HTTP_CACHE_LOOKUPS)
+
+
+class TestJobMetricsListener(object):
+    """Tests for the class JobMetricsListener."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.scheduler = mock.Mock()
+        self.job_index = mock.Mock()
+        self.job_index.get.return_value = None
+        self.listener = JobMetricsListener(self.scheduler, self.job_index)
+        self.scheduled_run_time = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def _executed(self, handler, succeeded, **flows_dispatched):
+        return JobExecutionEvent(EVENT_JOB_EXECUTED, 'job-1', 'default', self.scheduled_run_time,
+                                 retval={
+                                     'handler': handler,
+                                     'succeeded': succeeded,
+                                     'started_at': self.scheduled_run_time.timestamp() + 2,
+                                     'duration': 10.0,
+                                     'flows_dispatched': flows_dispatched
+                                 })
+
+    def test_subscribed(self):
+        """Test that the listener is subscribed to job events."""
+        callback, mask = self.scheduler.add_listener.call_args[0]
+        assert callback == self.listener._on_event
+        for code in (EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED):
+            assert mask & code
+
+    def test_job_executed(self):
+        """Test metrics of executed jobs."""
+        self.listener._on_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'job-1', 'default',
+                                                   [self.scheduled_run_time]))
+        assert JOBS_IN_FLIGHT.get() == 1
+
+        self.listener._on_event(self._executed('TestMetricsHandler', True, bayesianFlow=3))
+        assert JOBS_IN_FLIGHT.get() == 0
+
+        duration = JOB_DURATION._values[('TestMetricsHandler', 'succeeded')]
+        assert duration['count'] == 1
+        assert duration['sum'] == 10.0
+        assert JOB_LAG._values[('TestMetricsHandler',)]['sum'] == 2.0
+        assert FLOWS_DISPATCHED.get(handler='TestMetricsHandler', flow='bayesianFlow') == 3
+        assert JOBS_FAILED.get(handler='TestMetricsHandler') is None
+
+    def test_job_failed(self):
+        """Test metrics of jobs that failed."""
+        self.listener._on_event(self._executed('TestFailedHandler', False))
+        assert JOB_DURATION._values[('TestFailedHandler', 'failed')]['count'] == 1
+        assert JOBS_FAILED.get(handler='TestFailedHandler') == 1
+
+        self.job_index.get.return_value = {'handler': 'TestFailedHandler'}
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_ERROR, 'job-1', 'default',
+                                                  self.scheduled_run_time,
+                                                  exception=ValueError()))
+        assert JOBS_FAILED.get(handler='TestFailedHandler') == 2
+
+    def test_job_missed(self):
+        """Test metrics of jobs that missed their run time."""
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_MISSED, 'job-1', 'default',
+                                                  self.scheduled_run_time))
+        assert JOBS_MISSED.get(handler=JobMetricsListener.UNKNOWN_HANDLER) == 1
+        self.job_index.get.assert_called_once_with('job-1')
+
+    def test_in_flight(self):
+        """Test that only runs submitted to executors are counted as in flight."""
+        self.listener._on_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'job-1', 'default',
+                                                   [self.scheduled_run_time]))
+        self.listener._on_event(JobSubmissionEvent(EVENT_JOB_SUBMITTED, 'job-2', 'default',
+                                                   [self.scheduled_run_time]))
+        assert JOBS_IN_FLIGHT.get() == 2
+
+        # a run missed before it was submitted was never in flight
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_MISSED, 'job-3', 'default',
+                                                  self.scheduled_run_time))
+        assert JOBS_IN_FLIGHT.get() == 2
+
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_ERROR, 'job-2', 'default',
+                                                  self.scheduled_run_time,
+                                                  exception=ValueError()))
+        assert JOBS_IN_FLIGHT.get() == 1
+
+        # the executor did not run the submitted run as it was over misfire_grace_time
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_MISSED, 'job-1', 'default',
+                                                  self.scheduled_run_time))
+        assert JOBS_IN_FLIGHT.get() == 0
+
+    def test_flow_dispatch_chunks(self):
+        """Test that durations of chunks of flows dispatched in batches are recorded."""
+        event = self._executed('TestChunksHandler', True, bayesianFlow=150)
+        event.retval['flow_dispatch_chunks'] = [(100, 0.5), (50, 0.25)]
+        self.listener._on_event(event)
+
+        chunks = FLOW_DISPATCH_CHUNK_DURATION._values[('TestChunksHandler',)]
+        assert chunks['count'] == 2
+        assert chunks['sum'] == 0.75
+
+    def test_flow_dedupe_lookups(self):
+        """Test that results of duplicate dispatch lookups are recorded."""
+        event = self._executed('TestDedupeHandler', True, bayesianFlow=1)
+        event.retval['flow_dedupe_lookups'] = {('bayesianFlow', 'hit'): 3,
+                                               ('bayesianFlow', 'miss'): 1}
+        self.listener._on_event(event)
+
+        assert FLOW_DEDUPE_LOOKUPS.get(source='TestDedupeHandler', flow='bayesianFlow',
+                                       result='hit') == 3
+        assert FLOW_DEDUPE_LOOKUPS.get(source='TestDedupeHandler', flow='bayesianFlow',
+                                       result='miss') == 1
+
+    def test_http_cache_lookups(self):
+        """Test that results of HTTP cache lookups are recorded."""
+        event = self._executed('TestHttpCacheHandler', True)
+        event.retval['http_cache_lookups'] = {'hit': 4, 'revalidated': 2, 'miss': 1}
+        self.listener._on_event(event)
+
+        assert HTTP_CACHE_LOOKUPS.get(handler='TestHttpCacheHandler', result='hit') == 4
+        assert HTTP_CACHE_LOOKUPS.get(handler='TestHttpCacheHandler', result='revalidated') == 2
+        assert HTTP_CACHE_LOOKUPS.get(handler='TestHttpCacheHandler', result='miss') == 1
@@ -0,0 +1,71 @@
+"""Tests for the module 'job_retries'."""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+from apscheduler.events import JobExecutionEvent, EVENT_JOB_EXECUTED
+
+from f8a_jobs.job_retries import JobRetryListener
+
+
+class TestJobRetryListener(object):
+    """Tests for the class JobRetryListener."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.scheduler = mock.Mock()
+        self.listener = JobRetryListener(self.scheduler)
+
+    @staticmethod
+    def _executed(job_id, retry):
+        return JobExecutionEvent(EVENT_JOB_EXECUTED, job_id, 'default',
+                                 datetime(2020, 1, 1, tzinfo=timezone.utc),
+                                 retval={
+                                     'handler': 'PythonPopularAnalyses',
+                                     'succeeded': retry is None,
+                                     'retry': retry
+                                 })
+
+    def test_subscribed(self):
+        """Test that the listener is subscribed to executed jobs."""
+        self.scheduler.add_listener.assert_called_once_with(self.listener._on_event,
+                                                            EVENT_JOB_EXECUTED)
+
+    @pytest.mark.parametrize('job_id', ('popular-pypi', 'popular-pypi-retry'))
+    def test_retry_scheduled(self, job_id):
+        """Test that retries are scheduled as one-shot jobs, one pending retry per job."""
+        before = datetime.now(timezone.utc)
+        self.listener._on_event(self._executed(job_id, {
+            'job_id': 'popular-pypi',
+            'attempt': 2,
+            'delay': 300,
+            'kwargs': {'count': '10'}
+        }))
+
+        self.scheduler.add_job.assert_called_once()
+        args, kwargs = self.scheduler.add_job.call_args
+        assert args == ('f8a_jobs.scheduler:job_execute',)
+        assert kwargs['trigger'] == 'date'
+        assert 299 < (kwargs['run_date'] - before).total_seconds() < 310
+        assert kwargs['id'] == 'popular-pypi-retry'
+        assert kwargs['args'] == ('PythonPopularAnalyses', 'popular-pypi')
+        assert kwargs['kwargs'] == {'count': '10', '_attempt': 2}
+        assert kwargs['replace_existing'] is True
+
+    def test_no_retry(self):
+        """Test that nothing is scheduled if no retry was requested."""
+        self.listener._on_event(self._executed('popular-pypi', None))
+        self.listener._on_event(JobExecutionEvent(EVENT_JOB_EXECUTED, 'legacy', 'default',
+                                                  datetime(2020, 1, 1, tzinfo=timezone.utc)))
+        self.scheduler.add_job.assert_not_called()
+
+    def test_scheduling_error(self):
+        """Test that failures when scheduling retries do not propagate to the scheduler."""
+        self.scheduler.add_job.side_effect = RuntimeError()
+        self.listener._on_event(self._executed('popular-pypi', {
+            'job_id': 'popular-pypi',
+            'attempt': 2,
+            'delay': 300,
+            'kwargs': {}
+        }))
@@ -0,0 +1,71 @@
+"""Tests for the module 'leader_election'."""
+
+from unittest import mock
+
+from f8a_jobs.leader_election import LeaderElector
+
+
+class TestLeaderElector(object):
+    """Tests for the class LeaderElector."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.on_elected = mock.Mock()
+        self.on_demoted = mock.Mock()
+        self.on_tick = mock.Mock()
+        self.engine = mock.Mock()
+        with mock.patch('f8a_jobs.leader_election.create_engine', return_value=self.engine):
+            self.elector = LeaderElector('postgresql://localhost/db', 42, 1,
+                                         on_elected=self.on_elected,
+                                         on_demoted=self.on_demoted,
+                                         on_tick=self.on_tick)
+
+    def _set_lock_result(self, acquired):
+        connection = self.engine.connect.return_value
+        connection.execute.return_value.scalar.return_value = acquired
+        return connection
+
+    def test_elected(self):
+        """Test that the process becomes the leader once the lock is acquired."""
+        self._set_lock_result(True)
+        self.elector.elect()
+        assert self.elector.is_leader is True
+        self.on_elected.assert_called_once_with()
+        self.on_tick.assert_not_called()
+
+        # next round just checks the connection and ticks
+        self.elector.elect()
+        assert self.elector.is_leader is True
+        self.on_elected.assert_called_once_with()
+        self.on_tick.assert_called_once_with()
+
+    def test_lock_held_by_other_process(self):
+        """Test that the process stays a follower if the lock is held by another process."""
+        self._set_lock_result(False)
+        self.elector.elect()
+        self.elector.elect()
+        assert self.elector.is_leader is False
+        self.on_elected.assert_not_called()
+        # the connection is reused between rounds
+        self.engine.connect.assert_called_once_with()
+
+    def test_demoted_on_connection_failure(self):
+        """Test that the leadership is given up once the connection holding the lock fails."""
+        connection = self._set_lock_result(True)
+        self.elector.elect()
+        assert self.elector.is_leader is True
+
+        connection.execute.side_effect = Exception("connection lost")
+        self.elector.elect()
+        assert self.elector.is_leader is False
+        self.on_demoted.assert_called_once_with()
+        connection.close.assert_called_once_with()
+
+    def test_stop(self):
+        """Test that stopping the elector gives up the leadership."""
+        connection = self._set_lock_result(True)
+        self.elector.elect()
+        self.elector.stop()
+        assert self.elector.is_leader is False
+        self.on_demoted.assert_called_once_with()
+        connection.close.assert_called_once_with()
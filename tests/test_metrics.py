@@ -0,0 +1,82 @@
+"""Tests for the module 'metrics'."""
+
+import pytest
+
+from f8a_jobs.metrics import Counter, Gauge, Histogram, render
+
+
+class TestMetrics(object):
+    """Tests for the module 'metrics'."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        # metrics created by tests are not exported along with metrics of the service
+        self.registry = []
+
+    def test_counter(self):
+        """Test counter increments and its text representation."""
+        counter = Counter('test_counter_requests', 'Number of requests', labelnames=('handler',),
+                          registry=self.registry)
+        counter.inc(handler='FlowScheduling')
+        counter.inc(2, handler='FlowScheduling')
+        counter.inc(handler='CleanPostgres')
+
+        assert counter.get(handler='FlowScheduling') == 3
+        text = counter.collect()
+        assert '# TYPE test_counter_requests counter' in text
+        assert 'test_counter_requests_total{handler="FlowScheduling"} 3.0' in text
+        assert 'test_counter_requests_total{handler="CleanPostgres"} 1.0' in text
+
+    def test_counter_bad_labels(self):
+        """Test that labels are checked on update."""
+        counter = Counter('test_counter_labels', 'Labels check', labelnames=('handler',),
+                          registry=self.registry)
+        with pytest.raises(ValueError):
+            counter.inc(flow='bayesianFlow')
+
+    def test_gauge(self):
+        """Test gauge updates."""
+        gauge = Gauge('test_gauge_depth', 'Queue depth', registry=self.registry)
+        gauge.set(10)
+        gauge.set(5)
+        assert gauge.get() == 5
+        assert 'test_gauge_depth 5.0' in gauge.collect()
+
+    def test_histogram(self):
+        """Test histogram buckets are cumulative."""
+        histogram = Histogram('test_histogram_duration', 'Duration', buckets=(1, 10),
+                              registry=self.registry)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        histogram.observe(50)
+
+        text = histogram.collect()
+        assert 'test_histogram_duration_bucket{le="1.0"} 1' in text
+        assert 'test_histogram_duration_bucket{le="10.0"} 2' in text
+        assert 'test_histogram_duration_bucket{le="+Inf"} 3' in text
+        assert 'test_histogram_duration_sum 55.5' in text
+        assert 'test_histogram_duration_count 3' in text
+
+    def test_render(self):
+        """Test that all registered metrics are rendered."""
+        Counter('test_render_counter', 'Rendered counter', registry=self.registry).inc()
+        Gauge('test_render_gauge', 'Rendered gauge', registry=self.registry).set(2)
+        text = render(self.registry)
+        assert 'test_render_counter_total 1.0' in text
+        assert 'test_render_gauge 2.0' in text
+        assert 'f8a_jobs_scheduler_lock_wait_seconds' not in text
+
+        text = render()
+        assert 'f8a_jobs_scheduler_lock_wait_seconds' in text
+        assert 'test_render' not in text
+
+    def test_render_const_labels(self):
+        """Test that constant labels are added to all samples."""
+        Counter('test_const_counter', 'Labeled counter', labelnames=('handler',),
+                registry=self.registry).inc(handler='Flow')
+        Histogram('test_const_histogram', 'Histogram', buckets=(1.0,),
+                  registry=self.registry).observe(0.5)
+        text = render(self.registry, {'leader': 'true'})
+        assert 'test_const_counter_total{handler="Flow",leader="true"} 1.0' in text
+        assert 'test_const_histogram_bucket{leader="true",le="1.0"} 1' in text
+        assert 'test_const_histogram_sum{leader="true"} 0.5' in text
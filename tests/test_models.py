@@ -1,9 +1,21 @@
 """Tests for the module 'models'."""
 
-# import pytest
+import json
+from datetime import datetime
+from unittest import mock
 
-# TODO enable when new test(s) will be added
-# from f8a_jobs.models import *
+from sqlalchemy.dialects import postgresql
+
+from f8a_jobs import models
+from f8a_jobs.models import FailedJob, FlowDispatch, JobCheckpoint, dispose_inherited_engine
+
+_TRACEBACK = """Traceback (most recent call last):
+  File "/usr/lib/python3.6/site-packages/f8a_jobs/scheduler.py", line {line}, in job_execute
+    instance.execute(**handler_kwargs)
+  File "/usr/lib/python3.6/site-packages/f8a_jobs/handlers/flow.py", line 18, in execute
+    self.run_selinon_flow(flow_name, args)
+ValueError: {message}
+"""
 
 
 class TestModels(object):
@@ -16,3 +28,126 @@ class TestModels(object):
     def teardown_method(self, method):
         """Teardown any state that was previously setup with a setup_method call."""
         assert method
+
+    @mock.patch('f8a_jobs.models._inherited', [])
+    @mock.patch('f8a_jobs.models._pooled_engine_pid', 1)
+    @mock.patch('f8a_jobs.models._pooled_engine')
+    def test_dispose_inherited_engine(self, engine):
+        """Test that the pool inherited from the parent process is replaced, not closed."""
+        dispose_inherited_engine()
+
+        assert models._pooled_engine is None
+        assert models._pooled_engine_pid is None
+        assert models._inherited == [engine]
+        engine.dispose.assert_not_called()
+
+    def test_failed_job_fingerprint(self):
+        """Test that failures differing only in messages and line numbers are grouped."""
+        fingerprint, exc_type = FailedJob.compute_fingerprint(
+            'FlowScheduling', _TRACEBACK.format(line=10, message="Unknown package 'foo'"))
+        assert exc_type == 'ValueError'
+
+        same, _ = FailedJob.compute_fingerprint(
+            'FlowScheduling', _TRACEBACK.format(line=42, message="Unknown package 'bar'"))
+        assert same == fingerprint
+
+        other, _ = FailedJob.compute_fingerprint(
+            'SelectiveFlowScheduling', _TRACEBACK.format(line=10, message="Unknown package"))
+        assert other != fingerprint
+
+    def test_failed_job_record(self):
+        """Test that a failure is recorded using a single upsert statement."""
+        session = mock.Mock()
+        with mock.patch.object(FailedJob, '_last_purge', None), \
+                mock.patch.object(FailedJob, 'purge_expired') as purge_expired:
+            fingerprint = FailedJob.record('FlowScheduling', 'job-1',
+                                           {'flow_name': 'bayesianFlow'}, 'foo',
+                                           _TRACEBACK.format(line=10, message='foo'),
+                                           session=session)
+        purge_expired.assert_called_once_with(session)
+
+        statement = session.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert 'INSERT INTO jobs_failures' in sql
+        assert 'ON CONFLICT (fingerprint) DO UPDATE' in sql
+        assert 'occurrences = (jobs_failures.occurrences + ' in sql
+        assert statement.compile(dialect=postgresql.dialect()).params['fingerprint'] == \
+            fingerprint
+        session.commit.assert_called_once_with()
+
+    def test_failed_job_record_datetime_kwargs(self):
+        """Test that kwargs holding dates are converted to JSON serializable values."""
+        session = mock.Mock()
+        with mock.patch.object(FailedJob, '_last_purge', 0.0), \
+                mock.patch('f8a_jobs.models.monotonic', return_value=1.0):
+            FailedJob.record('CleanPostgres', 'job-1',
+                             {'from_date': datetime(2020, 10, 16, 10, 30), 'force': True},
+                             'foo', _TRACEBACK.format(line=10, message='foo'), session=session)
+
+        statement = session.execute.call_args[0][0]
+        handler_kwargs = statement.compile(dialect=postgresql.dialect()).params['handler_kwargs']
+        assert handler_kwargs == {'from_date': '2020-10-16 10:30:00', 'force': True}
+        json.dumps(handler_kwargs)
+
+    def test_job_checkpoint_store(self):
+        """Test that a checkpoint is stored using a single upsert statement."""
+        session = mock.Mock()
+        JobCheckpoint.store('job-1', 'CleanPostgres', {'last_id': 42}, session=session)
+
+        statement = session.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert 'INSERT INTO jobs_checkpoints' in sql
+        assert 'ON CONFLICT (job_id) DO UPDATE' in sql
+        session.commit.assert_called_once_with()
+
+    def test_job_checkpoint_get(self):
+        """Test that cursors stored by other handlers are ignored."""
+        session = mock.Mock()
+        entry = session.query.return_value.filter.return_value.one_or_none.return_value
+        entry.handler = 'CleanPostgres'
+        entry.cursor = {'last_id': 42}
+        assert JobCheckpoint.get('job-1', 'CleanPostgres', session=session) == {'last_id': 42}
+        assert JobCheckpoint.get('job-1', 'SyncToGraph', session=session) is None
+
+    def test_job_checkpoint_compute_id(self):
+        """Test that checkpoints of runs with different arguments differ."""
+        checkpoint_id = JobCheckpoint.compute_id('job-1', {'a': 1, 'b': [2]})
+        assert checkpoint_id.startswith('job-1:')
+        assert checkpoint_id == JobCheckpoint.compute_id('job-1', {'b': [2], 'a': 1})
+        assert checkpoint_id != JobCheckpoint.compute_id('job-1', {'a': 2, 'b': [2]})
+        assert checkpoint_id != JobCheckpoint.compute_id('job-1-retry', {'a': 1, 'b': [2]})
+        assert JobCheckpoint.compute_id('job-1', None) == JobCheckpoint.compute_id('job-1', {})
+        assert JobCheckpoint.compute_id('job-1', {'a': 1, 'b': [2]}, name='entries') == \
+            checkpoint_id + '/entries'
+
+    def test_job_checkpoint_clear(self):
+        """Test that named checkpoints are cleared along the checkpoint of the job."""
+        session = mock.Mock()
+        session.query.return_value.filter.return_value.delete.return_value = 2
+        assert JobCheckpoint.clear('job-1:0123', session=session)
+        criterion = session.query.return_value.filter.call_args[0][0]
+        sql = str(criterion.compile(dialect=postgresql.dialect(),
+                                    compile_kwargs={'literal_binds': True}))
+        assert "jobs_checkpoints.job_id = 'job-1:0123'" in sql
+        # '/' is the escape character of the pattern, hence doubled
+        assert "jobs_checkpoints.job_id LIKE 'job-1:0123//' || '%%' ESCAPE '/'" in sql
+        session.commit.assert_called_once_with()
+
+    def test_flow_dispatch_claim(self):
+        """Test that flows are claimed by a single upsert overwriting only expired dispatches."""
+        session = mock.Mock()
+        assert FlowDispatch.claim([], 60, session=session) == set()
+        session.execute.assert_not_called()
+
+        session.execute.return_value = [('b' * 64,)]
+        assert FlowDispatch.claim(['a' * 64, 'b' * 64], 60, session=session) == {'b' * 64}
+        session.execute.assert_called_once_with(mock.ANY)
+        session.commit.assert_called_once_with()
+
+        statement = session.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert 'ON CONFLICT (key) DO UPDATE' in sql
+        assert 'WHERE jobs_flow_dispatches.expires_at <=' in sql
+        assert 'RETURNING jobs_flow_dispatches.key' in sql
+        # one statement for all flows
+        assert '%(key_m1)s' in sql
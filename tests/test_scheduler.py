@@ -1,8 +1,14 @@
 """Tests for the module 'api_v1'."""
 
+from datetime import datetime, timedelta
+from unittest import mock
+
 import pytest
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
 
-from f8a_jobs.scheduler import Scheduler, ScheduleJobError
+from f8a_jobs.models import DefaultJobFingerprint
+from f8a_jobs.scheduler import Scheduler, ScheduleJobError, BulkScheduleJobError, job_execute
 import f8a_jobs.handlers as handlers
 
 
@@ -55,3 +61,340 @@ class TestScheduler(object):
         with pytest.raises(ScheduleJobError):
             Scheduler.schedule_job(None, handlers.ErrorHandler.__name__,
                                    periodically="foo bar baz")
+
+    def test_schedule_job_method_jitter_parsing(self):
+        """Basic test for the schedule_job method: parsing the 'jitter' parameter."""
+        with pytest.raises(ScheduleJobError):
+            Scheduler.schedule_job(None, handlers.ErrorHandler.__name__,
+                                   periodically="1 day", jitter="foo bar baz")
+
+    def test_process_trigger_parameters_jitter(self):
+        """Test that jitter is set only on periodic jobs."""
+        _, trigger_kwargs = Scheduler.process_trigger_parameters(None, "1 day", None,
+                                                                 jitter="10 minutes")
+        assert trigger_kwargs['jitter'] == 600
+
+        _, trigger_kwargs = Scheduler.process_trigger_parameters(None, None, None,
+                                                                 jitter="10 minutes")
+        assert 'jitter' not in trigger_kwargs
+
+    def test_compute_spread_start_date(self):
+        """Test that periodic jobs are spread within their interval based on job ids."""
+        now = 1600000000
+        start_dates = {Scheduler.compute_spread_start_date('job-%d' % idx, 3600, now)
+                       for idx in range(10)}
+        assert len(start_dates) > 1
+        for start_date in start_dates:
+            assert now <= start_date.timestamp() < now + 3600
+
+        # the offset is kept when the job is registered again later
+        first = Scheduler.compute_spread_start_date('job-1', 3600, now)
+        later = Scheduler.compute_spread_start_date('job-1', 3600, now + 5 * 3600 + 42)
+        assert (later - first).total_seconds() == 5 * 3600
+
+    def test_process_trigger_parameters_spread(self):
+        """Test that only periodic jobs without 'when' are spread."""
+        _, trigger_kwargs = Scheduler.process_trigger_parameters(None, "1 hour", None,
+                                                                 job_id='job-1', spread=True)
+        assert trigger_kwargs['start_date'] is not None
+
+        when = datetime.now() + timedelta(days=1)
+        _, trigger_kwargs = Scheduler.process_trigger_parameters(when, "1 hour", None,
+                                                                 job_id='job-1', spread=True)
+        assert trigger_kwargs['start_date'] == when
+
+        _, trigger_kwargs = Scheduler.process_trigger_parameters(None, "1 hour", None,
+                                                                 job_id='job-1', spread=False)
+        assert trigger_kwargs['start_date'] is None
+
+
+class TestSchedulerBulk(object):
+    """Tests for scheduling jobs in bulk."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': SQLAlchemyJobStore(url='sqlite://')},
+            timezone='UTC'
+        )
+        self.scheduler.start(paused=True)
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        self.scheduler.shutdown(wait=False)
+
+    def test_schedule_jobs_bulk(self):
+        """Test that all jobs are stored."""
+        result = Scheduler.schedule_jobs_bulk(self.scheduler, [
+            {'handler': handlers.ErrorHandler.__name__, 'job_id': 'job-1', 'state': 'paused'},
+            {'handler': handlers.ErrorHandler.__name__, 'periodically': '1 day',
+             'kwargs': {'failed_job_id': 'foo'}},
+        ])
+
+        assert [status for _, status in result] == ['scheduled', 'scheduled']
+        assert result[0][0].id == 'job-1'
+        assert result[0][0].next_run_time is None
+        assert result[1][0].kwargs == {'failed_job_id': 'foo'}
+
+        stored = {job.id: job for job in self.scheduler.get_jobs()}
+        assert set(stored.keys()) == {'job-1', result[1][0].id}
+        assert stored['job-1'].args == (handlers.ErrorHandler.__name__, 'job-1')
+        assert stored[result[1][0].id].trigger.interval.total_seconds() == 86400
+
+    def test_schedule_jobs_bulk_existing(self):
+        """Test that existing jobs are replaced only if requested."""
+        spec = {'handler': handlers.ErrorHandler.__name__, 'job_id': 'job-1', 'state': 'paused'}
+        Scheduler.schedule_jobs_bulk(self.scheduler, [spec])
+
+        result = Scheduler.schedule_jobs_bulk(self.scheduler, [spec])
+        assert [status for _, status in result] == ['exists']
+
+        result = Scheduler.schedule_jobs_bulk(self.scheduler, [dict(spec, periodically='1h')],
+                                              replace_existing=True)
+        assert [status for _, status in result] == ['replaced']
+        assert self.scheduler.get_job('job-1').trigger.interval.total_seconds() == 3600
+
+    def test_schedule_jobs_bulk_modify_existing(self):
+        """Test that existing jobs are modified keeping their state unless the trigger changed."""
+        spec = {'handler': handlers.ErrorHandler.__name__, 'job_id': 'job-1', 'state': 'paused',
+                'periodically': '1h'}
+        Scheduler.schedule_jobs_bulk(self.scheduler, [spec])
+
+        result = Scheduler.schedule_jobs_bulk(self.scheduler, [
+            dict(spec, state=None, kwargs={'failed_job_id': 'foo'})
+        ], modify_existing=True)
+        assert [status for _, status in result] == ['modified']
+        job = self.scheduler.get_job('job-1')
+        assert job.kwargs == {'failed_job_id': 'foo'}
+        assert job.next_run_time is None
+
+        Scheduler.schedule_jobs_bulk(self.scheduler, [dict(spec, state=None, periodically='2h')],
+                                     modify_existing=True)
+        job = self.scheduler.get_job('job-1')
+        assert job.trigger.interval.total_seconds() == 7200
+        assert job.next_run_time is not None
+
+    def test_schedule_jobs_bulk_apscheduler_internals(self):
+        """Test that apscheduler internals used by schedule_jobs_bulk() are available."""
+        jobstore = self.scheduler._lookup_jobstore('default')
+        assert callable(self.scheduler._create_trigger)
+        assert callable(self.scheduler._dispatch_event)
+        assert isinstance(self.scheduler._job_defaults, dict)
+        assert callable(jobstore._reconstitute_job)
+        assert {column.name for column in jobstore.jobs_t.c} == \
+            {'id', 'next_run_time', 'job_state'}
+
+    def test_schedule_jobs_bulk_invalid(self):
+        """Test that no job is scheduled if any of them is invalid."""
+        with pytest.raises(BulkScheduleJobError) as exc_info:
+            Scheduler.schedule_jobs_bulk(self.scheduler, [
+                {'handler': handlers.ErrorHandler.__name__, 'job_id': 'job-1'},
+                {'handler': 'unknown handler'},
+                {'handler': handlers.ErrorHandler.__name__, 'job_id': 'job-1'},
+                {'handler': handlers.ErrorHandler.__name__, 'periodically': 'foo bar baz'},
+            ])
+
+        assert [error['index'] for error in exc_info.value.errors] == [1, 2, 3]
+        assert self.scheduler.get_jobs() == []
+
+    def test_schedule_jobs_bulk_executor(self):
+        """Test that jobs are routed to executor pools."""
+        result = Scheduler.schedule_jobs_bulk(self.scheduler, [
+            {'handler': handlers.ErrorHandler.__name__},
+            {'handler': handlers.ErrorHandler.__name__, 'executor': 'processpool'},
+        ])
+        executors = [job.executor for job, _ in result]
+        assert executors == [handlers.ErrorHandler.executor, 'processpool']
+
+        with pytest.raises(BulkScheduleJobError):
+            Scheduler.schedule_jobs_bulk(self.scheduler, [
+                {'handler': handlers.ErrorHandler.__name__, 'executor': 'unknown'},
+            ])
+
+
+class TestRegisterDefaultJobs(object):
+    """Tests for registration of default jobs."""
+
+    _JOB = """---
+  handler: {handler}
+  job_id: {job_id}
+  periodically: {periodically}
+  state: paused
+  misfire_grace_time: 1 day
+  kwargs:
+    foo: {foo}
+"""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': SQLAlchemyJobStore(url='sqlite://')},
+            timezone='UTC'
+        )
+        self.scheduler.start(paused=True)
+        self.fingerprints = {}
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        self.scheduler.shutdown(wait=False)
+
+    def _write_job(self, job_dir, job_id, handler=handlers.ErrorHandler.__name__,
+                   periodically='1 day', foo='bar'):
+        job_dir.join(job_id + '.yaml').write(self._JOB.format(
+            handler=handler, job_id=job_id, periodically=periodically, foo=foo))
+
+    def _register(self, job_dir):
+        with mock.patch.object(Scheduler, 'get_paused_scheduler', return_value=self.scheduler), \
+                mock.patch.object(DefaultJobFingerprint, 'get_all',
+                                  return_value=dict(self.fingerprints)), \
+                mock.patch.object(DefaultJobFingerprint, 'store') as store, \
+                mock.patch.object(Scheduler, 'schedule_jobs_bulk',
+                                  wraps=Scheduler.schedule_jobs_bulk) as schedule_jobs_bulk:
+            Scheduler.register_default_jobs(str(job_dir))
+
+        fingerprints = store.call_args[0][0]
+        self.fingerprints.update(fingerprints)
+        return fingerprints, schedule_jobs_bulk
+
+    def test_register_default_jobs(self, tmpdir):
+        """Test that only new and changed default jobs are registered."""
+        self._write_job(tmpdir, 'job-1')
+        self._write_job(tmpdir, 'job-2')
+        tmpdir.join('.hidden.yaml').write('not a job definition: [')
+        tmpdir.mkdir('subdir')
+
+        registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1', 'job-2'}
+        assert self.scheduler.get_job('job-1').kwargs == {'foo': 'bar'}
+
+        # nothing changed, no job store manipulation
+        registered, schedule_jobs_bulk = self._register(tmpdir)
+        assert registered == {}
+        schedule_jobs_bulk.assert_not_called()
+
+        # paused state set by the administrator is kept if the trigger is not changed
+        self.scheduler.resume_job('job-1')
+        next_run_time = self.scheduler.get_job('job-1').next_run_time
+        self._write_job(tmpdir, 'job-1', foo='baz')
+        registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1'}
+        assert self.scheduler.get_job('job-1').kwargs == {'foo': 'baz'}
+        assert self.scheduler.get_job('job-1').next_run_time == next_run_time
+
+        # trigger change
+        self._write_job(tmpdir, 'job-1', periodically='2 days')
+        self._register(tmpdir)
+        assert self.scheduler.get_job('job-1').trigger.interval.days == 2
+
+    def test_register_default_jobs_options_changed(self, tmpdir):
+        """Test that jobs are registered again once options taken from defaults change."""
+        self._write_job(tmpdir, 'job-1')
+        self._register(tmpdir)
+
+        with mock.patch.object(handlers.ErrorHandler, 'executor', 'processpool', create=True), \
+                mock.patch.dict(Scheduler._EXECUTOR_POOLS, {'processpool': {}}):
+            registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1'}
+
+        with mock.patch('f8a_jobs.defaults.PERIODIC_JOBS_JITTER', '10 minutes'):
+            registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1'}
+
+        with mock.patch('f8a_jobs.defaults.PERIODIC_JOBS_SPREAD', True):
+            registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1'}
+
+    def test_register_default_jobs_removed(self, tmpdir):
+        """Test that removed jobs are registered again even if their definition did not change."""
+        self._write_job(tmpdir, 'job-1')
+        self._register(tmpdir)
+
+        self.scheduler.remove_job('job-1')
+        registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-1'}
+        assert self.scheduler.get_job('job-1') is not None
+
+    def test_register_default_jobs_invalid(self, tmpdir):
+        """Test that an invalid job definition does not block registration of other jobs."""
+        self._write_job(tmpdir, 'job-1', handler='UnknownHandler')
+        self._write_job(tmpdir, 'job-2')
+
+        registered, _ = self._register(tmpdir)
+        assert set(registered.keys()) == {'job-2'}
+        assert self.scheduler.get_job('job-1') is None
+
+
+class TestJobExecute(object):
+    """Tests for the function job_execute()."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.handler = mock.Mock(spec=['retry_policy', 'return_value'])
+        self.handler.retry_policy = mock.Mock()
+        self.handler.retry_policy.should_retry.return_value = True
+        self.handler.retry_policy.get_delay.return_value = 120.0
+        self.handler.return_value.flows_dispatched = {}
+        self.handler.return_value.flow_dispatch_chunks = []
+        self.handler.return_value.flow_dedupe_lookups = {}
+        self.handler.return_value.http_cache_lookups = {}
+        self.patches = [
+            mock.patch('f8a_jobs.scheduler.handlers', mock.Mock(TestHandler=self.handler)),
+            mock.patch('f8a_jobs.scheduler.FailedJob.record')
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown_method(self, method):
+        """Teardown any state that was previously setup with a setup_method call."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_succeeded(self):
+        """Test that successful runs are not retried."""
+        report = job_execute('TestHandler', 'job-1', count=10)
+        self.handler.return_value.execute.assert_called_once_with(count=10)
+        assert report['succeeded'] is True
+        assert report['retry'] is None
+        self.handler.return_value.clear_checkpoint.assert_called_once_with()
+
+    def test_failed_retry(self):
+        """Test that a retry is requested for failed runs based on the handler retry policy."""
+        exc = RuntimeError()
+        self.handler.return_value.execute.side_effect = exc
+        report = job_execute('TestHandler', 'job-1', _attempt=2, count=10)
+
+        assert report['succeeded'] is False
+        assert report['retry'] == {'job_id': 'job-1', 'attempt': 3, 'delay': 120.0,
+                                   'kwargs': {'count': 10}}
+        self.handler.retry_policy.should_retry.assert_called_once_with(exc, 2)
+        self.handler.return_value.clear_checkpoint.assert_not_called()
+
+    def test_attempt_handler_kwarg(self):
+        """Test that handler kwargs named 'attempt' do not collide with the attempt number."""
+        self.handler.return_value.execute.side_effect = RuntimeError()
+        report = job_execute('TestHandler', 'job-1', attempt=5)
+
+        self.handler.return_value.execute.assert_called_once_with(attempt=5)
+        self.handler.retry_policy.should_retry.assert_called_once()
+        assert self.handler.retry_policy.should_retry.call_args[0][1] == 1
+        assert report['retry']['attempt'] == 2
+        assert report['retry']['kwargs'] == {'attempt': 5}
+
+    @mock.patch('f8a_jobs.scheduler.JobCheckpoint.compute_id')
+    def test_retry_checkpoint(self, compute_id):
+        """Test that retries do not resume from checkpoints of the original job."""
+        job_execute('TestHandler', 'job-1', count=10)
+        compute_id.assert_called_once_with('job-1', {'count': 10})
+
+        compute_id.reset_mock()
+        job_execute('TestHandler', 'job-1', _attempt=2, count=10)
+        compute_id.assert_called_once_with('job-1-retry', {'count': 10})
+
+    def test_failed_no_retry(self):
+        """Test that no retry is requested if the retry policy does not allow it."""
+        self.handler.return_value.execute.side_effect = RuntimeError()
+        self.handler.retry_policy.should_retry.return_value = False
+        assert job_execute('TestHandler', 'job-1')['retry'] is None
+
+        self.handler.retry_policy = None
+        assert job_execute('TestHandler', 'job-1')['retry'] is None
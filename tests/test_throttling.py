@@ -0,0 +1,218 @@
+"""Tests for the module 'throttling'."""
+
+import multiprocessing
+from unittest import mock
+
+import pytest
+
+import f8a_jobs.defaults as configuration
+from f8a_jobs.throttling import (TokenBucket, ConcurrencyLimiter, parse_rate_limits,
+                                 parse_concurrency_limits, init_concurrency_limits,
+                                 get_rate_limiter)
+
+
+class _Clock(object):
+    """Fake clock advanced by sleep() calls."""
+
+    def __init__(self):
+        """Construct the clock."""
+        self.now = 1000.0
+
+    def monotonic(self):
+        """Get the current time."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance the clock."""
+        self.now += seconds
+
+
+class TestTokenBucket(object):
+    """Tests for the class TokenBucket."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.clock = _Clock()
+        self.patches = [
+            mock.patch('f8a_jobs.throttling.monotonic', self.clock.monotonic),
+            mock.patch('f8a_jobs.throttling.sleep', self.clock.sleep)
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def teardown_method(self, method):
+        """Tear down any specific state."""
+        for patch in self.patches:
+            patch.stop()
+
+    def test_burst(self):
+        """Test that burst is available immediately, further requests wait for refill."""
+        bucket = TokenBucket('test', rate=2, burst=3)
+        assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert bucket.acquire() == pytest.approx(0.5)
+        assert bucket.acquire() == pytest.approx(0.5)
+
+    def test_refill(self):
+        """Test that tokens are refilled up to burst."""
+        bucket = TokenBucket('test', rate=1, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock.now += 100
+        assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+        assert bucket.acquire() == pytest.approx(1.0)
+
+    @pytest.mark.parametrize(('rate', 'burst'), [(0, 1), (1, 0), (-1, 5)])
+    def test_invalid(self, rate, burst):
+        """Test that invalid rate limiter configuration is reported."""
+        with pytest.raises(ValueError):
+            TokenBucket('test', rate=rate, burst=burst)
+
+    def test_acquire_over_burst(self):
+        """Test that acquiring more tokens than burst fails instead of blocking forever."""
+        with pytest.raises(ValueError):
+            TokenBucket('test', rate=1, burst=2).acquire(3)
+
+
+def _acquire_in_child(bucket, queue):
+    """Acquire a token in a forked process and report the time spent waiting."""
+    queue.put(bucket._take(1))
+
+
+class TestTokenBucketShared(object):
+    """Tests for sharing of TokenBucket state with forked processes."""
+
+    def test_shared_with_forked_process(self):
+        """Test that tokens taken in a forked process are taken from the parent bucket."""
+        bucket = TokenBucket('test', rate=0.001, burst=2)
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        process = context.Process(target=_acquire_in_child, args=(bucket, queue))
+        process.start()
+        process.join()
+
+        assert queue.get() == 0.0
+        assert bucket._take(1) == 0.0
+        assert bucket._take(1) > 0.0
+
+
+class TestParsing(object):
+    """Tests for parsing of limits configuration."""
+
+    def test_parse_rate_limits(self):
+        """Test parsing of rate limiters configuration."""
+        assert parse_rate_limits('api.github.com:0.5:5, localhost:8080:10:20,') == {
+            'api.github.com': (0.5, 5),
+            'localhost:8080': (10.0, 20)
+        }
+
+    def test_parse_rate_limits_invalid(self):
+        """Test that malformed rate limiter definitions are reported."""
+        with pytest.raises(ValueError):
+            parse_rate_limits('api.github.com:fast:5')
+
+    def test_default_rate_limits(self):
+        """Test that rate limiters used by handlers are configured by default."""
+        assert set(parse_rate_limits(configuration.RATE_LIMITS)) >= {
+            'api.github.com', 'github.com', 'go-search.org', 'mvnrepository.com',
+            'skimdb.npmjs.com', 'www.npmjs.com'
+        }
+
+    @mock.patch('f8a_jobs.throttling._MISSING_RATE_LIMITERS', set())
+    @mock.patch('f8a_jobs.throttling.logger')
+    def test_missing_rate_limiter(self, logger):
+        """Test that a rate limiter which is not configured is reported once."""
+        assert get_rate_limiter('www.npmjs.com') is not None
+        assert get_rate_limiter(None) is None
+        logger.warning.assert_not_called()
+
+        for _ in range(2):
+            assert get_rate_limiter('unknown.example.com') is None
+        logger.warning.assert_called_once_with(mock.ANY, 'unknown.example.com')
+
+    def test_parse_concurrency_limits(self):
+        """Test parsing of concurrency limits configuration."""
+        assert parse_concurrency_limits('GitHubMostStarred:1,MavenPopularAnalyses:2') == {
+            'GitHubMostStarred': 1,
+            'MavenPopularAnalyses': 2
+        }
+        assert parse_concurrency_limits('') == {}
+
+    def test_parse_concurrency_limits_invalid(self):
+        """Test that malformed concurrency limit definitions are reported."""
+        with pytest.raises(ValueError):
+            parse_concurrency_limits('GitHubMostStarred')
+
+
+class TestConcurrencyLimits(object):
+    """Tests for per-handler concurrency limits."""
+
+    def setup_method(self, method):
+        """Set up any state tied to the execution of the given method in a class."""
+        self.limiter = ConcurrencyLimiter()
+
+    def test_limits_from_handlers_and_configuration(self):
+        """Test that limits stated by handlers are overridden by configuration."""
+        handlers = {
+            'Limited': mock.Mock(max_concurrency=2),
+            'Overridden': mock.Mock(max_concurrency=5),
+            'Unlimited': mock.Mock(max_concurrency=None)
+        }
+        with mock.patch('f8a_jobs.defaults.CONCURRENCY_LIMITS', 'Overridden:1'):
+            init_concurrency_limits(handlers, self.limiter)
+
+        assert self.limiter.get_limits() == {
+            'Limited': 2,
+            'Overridden': 1
+        }
+
+    def test_invalid_limit(self):
+        """Test that non-positive limits are reported."""
+        with pytest.raises(ValueError):
+            init_concurrency_limits({'Handler': mock.Mock(max_concurrency=0)}, self.limiter)
+
+    def test_submit(self):
+        """Test that jobs over the limit are submitted once a slot is freed."""
+        self.limiter.set_limit('Handler', 1)
+        first, second, deferred = mock.Mock(), mock.Mock(), mock.Mock()
+
+        assert self.limiter.submit('Handler', first)
+        assert not self.limiter.submit('Handler', second, deferred)
+        first.assert_called_once_with()
+        second.assert_not_called()
+        assert self.limiter.waiting('Handler') == 1
+
+        # the slot is handed over to the waiting job
+        self.limiter.release('Handler')
+        deferred.assert_called_once_with()
+        assert self.limiter.waiting('Handler') == 0
+        assert not self.limiter.submit('Handler', mock.Mock())
+
+        self.limiter.release('Handler')
+        self.limiter.release('Handler')
+        assert self.limiter.submit('Handler', mock.Mock())
+
+    def test_submit_error(self):
+        """Test that the slot is released if the job cannot be submitted."""
+        self.limiter.set_limit('Handler', 1)
+        with pytest.raises(RuntimeError):
+            self.limiter.submit('Handler', mock.Mock(side_effect=RuntimeError))
+
+        assert self.limiter.submit('Handler', mock.Mock())
+
+    def test_deferred_submit_error(self):
+        """Test that a waiting job failing to be submitted passes the slot on."""
+        self.limiter.set_limit('Handler', 1)
+        assert self.limiter.submit('Handler', mock.Mock())
+        failing, waiting = mock.Mock(side_effect=RuntimeError), mock.Mock()
+        self.limiter.submit('Handler', failing)
+        self.limiter.submit('Handler', waiting)
+
+        self.limiter.release('Handler')
+        failing.assert_called_once_with()
+        waiting.assert_called_once_with()
+        assert not self.limiter.submit('Handler', mock.Mock())
+
+    def test_unlimited(self):
+        """Test that handlers without limit are not limited."""
+        for _ in range(3):
+            assert self.limiter.submit('Unlimited', mock.Mock())
@@ -0,0 +1,66 @@
+"""Benchmark of HTML extraction done by handlers analysing popular packages.
+
+Pages in the mvnrepository.com format (tests/handlers/data/mvnrepository_pages.json) are padded
+with the given number of unrelated elements, as real pages carry navigation, ads and scripts,
+and versions are extracted from them the same way MavenPopularAnalyses does. Throughput is
+measured with each of the parsers supported by f8a_jobs.handlers.extraction.
+
+Usage:
+python3 benchmark_html_extraction.py [--rounds 20] [--padding 500]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from f8a_jobs.handlers.extraction import parse, BS4, LXML
+from f8a_jobs.handlers.maven_popular_analyses import MavenPopularAnalyses
+
+_PAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests',
+                           'handlers', 'data', 'mvnrepository_pages.json')
+
+_PADDING = '<div class="nav-item"><a href="/link/{idx}">Link {idx}</a><span>{idx}</span></div>'
+
+
+def load_pages(padding):
+    """Load pages and pad them with the given number of unrelated elements."""
+    with open(_PAGES_PATH) as rd:
+        pages = json.load(rd)
+
+    filler = ''.join(_PADDING.format(idx=idx) for idx in range(padding))
+    return [page.replace('<body>', '<body>' + filler, 1) for page in pages.values()]
+
+
+def measure(pages, rounds, backend):
+    """Measure number of pages parsed and extracted per second."""
+    start = time.monotonic()
+    for _ in range(rounds):
+        for page in pages:
+            document = parse(page, backend)
+            MavenPopularAnalyses._find_versions(document)
+            document.find_all('a', class_='im-usage')
+    return rounds * len(pages) / (time.monotonic() - start)
+
+
+def main():
+    """Run the benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='number of times all pages are parsed')
+    parser.add_argument('--padding', type=int, default=500,
+                        help='number of unrelated elements added to each page')
+    args = parser.parse_args()
+
+    pages = load_pages(args.padding)
+    print("Average page size: {:.1f} kB".format(sum(map(len, pages)) / len(pages) / 1024))
+    bs4_throughput = measure(pages, args.rounds, BS4)
+    lxml_throughput = measure(pages, args.rounds, LXML)
+
+    print("BeautifulSoup (html.parser): {:.1f} pages/s".format(bs4_throughput))
+    print("lxml:                        {:.1f} pages/s".format(lxml_throughput))
+    print("Speedup: {:.1f}x".format(lxml_throughput / bs4_throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark of scraping popular projects from mvnrepository.com done by MavenPopularAnalyses.
+
+Pages in the mvnrepository.com format (tests/handlers/data/mvnrepository_pages.json) are served
+by a local HTTP stand-in adding the given latency to each request and to each new connection
+(TCP/TLS handshake). Scraping is measured with a new connection per request and serial
+fetching (as done before artifact pages were fetched concurrently), with a keep-alive session
+and serial fetching, and with a keep-alive session and concurrent fetching.
+
+Usage:
+python3 benchmark_maven_popular_scraping.py [--latency 50] [--connect-latency 100] [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from f8a_jobs.handlers.base import BaseHandler, CountRange
+from f8a_jobs.handlers.maven_popular_analyses import MavenPopularAnalyses
+
+_PAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests',
+                           'handlers', 'data', 'mvnrepository_pages.json')
+
+
+def construct_request_handler(pages, latency, connect_latency):
+    """Construct HTTP request handler serving the given pages."""
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            time.sleep(connect_latency)
+            # headers and body are written separately, do not wait for delayed ACKs
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            super().setup()
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = pages.get(self.path, '<html><body></body></html>').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return RequestHandler
+
+
+def measure(base_url, workers, keep_alive):
+    """Scrape all served projects, return number of seconds spent and projects found."""
+    handler = MavenPopularAnalyses(None)
+    handler._BASE_URL = base_url
+    handler.rate_limiter = None
+    handler.count = CountRange(min=1, max=1000)
+    handler.nversions = 1
+    handler.analyses_selinon_flow = mock.Mock()
+    if not keep_alive:
+        # a new connection for each request
+        handler._get_http_session = lambda: requests
+
+    with mock.patch('f8a_jobs.handlers.base.configuration.HTTP_FETCH_WORKERS', workers):
+        start = time.monotonic()
+        handler._projects_from('/popular')
+        return time.monotonic() - start, handler.nprojects
+
+
+def main():
+    """Run the benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=50,
+                        help='latency of each request in milliseconds')
+    parser.add_argument('--connect-latency', type=float, default=100,
+                        help='latency of each new connection in milliseconds')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of concurrent requests for artifact pages')
+    args = parser.parse_args()
+
+    with open(_PAGES_PATH) as pages_file:
+        pages = json.load(pages_file)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), construct_request_handler(
+        pages, args.latency / 1000, args.connect_latency / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    with mock.patch.object(BaseHandler, '_init_celery'), \
+            mock.patch('f8a_jobs.handlers.base.StoragePool'):
+        for title, workers, keep_alive in (('new connection per request, serial', 1, False),
+                                           ('keep-alive session, serial', 1, True),
+                                           ('keep-alive session, concurrent', args.workers,
+                                            True)):
+            duration, nprojects = measure(base_url, workers, keep_alive)
+            print("{:<40} {:.2f} s ({} projects)".format(title + ':', duration, nprojects))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
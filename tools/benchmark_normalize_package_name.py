@@ -0,0 +1,64 @@
+"""Micro-benchmark of package name normalization done for each dispatched flow.
+
+Ecosystem lookups are replaced by a function simulating a database round trip of the given
+latency, so the benchmark can be run without a database. The per-dispatch latency is measured
+with the ecosystem backend cache invalidated before each dispatch (a lookup for every flow,
+as without the cache) and with the cache in place.
+
+Usage:
+python3 benchmark_normalize_package_name.py [--dispatches 1000] [--latency 1.0]
+"""
+
+import argparse
+import time
+from unittest import mock
+
+from f8a_jobs.handlers.base import BaseHandler, ECOSYSTEM_BACKENDS
+
+
+def simulated_by_name(latency):
+    """Construct Ecosystem.by_name() replacement taking the given number of seconds."""
+    def by_name(session, name):
+        time.sleep(latency)
+        ecosystem = mock.Mock()
+        ecosystem.backend.name = name
+        return ecosystem
+    return by_name
+
+
+def measure(handler, dispatches, cached):
+    """Measure average time spent normalizing package name of a single flow, in seconds."""
+    ECOSYSTEM_BACKENDS.invalidate()
+    start = time.monotonic()
+    for idx in range(dispatches):
+        if not cached:
+            ECOSYSTEM_BACKENDS.invalidate()
+        handler._normalize_package_name({'ecosystem': 'npm', 'name': 'package-{}'.format(idx),
+                                         'version': '1.0.0'})
+    return (time.monotonic() - start) / dispatches
+
+
+def main():
+    """Run the benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dispatches', type=int, default=1000,
+                        help='number of flows to normalize package names for')
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='simulated database round trip in milliseconds')
+    args = parser.parse_args()
+
+    with mock.patch.object(BaseHandler, '_init_celery'), \
+            mock.patch('f8a_jobs.handlers.base.StoragePool'), \
+            mock.patch('f8a_jobs.handlers.base.Ecosystem.by_name',
+                       side_effect=simulated_by_name(args.latency / 1000)):
+        handler = BaseHandler(job_id=None)
+        uncached = measure(handler, args.dispatches, cached=False)
+        cached = measure(handler, args.dispatches, cached=True)
+
+    print("Per-dispatch latency without cache: {:.1f} us".format(uncached * 1e6))
+    print("Per-dispatch latency with cache:    {:.1f} us".format(cached * 1e6))
+    print("Speedup: {:.1f}x".format(uncached / cached))
+
+
+if __name__ == '__main__':
+    main()